@@ -9,6 +9,7 @@ import plotly.graph_objs as go
 import statsmodels.stats.api as sms
 from dash import Input, Output, State, dcc, html
 
+from ..utils.lazy_html import render_html
 from .app import app, global_store
 from .plots import get_figures_single_run
 from .utils import create_table, generate_colors
@@ -340,7 +341,7 @@ def update_details_graph_conv_analysis(subset_name, url, run, day, prompt):
 
     return html.Iframe(
         sandbox="",
-        srcDoc=("".join(h["html_interactions"]).replace("\n", "<br>")),
+        srcDoc=render_html(h["html_interactions"]).replace("\n", "<br>"),
         width="100%",
         height="1000",
     )
@@ -372,7 +373,7 @@ def update_harvesting_prompts(subset_name, url, run, day, persona):
 
     return html.Iframe(
         sandbox="",
-        srcDoc=("".join(h["html_interactions"]).replace("\n", "<br>")),
+        srcDoc=render_html(h["html_interactions"]).replace("\n", "<br>"),
         width="100%",
         height="1000",
     )
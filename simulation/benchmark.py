@@ -0,0 +1,231 @@
+"""
+End-to-end benchmark of the simulation framework with the scripted LLM backend.
+
+Runs full fishing/sheep/pollution simulations on CPU, each in its own process, and
+reports wall time per phase, LLM calls per round and peak RSS:
+
+    python -m simulation.benchmark --output benchmark.json
+    python -m simulation.benchmark --scenarios fishing -- experiment.env.max_num_rounds=3
+    python -m simulation.benchmark -- profiler.enabled=true
+
+Arguments after "--" are hydra overrides applied to every run. With the profiler,
+the results also have the time, LLM calls and tokens of every persona component.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+from hydra import compose, initialize
+from omegaconf import OmegaConf
+
+EXPERIMENTS = {
+    "fishing": "fish_baseline_concurrent",
+    "sheep": "sheep_baseline_concurrent",
+    "pollution": "pollution_baseline_concurrent",
+}
+
+
+class StepTimer:
+    """
+    Attributes the wall time between two env steps, i.e. the decision of the
+    agent plus the step itself, to the phase in which the step happens.
+    """
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self.phases = defaultdict(lambda: {"wall_time_s": 0.0, "steps": 0, "calls": 0})
+        self.rounds = []
+        self.start = time.perf_counter()
+        self.last = None
+        self.last_calls = 0
+        self.round_start = None
+        self.round_calls = 0
+
+    def _num_calls(self) -> int:
+        return sum(self.backend.num_calls.values())
+
+    def wrap(self, step):
+        def timed_step(env, action):
+            phase, num_round = env.phase, env.num_round
+            if self.last is None:
+                # everything before the first step: setup and first decision
+                self.last = self.round_start = self.start
+            res = step(env, action)
+            now = time.perf_counter()
+            calls = self._num_calls()
+            stats = self.phases[phase]
+            stats["wall_time_s"] += now - self.last
+            stats["steps"] += 1
+            stats["calls"] += calls - self.last_calls
+            self.last, self.last_calls = now, calls
+            if env.num_round != num_round:
+                self.rounds.append(
+                    {
+                        "round": num_round,
+                        "wall_time_s": now - self.round_start,
+                        "calls": calls - self.round_calls,
+                    }
+                )
+                self.round_start, self.round_calls = now, calls
+            return res
+
+        return timed_step
+
+
+def run_worker(scenario: str, overrides: list[str], storage: str) -> dict:
+    from transformers import set_seed
+
+    from simulation.main import load_embedding_model
+    from simulation.scenarios.common import ConcurrentEnv, PerturbationEnv
+    from simulation.utils import (
+        ModelWandbWrapper,
+        Profiler,
+        ScriptedModel,
+        WandbLogger,
+    )
+
+    from .scenarios.fishing.run import run as run_scenario_fishing
+    from .scenarios.pollution.run import run as run_scenario_pollution
+    from .scenarios.sheep.run import run as run_scenario_sheep
+
+    OmegaConf.register_new_resolver("uuid", lambda: "benchmark", replace=True)
+    with initialize(version_base=None, config_path="conf"):
+        cfg = compose(
+            config_name="config",
+            overrides=[
+                f"experiment={EXPERIMENTS[scenario]}",
+                "llm.backend=scripted",
+                "debug=true",
+                *overrides,
+            ],
+        )
+    set_seed(cfg.seed)
+
+    model = ScriptedModel.from_config(
+        cfg.seed, OmegaConf.to_container(cfg.llm.scripted)
+    )
+    timer = StepTimer(model.backend)
+    for cls in [ConcurrentEnv, PerturbationEnv]:
+        cls.step = timer.wrap(cls.__dict__["step"])
+
+    logger = WandbLogger(cfg.experiment.name, OmegaConf.to_object(cfg), debug=True)
+    wrapper = ModelWandbWrapper(
+        model,
+        render=cfg.llm.render,
+        wanbd_logger=logger,
+        temperature=cfg.llm.temperature,
+        top_p=cfg.llm.top_p,
+        seed=cfg.seed,
+        is_api=cfg.llm.is_api,
+        log_path=os.path.join(storage, "llm_conversation.txt"),
+        transcript_options=OmegaConf.to_container(cfg.llm.transcript),
+        profiler=Profiler() if cfg.profiler.enabled else None,
+    )
+    embedding_model = load_embedding_model(cfg)
+
+    run_scenario = {
+        "fishing": run_scenario_fishing,
+        "sheep": run_scenario_sheep,
+        "pollution": run_scenario_pollution,
+    }[scenario]
+    run_scenario(cfg.experiment, logger, wrapper, embedding_model, storage)
+    # as in run_experiment, the transcript writes its queued messages here
+    wrapper.transcript.close()
+    logger.close_logs()
+    end = time.perf_counter()
+    if wrapper.num_default_values > 0:
+        # a failed call returns its default value, the run would measure nothing
+        raise RuntimeError(
+            f"{wrapper.num_default_values} LLM calls failed and returned their"
+            " default value"
+        )
+
+    round_calls = [r["calls"] for r in timer.rounds]
+    res = {
+        "scenario": scenario,
+        "wall_time_s": end - timer.start,
+        "after_last_step_s": end - (timer.last or timer.start),
+        "num_rounds": len(timer.rounds),
+        "phases": dict(timer.phases),
+        "rounds": timer.rounds,
+        "calls_per_round": float(np.mean(round_calls)) if round_calls else 0.0,
+        "llm": model.backend.stats(),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if wrapper.profiler is not None:
+        res["profile"] = wrapper.profiler.summary()["components"]
+    return res
+
+
+def run_benchmark(scenarios: list[str], overrides: list[str]) -> list[dict]:
+    """
+    Run every scenario in a fresh process, so that peak RSS is per scenario.
+    """
+    results = []
+    for scenario in scenarios:
+        with tempfile.TemporaryDirectory() as tmp:
+            result_path = os.path.join(tmp, "result.json")
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "simulation.benchmark",
+                    "--worker",
+                    scenario,
+                    "--result",
+                    result_path,
+                    "--",
+                    *overrides,
+                ],
+                check=True,
+            )
+            with open(result_path, "r") as f:
+                results.append(json.load(f))
+    return results
+
+
+def print_report(results: list[dict]):
+    for res in results:
+        print(
+            f"\n{res['scenario']}: {res['wall_time_s']:.1f}s,"
+            f" {res['num_rounds']} rounds, {res['calls_per_round']:.1f} calls/round,"
+            f" peak RSS {res['peak_rss_mb']:.0f} MB"
+        )
+        for phase, stats in res["phases"].items():
+            print(
+                f"  {phase:<24} {stats['wall_time_s']:8.2f}s"
+                f" {stats['steps']:6d} steps {stats['calls']:6d} calls"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scenarios", nargs="+", default=list(EXPERIMENTS), choices=list(EXPERIMENTS)
+    )
+    parser.add_argument("--output", default=None, help="write the results as json")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("overrides", nargs="*")
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        with tempfile.TemporaryDirectory() as storage:
+            result = run_worker(args.worker, args.overrides, storage)
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+    else:
+        results = run_benchmark(args.scenarios, args.overrides)
+        print_report(results)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
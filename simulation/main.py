@@ -10,28 +10,99 @@ from hydra.core.global_hydra import GlobalHydra
 from omegaconf import DictConfig, OmegaConf
 from transformers import set_seed
 
-from simulation.utils import ModelWandbWrapper, WandbLogger
+from simulation.utils import (
+    LLMCache,
+    ModelWandbWrapper,
+    OfflineLogger,
+    Profiler,
+    ScriptedModel,
+    WandbLogger,
+)
 from pathfinder import get_model
 
-from .persona import EmbeddingModel
+from .persona import EmbeddingModel, RemoteEmbeddingModel
+from .scenarios.common import read_checkpoint
 from .scenarios.fishing.run import run as run_scenario_fishing
 from .scenarios.pollution.run import run as run_scenario_pollution
 from .scenarios.sheep.run import run as run_scenario_sheep
 
 
-@hydra.main(version_base=None, config_path="conf", config_name="config")
-def main(cfg: DictConfig):
-    print(OmegaConf.to_yaml(cfg))
+def load_model(cfg: DictConfig):
+    if cfg.llm.backend == "scripted":
+        return ScriptedModel.from_config(
+            cfg.seed, OmegaConf.to_container(cfg.llm.scripted)
+        )
+    return get_model(cfg.llm.path, cfg.llm.is_api, cfg.seed, cfg.llm.backend)
+
+
+def load_embedding_model(cfg: DictConfig, encode_slots=None) -> EmbeddingModel:
+    if cfg.embedding.server is not None:
+        return RemoteEmbeddingModel(
+            cfg.embedding.server, cache_size=cfg.embedding.cache_size
+        )
+    return EmbeddingModel(
+        device="cpu",
+        cache_size=cfg.embedding.cache_size,
+        cache_path=cfg.embedding.cache,
+        encode_slots=encode_slots,
+        backend=cfg.embedding.backend,
+        truncate_dim=cfg.embedding.truncate_dim,
+    )
+
+
+def run_experiment(
+    cfg: DictConfig,
+    model=None,
+    embedding_model: EmbeddingModel = None,
+    hydra_log_path: str = None,
+    llm_log_in_storage: bool = False,
+    llm_slots=None,
+) -> str:
+    """
+    Run one simulation.
+
+    Args:
+        cfg (DictConfig): The composed config.
+        model: LLM backend to use instead of loading the one of cfg.llm.
+        embedding_model (EmbeddingModel): Shared embedding model, e.g. by the runs
+            of a sweep, instead of loading one.
+        hydra_log_path (str): Output dir of hydra, copied to the storage. Without,
+            only the config is written there.
+        llm_log_in_storage (bool): Write the LLM conversation log in the storage
+            instead of output/ in the working directory.
+        llm_slots: Optional semaphore bounding the concurrent LLM calls.
+
+    Returns:
+        str: The experiment storage.
+    """
     set_seed(cfg.seed)
 
-    model = get_model(cfg.llm.path, cfg.llm.is_api, cfg.seed, cfg.llm.backend)
-    logger = WandbLogger(cfg.experiment.name, OmegaConf.to_object(cfg), debug=cfg.debug)
+    if model is None:
+        model = load_model(cfg)
 
-    experiment_storage = os.path.join(
-        os.path.dirname(__file__),
-        f"./results/{cfg.experiment.name}/{logger.run_name}",
+    checkpoint = None
+    if cfg.resume_from is not None:
+        checkpoint = read_checkpoint(cfg.resume_from)
+        if checkpoint is None:
+            raise ValueError(f"No checkpoint to resume in {cfg.resume_from}")
+    logger_cls = OfflineLogger if cfg.logger.backend == "offline" else WandbLogger
+    logger = logger_cls(
+        cfg.experiment.name,
+        OmegaConf.to_object(cfg),
+        debug=cfg.debug,
+        resume_run_id=checkpoint["logger"]["run_id"] if checkpoint else None,
+        max_memory_mb=cfg.logger.max_memory_mb,
+        export_prompts=cfg.logger.export_prompts,
     )
 
+    if checkpoint is not None:
+        experiment_storage = cfg.resume_from
+    else:
+        experiment_storage = os.path.join(
+            os.path.dirname(__file__),
+            f"./results/{cfg.experiment.name}/{logger.run_name}",
+        )
+
     wrapper = ModelWandbWrapper(
         model,
         render=cfg.llm.render,
@@ -40,8 +111,27 @@ def main(cfg: DictConfig):
         top_p=cfg.llm.top_p,
         seed=cfg.seed,
         is_api=cfg.llm.is_api,
+        cache=(
+            LLMCache(cfg.llm.cache, max_size_bytes=cfg.llm.cache_max_size_mb * 1024**2)
+            if cfg.llm.cache is not None
+            else None
+        ),
+        log_path=(
+            os.path.join(experiment_storage, "llm_conversation.txt")
+            if llm_log_in_storage
+            else None
+        ),
+        backend_slots=llm_slots,
+        transcript_options={
+            **OmegaConf.to_container(cfg.llm.transcript),
+            # the transcript of a resumed run is in its storage already
+            "resume": checkpoint is not None,
+        },
+        profiler=Profiler() if cfg.profiler.enabled else None,
     )
-    embedding_model = EmbeddingModel(device="cpu")
+    shared_embedding_model = embedding_model is not None
+    if not shared_embedding_model:
+        embedding_model = load_embedding_model(cfg)
 
     if cfg.experiment.scenario == "fishing":
         run_scenario_fishing(
@@ -50,6 +140,7 @@ def main(cfg: DictConfig):
             wrapper,
             embedding_model,
             experiment_storage,
+            resume=checkpoint is not None,
         )
     elif cfg.experiment.scenario == "sheep":
         run_scenario_sheep(
@@ -58,6 +149,7 @@ def main(cfg: DictConfig):
             wrapper,
             embedding_model,
             experiment_storage,
+            resume=checkpoint is not None,
         )
     elif cfg.experiment.scenario == "pollution":
         run_scenario_pollution(
@@ -66,21 +158,52 @@ def main(cfg: DictConfig):
             wrapper,
             embedding_model,
             experiment_storage,
+            resume=checkpoint is not None,
         )
     else:
         raise ValueError(f"Unknown experiment.scenario: {cfg.experiment.scenario}")
 
+    # the transcript and chain logs of the run are complete once it returns
+    wrapper.transcript.close()
+    logger.close_logs()
+    print(f"Logger memory: {logger.memory_stats()}")
+    if wrapper.profiler is not None:
+        wrapper.profiler.save(experiment_storage)
+        print(f"Profile: {os.path.join(experiment_storage, 'profile.json')}")
+    if wrapper.cache is not None:
+        print(f"LLM cache: {wrapper.cache.stats()}")
+    if not shared_embedding_model:
+        # a shared model is saved by its owner
+        embedding_model.save_cache()
+    print(f"Embedding cache: {embedding_model.cache.stats()}")
+
+    if hydra_log_path is not None:
+        shutil.copytree(
+            f"{hydra_log_path}/.hydra/",
+            f"{experiment_storage}/.hydra/",
+            dirs_exist_ok=True,
+        )
+        shutil.copy(f"{hydra_log_path}/main.log", f"{experiment_storage}/main.log")
+        # shutil.rmtree(hydra_log_path)
+    else:
+        os.makedirs(f"{experiment_storage}/.hydra/", exist_ok=True)
+        OmegaConf.save(cfg, f"{experiment_storage}/.hydra/config.yaml")
+
+    if cfg.logger.backend == "wandb":
+        artifact = wandb.Artifact("hydra", type="log")
+        artifact.add_dir(f"{experiment_storage}/.hydra/")
+        for name in ["config.yaml", "hydra.yaml", "overrides.yaml"]:
+            if os.path.exists(f"{experiment_storage}/.hydra/{name}"):
+                artifact.add_file(f"{experiment_storage}/.hydra/{name}")
+        wandb.run.log_artifact(artifact)
+    return experiment_storage
+
+
+@hydra.main(version_base=None, config_path="conf", config_name="config")
+def main(cfg: DictConfig):
+    print(OmegaConf.to_yaml(cfg))
     hydra_log_path = hydra.core.hydra_config.HydraConfig.get().runtime.output_dir
-    shutil.copytree(f"{hydra_log_path}/.hydra/", f"{experiment_storage}/.hydra/")
-    shutil.copy(f"{hydra_log_path}/main.log", f"{experiment_storage}/main.log")
-    # shutil.rmtree(hydra_log_path)
-
-    artifact = wandb.Artifact("hydra", type="log")
-    artifact.add_dir(f"{experiment_storage}/.hydra/")
-    artifact.add_file(f"{experiment_storage}/.hydra/config.yaml")
-    artifact.add_file(f"{experiment_storage}/.hydra/hydra.yaml")
-    artifact.add_file(f"{experiment_storage}/.hydra/overrides.yaml")
-    wandb.run.log_artifact(artifact)
+    run_experiment(cfg, hydra_log_path=hydra_log_path)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,3 @@
 from .cognition import *
-from .embedding_model import EmbeddingModel
+from .embedding_model import EmbeddingModel, RemoteEmbeddingModel
 from .persona import PersonaAgent
@@ -1,6 +1,6 @@
 import datetime
 
-from simulation.utils import ModelWandbWrapper
+from simulation.utils import ModelWandbWrapper, profiled
 
 from ..common import (
     ChatObservation,
@@ -22,6 +22,7 @@ class PerceiveComponent(Component):
     def init_persona_ref(self, persona):
         self.persona = persona
 
+    @profiled
     def perceive(self, obs: PersonaOberservation):
         self._add_events(obs.events)
 
@@ -1,4 +1,4 @@
-from simulation.utils import ModelWandbWrapper
+from simulation.utils import ModelWandbWrapper, profiled
 
 from ..common import ChatObservation, PersonaIdentity
 from .component import Component
@@ -7,24 +7,33 @@ from .component import Component
 class ReflectComponent(Component):
 
     prompt_insight_and_evidence: callable
+    prompt_insights_single_pass: callable
     prompt_planning_thought_on_conversation: callable
     prompt_memorize_from_conversation: callable
 
-    def __init__(self, model: ModelWandbWrapper):
-        super().__init__(model)
+    def __init__(self, model: ModelWandbWrapper, cfg=None):
+        super().__init__(model, cfg)
 
+    @profiled
     def run(self, focal_points: list[str]):
+        # single_pass: one call per reflection, iterative: one call per insight
+        if self.cfg is not None and self.cfg.insight_generation == "single_pass":
+            prompt_insights = self.prompt_insights_single_pass
+        else:
+            prompt_insights = self.prompt_insight_and_evidence
+
         acc = []
         for focal_point in focal_points:
             retireved_memory = self.persona.retrieve.retrieve([focal_point], 10)
 
-            insights = self.prompt_insight_and_evidence(
+            insights = prompt_insights(
                 self.model, self.persona.identity, retireved_memory
             )
             for insight in insights:
                 self.persona.store.store_thought(insight, self.persona.current_time)
                 acc.append(insight)
 
+    @profiled
     def reflect_on_convesation(self, conversation: list[tuple[str, str]]):
         planning = self.prompt_planning_thought_on_conversation(
             self.model, self.persona.identity, conversation
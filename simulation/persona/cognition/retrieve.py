@@ -2,7 +2,7 @@ from datetime import datetime
 
 import numpy as np
 
-from simulation.utils import ModelWandbWrapper
+from simulation.utils import ModelWandbWrapper, profiled
 
 from ..common import PersonaIdentity
 from ..embedding_model import EmbeddingModel
@@ -47,8 +47,9 @@ class RetrieveComponent(Component):
             "relevance": 2,
         }
         self.recency_decay_param = 0.99
+        self._recency_scores: list[float] = []
 
-    def _recency_retrieval(self, nodes: list[Node]) -> dict[str, float]:
+    def _recency_retrieval(self, nodes: list[Node]) -> np.ndarray:
         """
         Calculate the recency retrieval scores for a list of nodes.
 
@@ -56,60 +57,62 @@ class RetrieveComponent(Component):
             nodes (list[Node]): The list of nodes to calculate recency retrieval scores for.
 
         Returns:
-            dict[str, float]: A dictionary mapping node IDs to their recency retrieval scores.
+            np.ndarray: The recency score of each node, in the order of `nodes`.
         """
-        result = dict()
-        for i, node in enumerate(nodes):
-            result[node.id] = self.recency_decay_param**i
-        return result
+        # cached, and computed with python floats to match the scalar formula
+        for i in range(len(self._recency_scores), len(nodes)):
+            self._recency_scores.append(self.recency_decay_param**i)
+        return np.array(self._recency_scores[: len(nodes)], dtype=np.float64)
 
-    def _importance_retrieval(self, nodes: list[Node]) -> dict[str, float]:
+    def _importance_retrieval(self, rows: np.ndarray) -> np.ndarray:
         """
-        Retrieve the importance scores for a list of nodes and normalize them.
+        Retrieve the importance scores for the given memory rows and normalize them.
 
         Args:
-            nodes (list[Node]): The list of nodes to retrieve importance scores for.
+            rows (np.ndarray): The memory rows of the nodes to retrieve importance scores for.
 
         Returns:
-            dict[str, float]: A dictionary mapping node IDs to their normalized importance scores.
+            np.ndarray: The normalized importance score of each row.
         """
-        result = dict()
-        for node in nodes:
-            result[node.id] = node.importance_score
-
         # normalize
         min_score = 1
         max_score = 10
-        for node_id in result.keys():
-            result[node_id] = (result[node_id] - min_score) / (max_score - min_score)
-
-        return result
+        importance = self.associative_memory.get_importance_vector(rows)
+        return (importance - min_score) / (max_score - min_score)
 
     def _relevance_retrieval(
-        self, nodes: list[Node], focal_point: str
-    ) -> dict[str, float]:
+        self, rows: np.ndarray, focal_points: list[str]
+    ) -> np.ndarray:
         """
-        Retrieves the relevance scores of nodes based on their similarity to the focal point.
+        Retrieves the relevance scores of nodes based on their similarity to the focal points.
 
         Args:
-            nodes (list[Node]): The list of nodes to retrieve relevance scores for.
-            focal_point (str): The focal point used for comparison.
+            rows (np.ndarray): The memory rows of the nodes to retrieve relevance scores for.
+            focal_points (list[str]): The focal points used for comparison.
 
         Returns:
-            dict[str, float]: A dictionary mapping node IDs to their relevance scores.
+            np.ndarray: The cosine similarities, shape (len(focal_points), len(rows)).
         """
+        focal_point_embeddings = self.embedding_model.embed_retrieve_batch(focal_points)
+        return self.associative_memory.get_relevance_matrix(
+            focal_point_embeddings, rows
+        )
 
-        result = dict()
-        focal_point_embedding = self.embedding_model.embed_retrieve(focal_point)
-
-        def cosine_similarity(a, b):
-            return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-        for node in nodes:
-            node_embedding = self.associative_memory.get_node_embedding(node.id)
-            result[node.id] = cosine_similarity(focal_point_embedding, node_embedding)
+    @staticmethod
+    def _top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Indices of the top_k highest scores, in the same order as a stable
+        descending sort would give (ties keep their original order).
 
-        return result
+        Uses a partial selection, so only the k selected entries get sorted.
+        """
+        if top_k <= 0 or top_k >= len(scores):
+            return np.argsort(-scores, kind="stable")[:top_k]
+        kth_score = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+        above = np.flatnonzero(scores > kth_score)
+        ties = np.flatnonzero(scores == kth_score)[: top_k - len(above)]
+        selected = np.sort(np.concatenate([above, ties]))
+        return selected[np.argsort(-scores[selected], kind="stable")]
 
     def _retrieve_dict(
         self, focal_points: list[str], top_k: int
@@ -125,44 +128,41 @@ class RetrieveComponent(Component):
             dict[str, list[Node]]: Dictionary mapping each focal point to a list of top-k nodes.
 
         """
+        # nodes stored since the last retrieval are rated and embedded together here
+        self.persona.store.score_pending()
+        self.associative_memory.embed_pending(self.embedding_model)
+
         nodes = self.associative_memory.get_nodes_for_retrieval(
             self.persona.current_time
         )
+        if len(nodes) == 0 or len(focal_points) == 0:
+            return {focal_point: [] for focal_point in focal_points}
 
-        recency_scores = self._recency_retrieval(nodes)
-        importance_scores = self._importance_retrieval(nodes)
-
-        acc_nodes = dict()
-
-        for focal_point in focal_points:
-            relevance_scores = self._relevance_retrieval(nodes, focal_point)
+        rows = self.associative_memory.get_node_rows(nodes)
+        always_include = self.associative_memory.get_always_include_vector(rows)
 
-            # combine scores
-            combined_scores = dict()
-
-            for node_id in recency_scores.keys():
-                combined_scores[node_id] = (
-                    recency_scores[node_id] * self.weights["recency"]
-                    + importance_scores[node_id] * self.weights["importance"]
-                    + relevance_scores[node_id] * self.weights["relevance"]
-                )
+        recency_scores = self._recency_retrieval(nodes)
+        importance_scores = self._importance_retrieval(rows)
+        relevance_scores = self._relevance_retrieval(rows, focal_points)
 
-            # Put max score to node with always_include flag
-            max_value = max(combined_scores.values()) if combined_scores else 10
-            for node in nodes:
-                if node.always_include:
-                    combined_scores[node.id] = max_value + 1
+        # combine scores, one row per focal point
+        combined_scores = (
+            recency_scores * self.weights["recency"]
+            + importance_scores * self.weights["importance"]
+        ) + relevance_scores.astype(np.float64) * self.weights["relevance"]
 
-            # sort by combined scores
-            sorted_nodes = sorted(
-                nodes, key=lambda node: combined_scores[node.id], reverse=True
-            )
+        # Put max score to node with always_include flag
+        if always_include.any():
+            max_value = combined_scores.max(axis=1, keepdims=True)
+            combined_scores = np.where(always_include, max_value + 1, combined_scores)
 
-            # pick top k
-            top_k_nodes = sorted_nodes[:top_k]
+        acc_nodes = dict()
+        for focal_point, scores in zip(focal_points, combined_scores):
+            top_k_nodes = [nodes[i] for i in self._top_k_indices(scores, top_k)]
             acc_nodes[focal_point] = top_k_nodes
         return acc_nodes
 
+    @profiled
     def retrieve(
         self, focal_points: list[str], top_k: int
     ) -> list[tuple[datetime, str]]:
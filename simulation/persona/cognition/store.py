@@ -1,8 +1,9 @@
 from datetime import datetime, timedelta
+from functools import partial
 
 import numpy as np
 
-from simulation.utils import ModelWandbWrapper
+from simulation.utils import ModelWandbWrapper, profiled
 
 from ..common import PersonaEvent, PersonaIdentity
 from ..embedding_model import EmbeddingModel
@@ -15,6 +16,7 @@ class StoreComponent(Component):
     prompt_importance_chat: callable
     prompt_importance_event: callable
     prompt_importance_action: callable
+    prompt_importance_batch: callable
 
     def __init__(
         self,
@@ -27,39 +29,90 @@ class StoreComponent(Component):
         self.associative_memory = associative_memory
         self.embedding_model = embedding_model
 
-    def _compute_importance(self, node: Node) -> float:
+    def _prompt_importance(self, node: Node) -> int:
         if node.type == NodeType.THOUGHT:
-            score = self.prompt_importance_thought(
+            return self.prompt_importance_thought(
                 self.model, self.persona.identity, node
             )
         elif node.type == NodeType.CHAT:
-            score = self.prompt_importance_chat(self.model, self.persona.identity, node)
+            return self.prompt_importance_chat(
+                self.model, self.persona.identity, node
+            )
         elif node.type == NodeType.EVENT:
-            score = self.prompt_importance_event(
+            return self.prompt_importance_event(
                 self.model, self.persona.identity, node
             )
         elif node.type == NodeType.ACTION:
-            score = self.prompt_importance_action(
+            return self.prompt_importance_action(
                 self.model, self.persona.identity, node
             )
         else:
             raise ValueError(f"Unknown node type: {node.type}")
-        node.importance_score = score
 
+    def _compute_importance(self, node: Node):
+        if self.cfg.importance_scoring != "per_node":
+            # rated together with the other new nodes before the next retrieval
+            self.associative_memory.defer_node_importance(node.id)
+            return
+        score = self._prompt_importance(node)
+        self.associative_memory.set_node_importance(node.id, score)
+
+    @profiled
+    def score_pending(self):
+        """
+        Rate the importance of all queued nodes, as one parallel batch of the
+        per-node prompts or with a single prompt rating all of them.
+        """
+        nodes = self.associative_memory.pop_pending_importance()
+        if len(nodes) == 0:
+            return
+        if self.cfg.importance_scoring == "batch_prompt":
+            scores = self.prompt_importance_batch(
+                self.model, self.persona.identity, nodes
+            )
+        else:
+            scores = self.model.run_parallel(
+                [partial(self._prompt_importance, node) for node in nodes]
+            )
+        for node, score in zip(nodes, scores):
+            self.associative_memory.set_node_importance(node.id, score)
+
+    def _embed(self, node: Node):
+        shared_event = node.shared_event
+        if shared_event is not None and shared_event.embedding is not None:
+            self.associative_memory.set_node_embedding(node.id, shared_event.embedding)
+        elif self.cfg.deferred_embedding:
+            # embedded in a batch right before the next retrieval
+            self.associative_memory.defer_node_embedding(node.id)
+        else:
+            embedding = self.embedding_model.embed(node.description)
+            self.associative_memory.set_node_embedding(node.id, embedding)
+
+    @profiled
+    def embed_pending(self):
+        self.associative_memory.embed_pending(self.embedding_model)
+
+    @profiled
     def store_event(self, event: PersonaEvent):
         # s, p, o = prompt_text_to_triple(self.model, event.description)
         s, p, o = (None, None, None)
         node = self.associative_memory.add_event(
-            s, p, o, event.description, event.created, event.expiration
+            s,
+            p,
+            o,
+            event.description,
+            event.created,
+            event.expiration,
+            shared=event.broadcast,
         )
         if event.always_include:
-            node.importance_score = 10
+            self.associative_memory.set_node_importance(node.id, 10)
             node.always_include = True
         else:
             self._compute_importance(node)
-        embedding = self.embedding_model.embed(event.description)
-        self.associative_memory.set_node_embedding(node.id, embedding)
+        self._embed(node)
 
+    @profiled
     def store_chat(
         self,
         summary: str,
@@ -76,9 +129,9 @@ class StoreComponent(Component):
             s, p, o, summary, conversation, created, expiration
         )
         self._compute_importance(node)
-        embedding = self.embedding_model.embed(summary)
-        self.associative_memory.set_node_embedding(node.id, embedding)
+        self._embed(node)
 
+    @profiled
     def store_action(
         self,
         description: str,
@@ -94,9 +147,9 @@ class StoreComponent(Component):
             s, p, o, description, created, expiration
         )
         self._compute_importance(node)
-        embedding = self.embedding_model.embed(description)
-        self.associative_memory.set_node_embedding(node.id, embedding)
+        self._embed(node)
 
+    @profiled
     def store_thought(
         self,
         description: str,
@@ -113,9 +166,8 @@ class StoreComponent(Component):
             s, p, o, description, created, expiration
         )
         if always_include:
-            node.importance_score = 10
+            self.associative_memory.set_node_importance(node.id, 10)
             node.always_include = True
         else:
             self._compute_importance(node)
-        embedding = self.embedding_model.embed(description)
-        self.associative_memory.set_node_embedding(node.id, embedding)
+        self._embed(node)
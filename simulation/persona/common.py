@@ -9,7 +9,13 @@ class PersonaIdentity:
         goals: str = None,
         behavior: str = None,
         customs: str = None,
+        community: list[str] = None,
     ) -> None:
+        """
+        Args:
+            community (list[str]): Names of all the personas of the run, this one
+                included, as told in the system prompt.
+        """
         self.agent_id = agent_id
         self.name = name
         self.age = age
@@ -18,6 +24,7 @@ class PersonaIdentity:
         self.goals = goals
         self.behavior = behavior
         self.customs = customs
+        self.community = community
 
     def get_identiy_stable_set(self) -> str:
         # Before we also used: lm += f"Here is a brief description of {persona.name}."
@@ -143,6 +150,7 @@ class PersonaEvent:
     created: datetime
     expiration: datetime
     always_include: bool
+    broadcast: bool  # the same event is given to several personas
 
     def __init__(
         self,
@@ -150,8 +158,10 @@ class PersonaEvent:
         created: datetime,
         expiration: datetime,
         always_include: bool = False,
+        broadcast: bool = False,
     ) -> None:
         self.description = description
         self.created = created
         self.expiration = expiration
         self.always_include = always_include
+        self.broadcast = broadcast
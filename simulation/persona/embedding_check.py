@@ -0,0 +1,204 @@
+"""
+Benchmark of the embedding backends and agreement of their retrievals with the fp32
+model, on the memories recorded by previous runs:
+
+    python -m simulation.persona.embedding_check simulation/results/fishing_v6.4
+    python -m simulation.persona.embedding_check <runs> --candidates int8 onnx:512
+
+A candidate is "<backend>" or "<backend>:<truncate_dim>". For every persona, the
+descriptions of its memories are used both as documents and, with the query
+prefix, as focal points; agreement is the overlap of the top-k memories by cosine
+similarity with those of the fp32 model (1.0 when they are the same), i.e. the
+relevance part of the retrieval score. The memory a focal point was taken from is
+left out of its top-k, as both models would trivially rank it first. Latency is
+measured without cache.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from .embedding_model import EmbeddingModel
+
+
+def load_recorded_memories(paths: list[str]) -> list[list[str]]:
+    """
+    Returns:
+        list[list[str]]: The node descriptions of each persona memory (nodes.json)
+        found under paths.
+    """
+    memories = []
+    for path in paths:
+        for root, _, files in sorted(os.walk(path)):
+            if "nodes.json" not in files:
+                continue
+            with open(os.path.join(root, "nodes.json"), "r") as f:
+                nodes = json.load(f)
+            descriptions = [node["description"] for node in nodes]
+            if len(descriptions) > 0:
+                memories.append(descriptions)
+    return memories
+
+
+def parse_candidate(candidate: str) -> tuple[str, int]:
+    backend, _, truncate_dim = candidate.partition(":")
+    return backend, int(truncate_dim) if truncate_dim else None
+
+
+def top_k(documents: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: The indices of the k documents most similar to each query,
+        without document i for query i, which is its own text.
+    """
+
+    def normalize(x):
+        norms = np.linalg.norm(x, axis=1, keepdims=True)
+        return x / np.where(norms > 0, norms, 1)
+
+    scores = normalize(queries) @ normalize(documents).T
+    own = np.arange(queries.shape[0])
+    scores[own, own] = -np.inf
+    k = min(k, documents.shape[0] - 1)
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+
+def embed_memories(
+    embedding_model: EmbeddingModel, memories: list[list[str]], num_queries: int
+) -> tuple[list[tuple[np.ndarray, np.ndarray]], dict]:
+    embeddings = []
+    num_texts = 0
+    start = time.perf_counter()
+    for descriptions in memories:
+        documents = embedding_model.embed_batch(descriptions)
+        queries = embedding_model.embed_retrieve_batch(descriptions[:num_queries])
+        embeddings.append((documents, queries))
+        num_texts += len(descriptions) + len(descriptions[:num_queries])
+    elapsed = time.perf_counter() - start
+
+    # one forward pass per text, as for the focal points of a retrieval
+    texts = [text for descriptions in memories for text in descriptions][:num_queries]
+    latencies = []
+    for text in texts:
+        start_single = time.perf_counter()
+        embedding_model.embed_retrieve(text)
+        latencies.append(time.perf_counter() - start_single)
+
+    stats = {
+        "dim": int(embeddings[0][0].shape[1]),
+        "texts_per_s": num_texts / elapsed if elapsed > 0 else 0.0,
+        "single_latency_ms": float(np.median(latencies) * 1000) if latencies else 0.0,
+    }
+    return embeddings, stats
+
+
+def agreement(
+    reference: list[tuple[np.ndarray, np.ndarray]],
+    candidate: list[tuple[np.ndarray, np.ndarray]],
+    k: int,
+) -> dict:
+    overlaps = []
+    for (ref_docs, ref_queries), (docs, queries) in zip(reference, candidate):
+        if ref_docs.shape[0] < 2:
+            # nothing to retrieve besides the memory of the focal point
+            continue
+        ref_top = top_k(ref_docs, ref_queries, k)
+        cand_top = top_k(docs, queries, k)
+        for ref_row, cand_row in zip(ref_top, cand_top):
+            overlaps.append(len(set(ref_row) & set(cand_row)) / len(ref_row))
+    return {
+        f"overlap@{k}": float(np.mean(overlaps)),
+        f"min_overlap@{k}": float(np.min(overlaps)),
+    }
+
+
+def run_check(
+    memories: list[list[str]],
+    candidates: list[str],
+    k: int = 10,
+    num_queries: int = 50,
+    device: str = "cpu",
+) -> list[dict]:
+    def load(backend, truncate_dim):
+        start = time.perf_counter()
+        embedding_model = EmbeddingModel(
+            device=device, cache_size=0, backend=backend, truncate_dim=truncate_dim
+        )
+        return embedding_model, time.perf_counter() - start
+
+    embedding_model, load_time = load("torch", None)
+    reference, stats = embed_memories(embedding_model, memories, num_queries)
+    del embedding_model
+    results = [{"candidate": "torch", "load_time_s": load_time, **stats}]
+
+    for candidate in candidates:
+        res = {"candidate": candidate}
+        try:
+            embedding_model, res["load_time_s"] = load(*parse_candidate(candidate))
+            embeddings, stats = embed_memories(embedding_model, memories, num_queries)
+            del embedding_model
+        except Exception as e:
+            # e.g. onnx without optimum installed
+            res["error"] = f"{type(e).__name__}: {e}"
+            results.append(res)
+            continue
+        res.update(stats)
+        res["speedup"] = res["texts_per_s"] / results[0]["texts_per_s"]
+        res.update(agreement(reference, embeddings, k))
+        results.append(res)
+    return results
+
+
+def print_report(results: list[dict]):
+    for res in results:
+        if "error" in res:
+            print(f"{res['candidate']:<12} failed: {res['error']}")
+            continue
+        line = (
+            f"{res['candidate']:<12} dim {res['dim']:5d}"
+            f" {res['texts_per_s']:8.1f} texts/s"
+            f" {res['single_latency_ms']:7.1f} ms/query"
+            f" load {res['load_time_s']:5.1f}s"
+        )
+        overlaps = [f"{key} {value:.3f}" for key, value in res.items() if "@" in key]
+        if overlaps:
+            line += f" speedup {res['speedup']:.2f}x " + " ".join(overlaps)
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "paths", nargs="+", help="experiment storages or results folders of runs"
+    )
+    parser.add_argument(
+        "--candidates",
+        nargs="+",
+        default=["int8", "onnx", "torch:512", "torch:256", "int8:512"],
+        help="<backend> or <backend>:<truncate_dim>, compared with the fp32 model",
+    )
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--num-queries", type=int, default=50, help="focal points per persona"
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--output", default=None, help="write the results as json")
+    args = parser.parse_args()
+
+    memories = load_recorded_memories(args.paths)
+    if len(memories) == 0:
+        parser.error(f"No nodes.json found in {args.paths}")
+    print(
+        f"{len(memories)} memories, {sum(len(m) for m in memories)} nodes,"
+        f" top-{args.k} agreement with the fp32 model"
+    )
+    results = run_check(
+        memories, args.candidates, args.k, args.num_queries, args.device
+    )
+    print_report(results)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,22 +1,281 @@
+import contextlib
+import http.client
+import json
+import os
+import threading
+import urllib.parse
+from collections import OrderedDict
+
 import numpy as np
 
 # Implemented using this: https://huggingface.co/mixedbread-ai/mxbai-embed-large-v1
 from sentence_transformers import SentenceTransformer
 
+from simulation.utils.profiler import record_embedding
 
-class EmbeddingModel:
-    def __init__(self, device) -> None:
-        self.model = SentenceTransformer(
-            "mixedbread-ai/mxbai-embed-large-v1", device=device
+MODEL_NAME = "mixedbread-ai/mxbai-embed-large-v1"
+RETRIEVE_PREFIX = "Represent this sentence for searching relevant passages: "
+
+
+class EmbeddingCache:
+    """
+    LRU cache of embeddings keyed by (mode, text), where mode is "document" for
+    stored memories and "query" for retrieval focal points.
+
+    Can be saved to and loaded from a .npz file to be reused across runs.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mode: str, text: str) -> np.ndarray:
+        with self._lock:
+            vec = self._entries.get((mode, text))
+            if vec is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end((mode, text))
+            return vec
+
+    def put(self, mode: str, text: str, vec: np.ndarray):
+        if self.max_entries <= 0:
+            return
+        vec = np.array(vec, dtype=np.float32)
+        vec.setflags(write=False)  # shared between personas
+        with self._lock:
+            self._entries[(mode, text)] = vec
+            self._entries.move_to_end((mode, text))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+        }
+
+    def save(self, path: str, model_name: str):
+        with self._lock:
+            keys = list(self._entries.keys())
+            vecs = list(self._entries.values())
+        if len(keys) == 0:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path,
+            model=np.array(model_name),
+            modes=np.array([mode for mode, _ in keys]),
+            texts=np.array([text for _, text in keys]),
+            embeddings=np.stack(vecs),
         )
 
+    def load(self, path: str, model_name: str):
+        data = np.load(path)
+        if str(data["model"]) != model_name:
+            return
+        for mode, text, vec in zip(
+            data["modes"].tolist(), data["texts"].tolist(), data["embeddings"]
+        ):
+            self.put(mode, text, vec)
+
+
+BACKENDS = ["torch", "int8", "onnx"]
+
+
+def model_id(backend: str = "torch", truncate_dim: int = None) -> str:
+    """
+    Identifies the embeddings produced by a backend, e.g. in saved caches.
+    """
+    res = MODEL_NAME if backend == "torch" else f"{MODEL_NAME}:{backend}"
+    if truncate_dim is not None:
+        res = f"{res}:{truncate_dim}"
+    return res
+
+
+def load_sentence_transformer(device, backend: str = "torch") -> SentenceTransformer:
+    """
+    Args:
+        backend: "torch" for the fp32 model, "int8" for its linear layers
+            dynamically quantized to int8 (CPU only), "onnx" for ONNX Runtime
+            (needs sentence_transformers>=3.2 and optimum[onnxruntime]).
+    """
+    if backend == "torch":
+        return SentenceTransformer(MODEL_NAME, device=device)
+    elif backend == "int8":
+        if device != "cpu":
+            raise ValueError("The int8 embedding backend only runs on cpu")
+        import torch
+
+        model = SentenceTransformer(MODEL_NAME, device="cpu")
+        torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+        return model
+    elif backend == "onnx":
+        return SentenceTransformer(MODEL_NAME, device=device, backend="onnx")
+    else:
+        raise ValueError(f"Unknown embedding backend {backend}, expected {BACKENDS}")
+
+
+class EmbeddingModel:
+    def __init__(
+        self,
+        device,
+        batch_size: int = 32,
+        cache_size: int = 10000,
+        cache_path: str = None,
+        encode_slots=None,
+        backend: str = "torch",
+        truncate_dim: int = None,
+    ) -> None:
+        """
+        Args:
+            encode_slots: Optional semaphore bounding the number of concurrent
+                forward passes, e.g. shared by the runs of a sweep.
+            backend: See load_sentence_transformer.
+            truncate_dim: Keep only the first truncate_dim dimensions of each
+                embedding, the model is trained for it (Matryoshka). Similarities
+                are cosine, so the truncated vectors are not renormalized.
+        """
+        self.model = load_sentence_transformer(device, backend)
+
         self.device = device
+        self.batch_size = batch_size
+        self.encode_slots = encode_slots
+        self.backend = backend
+        self.truncate_dim = truncate_dim
+        self.model_id = model_id(backend, truncate_dim)
+
+        # shared by all personas using this model
+        self.cache = EmbeddingCache(cache_size)
+        self.cache_path = cache_path
+        if cache_path is not None and os.path.exists(cache_path):
+            self.cache.load(cache_path, self.model_id)
+
+    def save_cache(self):
+        if self.cache_path is not None:
+            self.cache.save(self.cache_path, self.model_id)
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        with self.encode_slots or contextlib.nullcontext():
+            embeddings = self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+        if self.truncate_dim is not None:
+            embeddings = np.ascontiguousarray(embeddings[:, : self.truncate_dim])
+        return embeddings
+
+    def _dimension(self) -> int:
+        dim = self.model.get_sentence_embedding_dimension()
+        if self.truncate_dim is not None:
+            dim = min(dim, self.truncate_dim)
+        return dim
+
+    def _embed_cached(self, texts: list[str], mode: str) -> np.ndarray:
+        if len(texts) == 0:
+            return np.zeros((0, self._dimension()), dtype=np.float32)
+        prefix = RETRIEVE_PREFIX if mode == "query" else ""
+
+        res = [self.cache.get(mode, text) for text in texts]
+        missing = list(dict.fromkeys(t for t, vec in zip(texts, res) if vec is None))
+        if len(missing) > 0:
+            computed = dict(
+                zip(missing, self._encode([f"{prefix}{text}" for text in missing]))
+            )
+            for text, vec in computed.items():
+                self.cache.put(mode, text, vec)
+            res = [computed[t] if vec is None else vec for t, vec in zip(texts, res)]
+        record_embedding(len(texts), len(missing))
+        return np.stack(res)
 
     def embed(self, text: str) -> np.ndarray:
-        vec = self.model.encode(text, convert_to_numpy=True, show_progress_bar=False)
-        return vec.squeeze()
+        return self._embed_cached([text], "document")[0]
 
     def embed_retrieve(self, text: str) -> np.ndarray:
-        return self.embed(
-            f"Represent this sentence for searching relevant passages: {text}"
+        return self._embed_cached([text], "query")[0]
+
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        """
+        Embed several texts with batched forward passes.
+
+        Returns:
+            np.ndarray: One embedding per text, shape (len(texts), dim).
+        """
+        return self._embed_cached(list(texts), "document")
+
+    def embed_retrieve_batch(self, texts: list[str]) -> np.ndarray:
+        return self._embed_cached(list(texts), "query")
+
+
+class RemoteEmbeddingModel(EmbeddingModel):
+    """
+    Client of a local embedding server (see embedding_server), with the interface
+    of EmbeddingModel, so that the simulations on one machine share one model.
+
+    Keeps its own cache, so that repeated texts are not sent again.
+    """
+
+    def __init__(self, url: str, cache_size: int = 10000, timeout: float = 60.0):
+        parsed = urllib.parse.urlsplit(url)
+        self.url = url
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self._local = threading.local()  # one keep-alive connection per thread
+        self._dim = None
+
+        self.cache = EmbeddingCache(cache_size)
+        self.cache_path = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method: str, path: str, body: bytes = None):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # the server may have closed the idle connection, reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt > 0:
+                    raise
+                continue
+            if response.status != 200:
+                raise RuntimeError(
+                    f"Embedding server {self.url} returned {response.status}: {data!r}"
+                )
+            return response, data
+
+    def _dimension(self) -> int:
+        if self._dim is None:
+            _, data = self._request("GET", "/info")
+            self._dim = json.loads(data)["dim"]
+        return self._dim
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        response, data = self._request(
+            "POST", "/encode", json.dumps({"texts": texts}).encode("utf-8")
         )
+        shape = [int(n) for n in response.getheader("X-Embedding-Shape").split(",")]
+        return np.frombuffer(data, dtype=np.float32).reshape(shape)
@@ -0,0 +1,201 @@
+"""
+Local embedding service, so that the simulations running on one machine share a
+single copy of the embedding model:
+
+    python -m simulation.persona.embedding_server --port 8765
+
+and run the simulations with embedding.server=http://127.0.0.1:8765, see
+RemoteEmbeddingModel.
+
+Requests of all clients arriving within --window-ms of each other are coalesced
+into one forward pass of up to --max-batch texts.
+
+Protocol, over HTTP on loopback:
+- GET /info: {"model": ..., "dim": ...}
+- POST /encode with {"texts": [...]}: float32 rows as raw bytes, the shape in the
+  X-Embedding-Shape header. Texts are encoded as given, query prefixes are added
+  by the client.
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from .embedding_model import BACKENDS, EmbeddingModel
+
+
+class MicroBatcher:
+    """
+    Collects the texts of concurrent requests and encodes them together.
+    """
+
+    def __init__(
+        self, embedding_model: EmbeddingModel, window_ms: float, max_batch: int
+    ) -> None:
+        self.embedding_model = embedding_model
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self._queue: queue.Queue[tuple[list[str], Future]] = queue.Queue()
+        self.num_requests = 0
+        self.num_batches = 0
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: list[str]) -> Future:
+        future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def _collect(self) -> list[tuple[list[str], Future]]:
+        requests = [self._queue.get()]
+        num_texts = len(requests[0][0])
+        deadline = time.monotonic() + self.window_ms / 1000
+        while num_texts < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            num_texts += len(request[0])
+        return requests
+
+    def _loop(self):
+        while True:
+            requests = self._collect()
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            try:
+                embeddings = self.embedding_model.embed_batch(texts)
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            self.num_requests += len(requests)
+            self.num_batches += 1
+            start = 0
+            for request_texts, future in requests:
+                future.set_result(embeddings[start : start + len(request_texts)])
+                start += len(request_texts)
+
+
+def make_handler(batcher: MicroBatcher):
+    embedding_model = batcher.embedding_model
+    dim = embedding_model._dimension()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def _send(self, code: int, body: bytes, content_type: str, headers={}):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, code: int, data: dict):
+            self._send(code, json.dumps(data).encode("utf-8"), "application/json")
+
+        def do_GET(self):
+            if self.path != "/info":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            self._send_json(
+                200,
+                {
+                    "model": embedding_model.model_id,
+                    "dim": dim,
+                    "requests": batcher.num_requests,
+                    "batches": batcher.num_batches,
+                    "cache": embedding_model.cache.stats(),
+                },
+            )
+
+        def do_POST(self):
+            if self.path != "/encode":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            texts = json.loads(self.rfile.read(length))["texts"]
+            try:
+                embeddings = batcher.submit(texts).result()
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            self._send(
+                200,
+                embeddings.tobytes(),
+                "application/octet-stream",
+                {"X-Embedding-Shape": f"{embeddings.shape[0]},{embeddings.shape[1]}"},
+            )
+
+        def log_message(self, format, *args):
+            pass  # one line per request is too verbose
+
+    return Handler
+
+
+def serve(
+    host: str,
+    port: int,
+    window_ms: float,
+    max_batch: int,
+    device: str = "cpu",
+    cache_size: int = 10000,
+    cache_path: str = None,
+    backend: str = "torch",
+    truncate_dim: int = None,
+):
+    embedding_model = EmbeddingModel(
+        device=device,
+        batch_size=max_batch,
+        cache_size=cache_size,
+        cache_path=cache_path,
+        backend=backend,
+        truncate_dim=truncate_dim,
+    )
+    batcher = MicroBatcher(embedding_model, window_ms, max_batch)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    print(f"Embedding server on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        embedding_model.save_cache()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--cache", default=None, help=".npz file of the cache")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    parser.add_argument("--truncate-dim", type=int, default=None)
+    args = parser.parse_args()
+    serve(
+        args.host,
+        args.port,
+        args.window_ms,
+        args.max_batch,
+        args.device,
+        args.cache_size,
+        args.cache,
+        args.backend,
+        args.truncate_dim,
+    )
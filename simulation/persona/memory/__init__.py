@@ -1,2 +1,4 @@
 from .associative_memory import AssociativeMemory
+from .embedding_file import EmbeddingFile
 from .scratch import Scratch
+from .shared_event_store import SharedEvent, SharedEventStore
@@ -1,11 +1,19 @@
+import heapq
 import json
 import os
+import sys
 import typing
 from datetime import datetime
 from enum import Enum
 
 import numpy as np
 
+from .embedding_file import EmbeddingFile
+
+if typing.TYPE_CHECKING:
+    from ..embedding_model import EmbeddingModel
+    from .shared_event_store import SharedEvent, SharedEventStore
+
 
 class NodeType(Enum):
     CHAT = 1
@@ -17,49 +25,109 @@ class NodeType(Enum):
         return self.name
 
 
+def _to_us(time: datetime) -> int:
+    """
+    Simulated time as integer microseconds, as stored in the node table.
+    """
+    return int(np.datetime64(time, "us").astype(np.int64))
+
+
+def _intern(text: str) -> str:
+    # subjects, predicates and broadcast descriptions repeat across nodes
+    return sys.intern(text) if text is not None else None
+
+
 class Node:
+    """
+    View of one row of the node table of an AssociativeMemory.
+
+    Only holds the memory and the node id, the attributes are read from (and
+    written to) the columns of the memory. Views are created on access, two views
+    of the same node are equal.
+    """
+
+    __slots__ = ("memory", "id")
+
+    memory: "AssociativeMemory"
     id: int
-    type: NodeType
 
-    subject: str
-    predicate: str
-    object: str
+    def __init__(self, memory: "AssociativeMemory", id: int) -> None:
+        self.memory = memory
+        self.id = id
 
-    description: str
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, Node)
+            and self.memory is other.memory
+            and self.id == other.id
+        )
 
-    importance_score: float
+    def __hash__(self) -> int:
+        return hash(self.id)
 
-    created: datetime
-    expiration: datetime
+    @property
+    def type(self) -> NodeType:
+        return NodeType(int(self.memory._types[self.id - 1]))
 
-    always_include: bool
+    @property
+    def subject(self) -> str:
+        return self.memory._subjects[self.id - 1]
 
-    def __init__(
-        self,
-        id: int,
-        type: NodeType,
-        subject: str,
-        predicate: str,
-        object: str,
-        description: str,
-        created: datetime,
-        expiration: datetime,
-        always_include: bool = False,
-    ) -> None:
-        self.id = id
-        self.type = type
-        self.subject = subject
-        self.predicate = predicate
-        self.object = object
-        self.description = description
-        self.created = created
-        self.expiration = expiration
-        self.always_include = always_include
+    @property
+    def predicate(self) -> str:
+        return self.memory._predicates[self.id - 1]
+
+    @property
+    def object(self) -> str:
+        return self.memory._objects[self.id - 1]
+
+    @property
+    def description(self) -> str:
+        return self.memory._descriptions[self.id - 1]
+
+    @description.setter
+    def description(self, description: str):
+        self.memory._descriptions[self.id - 1] = _intern(description)
+
+    @property
+    def importance_score(self) -> float:
+        return float(self.memory._importance[self.id - 1])
+
+    @importance_score.setter
+    def importance_score(self, importance_score: float):
+        self.memory.set_node_importance(self.id, importance_score)
+
+    @property
+    def created(self) -> datetime:
+        return self.memory._created[self.id - 1].item()
+
+    @property
+    def expiration(self) -> datetime:
+        return self.memory._expiration[self.id - 1].item()
+
+    @property
+    def always_include(self) -> bool:
+        return bool(self.memory._always_include[self.id - 1])
+
+    @always_include.setter
+    def always_include(self, always_include: bool):
+        self.memory._always_include[self.id - 1] = always_include
+
+    @property
+    def shared_event(self) -> "SharedEvent":
+        """
+        Set for events broadcast to several personas, see SharedEventStore.
+        """
+        return self.memory._shared_events.get(self.id)
 
     def __str__(self) -> str:
         return f"{self.subject} {self.predicate} {self.object}"
 
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(id={self.id}, description={self.description!r})"
+
     def toJSON(self):
+        shared_event = self.shared_event
         return {
             "id": self.id,
             "type": self.type.toJSON(),
@@ -71,62 +139,27 @@ class Node:
             "created": self.created.strftime("%Y-%m-%d %H:%M:%S"),
             "expiration": self.expiration.strftime("%Y-%m-%d %H:%M:%S"),
             "always_include": "true" if self.always_include else "false",
+            "shared_event_id": shared_event.id if shared_event is not None else None,
         }
 
 
 class Thought(Node):
-    def __init__(
-        self,
-        id: int,
-        subject: str,
-        predicate: str,
-        object: str,
-        description: str,
-        created: datetime,
-        expiration: datetime,
-        always_include: bool = False,
-    ) -> None:
-        super().__init__(
-            id,
-            NodeType.THOUGHT,
-            subject,
-            predicate,
-            object,
-            description,
-            created,
-            expiration,
-            always_include,
-        )
+    __slots__ = ()
 
 
 class Chat(Node):
-    conversation: list[tuple[str, str]]
+    __slots__ = ()
 
-    def __init__(
-        self,
-        id: int,
-        subject: str,
-        predicate: str,
-        object: str,
-        description: str,
-        created: datetime,
-        expiration: datetime,
-        always_include: bool = False,
-    ) -> None:
-        self.conversation = []
-        super().__init__(
-            id,
-            NodeType.CHAT,
-            subject,
-            predicate,
-            object,
-            description,
-            created,
-            expiration,
-            always_include,
-        )
+    @property
+    def conversation(self) -> list[tuple[str, str]]:
+        return self.memory._conversations[self.id]
+
+    @conversation.setter
+    def conversation(self, conversation: list[tuple[str, str]]):
+        self.memory._conversations[self.id] = conversation
 
     def toJSON(self):
+        shared_event = self.shared_event
         return {
             "id": self.id,
             "type": self.type.toJSON(),
@@ -139,60 +172,24 @@ class Chat(Node):
             "created": self.created.strftime("%Y-%m-%d %H:%M:%S"),
             "expiration": self.expiration.strftime("%Y-%m-%d %H:%M:%S"),
             "always_include": "true" if self.always_include else "false",
+            "shared_event_id": shared_event.id if shared_event is not None else None,
         }
 
 
 class Event(Node):
-    def __init__(
-        self,
-        id: int,
-        subject: str,
-        predicate: str,
-        object: str,
-        description: str,
-        created: datetime,
-        expiration: datetime,
-        always_include: bool = False,
-    ) -> None:
-        super().__init__(
-            id,
-            NodeType.EVENT,
-            subject,
-            predicate,
-            object,
-            description,
-            created,
-            expiration,
-            always_include,
-        )
+    __slots__ = ()
 
 
 class Action(Node):
-    def __init__(
-        self,
-        id: int,
-        subject: str,
-        predicate: str,
-        object: str,
-        description: str,
-        created: datetime,
-        expiration: datetime,
-        always_include: bool = False,
-    ) -> None:
-        super().__init__(
-            id,
-            NodeType.ACTION,
-            subject,
-            predicate,
-            object,
-            description,
-            created,
-            expiration,
-            always_include,
-        )
+    __slots__ = ()
 
 
-import os
+VIEW_CLASSES = {
+    NodeType.CHAT.value: Chat,
+    NodeType.THOUGHT.value: Thought,
+    NodeType.EVENT.value: Event,
+    NodeType.ACTION.value: Action,
+}
 
 
 class NumpyEncoder(json.JSONEncoder):
@@ -203,80 +200,215 @@ class NumpyEncoder(json.JSONEncoder):
 
 
 class AssociativeMemory:
-    def __init__(self, base_path, do_load=False) -> None:
-        self.id_to_node: typing.Dict[int, Node] = dict()
-
-        self.thought_id_to_node: typing.Dict[int, Thought] = dict()
-        self.chat_id_to_node: typing.Dict[int, Node] = dict()
-        self.event_id_to_node: typing.Dict[int, Node] = dict()
-        self.action_id_to_node: typing.Dict[int, Node] = dict()
-
-        self.nodes_without_chat_by_time: list[Node] = []
-
-        self.embeddings: dict[int, list[float]] = dict()
-
+    def __init__(
+        self, base_path, do_load=False, shared_events: "SharedEventStore" = None
+    ) -> None:
         self.base_path = base_path
+        self.embedding_file = EmbeddingFile(base_path)
+        self.shared_events = shared_events
+        self._shared_events: typing.Dict[int, "SharedEvent"] = dict()
+        self._clear()
+
         if (
-            os.path.exists(f"{base_path}/embeddings.json")
+            self.embedding_file.exists()
             and os.path.exists(f"{base_path}/nodes.json")
             and do_load
         ):
             self._load(base_path)
 
-    def _load(self, base_path):
-        raise NotImplementedError("Not sure if it works")
-        self.embeddings = json.load(open(f"{base_path}/embeddings.json"))
+    def _clear(self):
+        for shared_event in self._shared_events.values():
+            self.shared_events.release(shared_event)
+
+        # Node table, one row per node, row = node.id - 1. Nodes are returned as
+        # views on their row (see Node). Fixed size attributes are typed columns,
+        # grown together by _ensure_capacity; strings are interned, and the
+        # attributes of only some nodes are dicts keyed by id.
+        self._num_nodes = 0
+        self._capacity = 0
+        self._types = np.zeros(0, dtype=np.int8)
+        self._created = np.zeros(0, dtype="datetime64[us]")
+        self._expiration = np.zeros(0, dtype="datetime64[us]")
+        self._importance = np.zeros(0, dtype=np.float64)
+        self._always_include = np.zeros(0, dtype=bool)
+        self._subjects: list[str] = []
+        self._predicates: list[str] = []
+        self._objects: list[str] = []
+        self._descriptions: list[str] = []
+        self._conversations: typing.Dict[int, list[tuple[str, str]]] = dict()
+        self._shared_events: typing.Dict[int, "SharedEvent"] = dict()
+
+        # Ids of the nodes used by retrieval (all but chats) that were live at the
+        # simulated time of the last retrieval, in order of creation. A heap on
+        # their expiration lets get_nodes_for_retrieval drop only the nodes that
+        # just expired.
+        self._live_ids: typing.Dict[int, None] = dict()
+        self._expiration_heap: list[tuple[int, int]] = []
+        self._retrieval_time: datetime = None
+
+        # Embeddings, in the same rows, are kept L2-normalized in one contiguous
+        # float32 matrix (allocated on the first embedding, once the dimension is
+        # known) together with their original norms, so the raw vector can be
+        # recovered.
+        self._embedding_matrix: np.ndarray = None
+        self._embedding_norms = np.zeros(0, dtype=np.float32)
+        self._has_embedding = np.zeros(0, dtype=bool)
+
+        # nodes waiting to be embedded, see defer_node_embedding
+        self._pending_embedding_ids: list[int] = []
+        # nodes waiting for their importance score, see defer_node_importance
+        self._pending_importance_ids: list[int] = []
+
+        # embeddings set since the last save, appended to the file on save
+        self._unsaved_embedding_ids: list[int] = []
+        self._embedding_file_started = False
+
+    def __len__(self) -> int:
+        return self._num_nodes
+
+    def get_node(self, node_id: int) -> Node:
+        if not 0 < node_id <= self._num_nodes:
+            raise KeyError(node_id)
+        return VIEW_CLASSES[int(self._types[node_id - 1])](self, node_id)
+
+    def get_nodes(self, type: NodeType = None) -> list[Node]:
+        """
+        All nodes, or all nodes of a type, in order of creation.
+        """
+        node_ids = range(1, self._num_nodes + 1)
+        if type is not None:
+            rows = np.flatnonzero(self._types[: self._num_nodes] == type.value)
+            node_ids = (rows + 1).tolist()
+        return [self.get_node(node_id) for node_id in node_ids]
+
+    def _load(self, base_path, max_node_id: int = None):
+        """
+        Load nodes, importance scores and embeddings saved in base_path.
+
+        Args:
+            base_path (str): Directory written by save().
+            max_node_id (int): If set, nodes added after this id are dropped,
+                e.g. to go back to the state of a checkpoint.
+        """
         saved_nodes = json.load(open(f"{base_path}/nodes.json"))
-        for node in saved_nodes:
-            self.id_to_node[node["id"]] = Node(
-                node["id"],
-                NodeType[node["type"]],
-                node["subject"],
-                node["predicate"],
-                node["object"],
-                node["description"],
-                node["embedding_key"],
-                node["created"],
-                node["expiration"],
+        for saved in saved_nodes:
+            if max_node_id is not None and saved["id"] > max_node_id:
+                continue
+            node = self._add(
+                saved["subject"],
+                saved["predicate"],
+                saved["object"],
+                saved["description"],
+                NodeType[saved["type"]],
+                datetime.strptime(saved["created"], "%Y-%m-%d %H:%M:%S"),
+                datetime.strptime(saved["expiration"], "%Y-%m-%d %H:%M:%S"),
             )
+            assert node.id == saved["id"], "nodes.json is not ordered by id"
+            if node.type == NodeType.CHAT:
+                node.conversation = [tuple(u) for u in saved["conversation"]]
+            node.always_include = saved["always_include"] == "true"
+            shared_event_id = saved.get("shared_event_id")
+            if shared_event_id is not None and self.shared_events is not None:
+                shared_event = self.shared_events.acquire_id(shared_event_id)
+                self._shared_events[node.id] = shared_event
+                node.description = shared_event.description
+            self.set_node_importance(node.id, saved["importance_score"])
+
+        if self.embedding_file.exists():
+            node_ids, embeddings = self.embedding_file.load()
+            for node_id, embedding in zip(node_ids.tolist(), embeddings):
+                if node_id <= self._num_nodes:
+                    self.set_node_embedding(node_id, embedding)
+        for node_id, shared_event in self._shared_events.items():
+            if shared_event.embedding is not None:
+                self.set_node_embedding(node_id, shared_event.embedding)
+        # nodes stored without embedding (deferred) get embedded on next retrieval
+        self._pending_embedding_ids = (
+            np.flatnonzero(~self._has_embedding[: self._num_nodes]) + 1
+        ).tolist()
+        # rows of dropped nodes may still be in the file, rewrite it on next save
+        self._embedding_file_started = False
+
+    def checkpoint_state(self) -> dict:
+        return {"num_nodes": self._num_nodes}
+
+    def restore(self, state: dict):
+        """
+        Reset the memory to the saved state of a checkpoint_state() snapshot.
+        """
+        self._clear()
+        self._load(self.base_path, max_node_id=state["num_nodes"])
 
     def save(self):
+        if self.shared_events is not None:
+            # before nodes.json, so that its shared_event_id always resolves
+            self.shared_events.save()
         json.dump(
-            [node.toJSON() for node in self.id_to_node.values()],
+            [node.toJSON() for node in self.get_nodes()],
             open(f"{self.base_path}/nodes.json", "w"),
         )
-        json.dump(
-            self.embeddings,
-            open(f"{self.base_path}/embeddings.json", "w"),
-            cls=NumpyEncoder,
-        )
+        if len(self._unsaved_embedding_ids) > 0:
+            self.embedding_file.append(
+                self._unsaved_embedding_ids,
+                np.stack(
+                    [
+                        self.get_node_embedding(node_id)
+                        for node_id in self._unsaved_embedding_ids
+                    ]
+                ),
+                truncate=not self._embedding_file_started,
+            )
+            self._embedding_file_started = True
+            self._unsaved_embedding_ids = []
+
+    def _ensure_capacity(self, num_rows: int, dim: int = None):
+        if self._embedding_matrix is None and dim is not None:
+            self._embedding_matrix = np.zeros((self._capacity, dim), dtype=np.float32)
+        if num_rows <= self._capacity:
+            return
+        capacity = max(num_rows, 2 * self._capacity, 64)
+
+        def grow(array):
+            res = np.zeros((capacity, *array.shape[1:]), dtype=array.dtype)
+            res[: self._capacity] = array[: self._capacity]
+            return res
+
+        if self._embedding_matrix is not None:
+            self._embedding_matrix = grow(self._embedding_matrix)
+        self._embedding_norms = grow(self._embedding_norms)
+        self._has_embedding = grow(self._has_embedding)
+        self._types = grow(self._types)
+        self._created = grow(self._created)
+        self._expiration = grow(self._expiration)
+        self._importance = grow(self._importance)
+        self._always_include = grow(self._always_include)
+        self._capacity = capacity
 
     def _add(
         self, subject, predicate, obj, description, type, created, expiration
     ) -> Node:
-        id = len(self.id_to_node) + 1
-
+        id = self._num_nodes + 1
+        row = id - 1
+        self._ensure_capacity(id)
+
+        self._types[row] = type.value
+        self._created[row] = np.datetime64(created, "us")
+        self._expiration[row] = np.datetime64(expiration, "us")
+        self._importance[row] = 0
+        self._always_include[row] = False
+        self._subjects.append(_intern(subject))
+        self._predicates.append(_intern(predicate))
+        self._objects.append(_intern(obj))
+        self._descriptions.append(_intern(description))
         if type == NodeType.CHAT:
-            node = Chat(id, subject, predicate, obj, description, created, expiration)
-            self.chat_id_to_node[id] = node
-        elif type == NodeType.THOUGHT:
-            node = Thought(
-                id, subject, predicate, obj, description, created, expiration
-            )
-            self.thought_id_to_node[id] = node
-        elif type == NodeType.EVENT:
-            node = Event(id, subject, predicate, obj, description, created, expiration)
-            self.event_id_to_node[id] = node
-        elif type == NodeType.ACTION:
-            node = Action(id, subject, predicate, obj, description, created, expiration)
-            self.action_id_to_node[id] = node
+            self._conversations[id] = []
+        self._num_nodes = id
 
         if type != NodeType.CHAT:
-            self.nodes_without_chat_by_time.append(node)
+            self._live_ids[id] = None
+            heapq.heappush(self._expiration_heap, (_to_us(expiration), id))
 
-        self.id_to_node[id] = node
-
-        return node
+        return self.get_node(id)
 
     def add_chat(
         self, subject, predicate, obj, description, conversation, created, expiration
@@ -295,11 +427,24 @@ class AssociativeMemory:
         )
 
     def add_event(
-        self, subject, predicate, obj, description, created, expiration
+        self, subject, predicate, obj, description, created, expiration, shared=False
     ) -> Event:
-        return self._add(
+        """
+        Args:
+            shared (bool): The event is broadcast to several personas, its payload
+                is kept in the SharedEventStore of the memory, if there is one.
+        """
+        if shared and self.shared_events is not None:
+            shared_event = self.shared_events.acquire(description)
+            description = shared_event.description
+        else:
+            shared_event = None
+        node = self._add(
             subject, predicate, obj, description, NodeType.EVENT, created, expiration
         )
+        if shared_event is not None:
+            self._shared_events[node.id] = shared_event
+        return node
 
     def add_action(
         self, subject, predicate, obj, description, created, expiration
@@ -308,18 +453,126 @@ class AssociativeMemory:
             subject, predicate, obj, description, NodeType.ACTION, created, expiration
         )
 
+    def _reindex_expiration(self):
+        rows = np.flatnonzero(
+            self._types[: self._num_nodes] != NodeType.CHAT.value
+        )
+        self._live_ids = dict.fromkeys((rows + 1).tolist())
+        self._expiration_heap = list(
+            zip(self._expiration[rows].astype(np.int64).tolist(), (rows + 1).tolist())
+        )
+        heapq.heapify(self._expiration_heap)
+
     def get_nodes_for_retrieval(self, current_time: datetime) -> list[Node]:
         """
-        Get all nodes except chat
+        Get all nodes except chat that are not expired at current_time, in order of
+        creation.
         """
-        nodes = []
-        for node in self.nodes_without_chat_by_time:
-            if node.expiration > current_time:
-                nodes.append(node)
-        return nodes
+        if self._retrieval_time is not None and current_time < self._retrieval_time:
+            # time went back, expired nodes may be live again
+            self._reindex_expiration()
+        self._retrieval_time = current_time
+
+        now = _to_us(current_time)
+        while len(self._expiration_heap) > 0 and self._expiration_heap[0][0] <= now:
+            _, node_id = heapq.heappop(self._expiration_heap)
+            del self._live_ids[node_id]
+        return [self.get_node(node_id) for node_id in self._live_ids]
+
+    def get_node_rows(self, nodes: list[Node]) -> np.ndarray:
+        """
+        Row of each node in the column storage (embeddings, importance).
+        """
+        return np.fromiter((node.id - 1 for node in nodes), np.int64, len(nodes))
 
-    def get_node_embedding(self, node_id: int):
-        return self.embeddings[node_id]
+    def get_node_embedding(self, node_id: int) -> np.ndarray:
+        row = node_id - 1
+        if row >= self._capacity or not self._has_embedding[row]:
+            raise KeyError(node_id)
+        return self._embedding_matrix[row] * self._embedding_norms[row]
 
     def set_node_embedding(self, node_id: int, embedding: list[float]):
-        self.embeddings[node_id] = embedding
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        row = node_id - 1
+        self._ensure_capacity(node_id, dim=embedding.shape[0])
+        norm = np.linalg.norm(embedding)
+        self._embedding_matrix[row] = embedding / norm if norm > 0 else embedding
+        self._embedding_norms[row] = norm
+        self._has_embedding[row] = True
+        shared_event = self._shared_events.get(node_id)
+        if shared_event is not None:
+            # saved once by the shared store
+            self.shared_events.set_embedding(shared_event, embedding)
+        else:
+            self._unsaved_embedding_ids.append(node_id)
+
+    def defer_node_embedding(self, node_id: int):
+        """
+        Queue the node to be embedded, from its description, by the next
+        embed_pending call.
+        """
+        self._pending_embedding_ids.append(node_id)
+
+    def embed_pending(self, embedding_model: "EmbeddingModel"):
+        """
+        Embed all queued nodes in one batched call.
+        """
+        if len(self._pending_embedding_ids) == 0:
+            return
+        node_ids = []
+        for node_id in self._pending_embedding_ids:
+            shared_event = self._shared_events.get(node_id)
+            if shared_event is not None and shared_event.embedding is not None:
+                self.set_node_embedding(node_id, shared_event.embedding)
+            else:
+                node_ids.append(node_id)
+        self._pending_embedding_ids = []
+        if len(node_ids) == 0:
+            return
+        embeddings = embedding_model.embed_batch(
+            [self._descriptions[node_id - 1] for node_id in node_ids]
+        )
+        for node_id, embedding in zip(node_ids, embeddings):
+            self.set_node_embedding(node_id, embedding)
+
+    def defer_node_importance(self, node_id: int):
+        """
+        Queue the node to be rated by the store, its importance is 0 until then.
+        """
+        self._importance[node_id - 1] = 0
+        self._pending_importance_ids.append(node_id)
+
+    def pop_pending_importance(self) -> list[Node]:
+        node_ids = self._pending_importance_ids
+        self._pending_importance_ids = []
+        return [self.get_node(node_id) for node_id in node_ids]
+
+    def set_node_importance(self, node_id: int, importance_score: float):
+        self._importance[node_id - 1] = importance_score
+
+    def get_importance_vector(self, rows: np.ndarray) -> np.ndarray:
+        return self._importance[rows]
+
+    def get_always_include_vector(self, rows: np.ndarray) -> np.ndarray:
+        return self._always_include[rows]
+
+    def get_relevance_matrix(self, queries: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity between each query and the embedding of each row.
+
+        Args:
+            queries (np.ndarray): Query embeddings, shape (num_queries, dim).
+            rows (np.ndarray): Rows of the nodes to score.
+
+        Returns:
+            np.ndarray: Similarities, shape (num_queries, len(rows)).
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1)
+        if len(rows) == 0 or self._embedding_matrix is None:
+            return np.zeros((len(queries), len(rows)), dtype=np.float32)
+        # one matmul over the contiguous matrix, then pick the requested rows
+        num_rows = int(rows.max()) + 1
+        scores = queries @ self._embedding_matrix[:num_rows].T
+        return scores[:, rows]
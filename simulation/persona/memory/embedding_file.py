@@ -0,0 +1,83 @@
+import json
+import os
+
+import numpy as np
+
+
+class EmbeddingFile:
+    """
+    Append-only binary storage of the node embeddings of one memory.
+
+    - embeddings.bin: raw float32 rows, one per stored embedding
+    - embedding_ids.bin: int64 node id of each row
+    - embeddings_meta.json: dtype and dimension of the rows
+
+    Rows are only ever appended, so a save costs O(new nodes). If the embedding of
+    a node is replaced, the node appears more than once and the last row wins.
+
+    For analysis the rows can be opened without reading them into memory:
+        ids, matrix = EmbeddingFile(path).load(mmap_mode="r")
+    """
+
+    dtype = np.float32
+
+    def __init__(self, base_path: str) -> None:
+        self.base_path = base_path
+        self.data_path = f"{base_path}/embeddings.bin"
+        self.ids_path = f"{base_path}/embedding_ids.bin"
+        self.meta_path = f"{base_path}/embeddings_meta.json"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_path)
+
+    def append(self, node_ids: list[int], embeddings: np.ndarray, truncate=False):
+        """
+        Append embeddings of the given nodes.
+
+        Args:
+            node_ids (list[int]): Node id of each row.
+            embeddings (np.ndarray): Embeddings, shape (len(node_ids), dim).
+            truncate (bool): Start a new file instead of appending to the existing one.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        mode = "wb" if truncate else "ab"
+        if truncate or not self.exists():
+            with open(self.meta_path, "w") as f:
+                json.dump(
+                    {"dtype": np.dtype(self.dtype).name, "dim": embeddings.shape[1]}, f
+                )
+        # rows before ids, so an interrupted save never indexes a missing row
+        with open(self.data_path, mode) as f:
+            f.write(embeddings.tobytes())
+        with open(self.ids_path, mode) as f:
+            f.write(np.asarray(node_ids, dtype=np.int64).tobytes())
+
+    def load(self, mmap_mode: str = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Load the stored embeddings.
+
+        Args:
+            mmap_mode (str): If set (e.g. "r"), the rows are returned as a np.memmap.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Node ids, shape (n,), and rows, shape (n, dim).
+        """
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+        dtype = np.dtype(meta["dtype"])
+        dim = meta["dim"]
+
+        node_ids = np.fromfile(self.ids_path, dtype=np.int64)
+        num_rows = os.path.getsize(self.data_path) // (dtype.itemsize * dim)
+        num_rows = min(num_rows, len(node_ids))
+        node_ids = node_ids[:num_rows]
+        if num_rows == 0:
+            return node_ids, np.zeros((0, dim), dtype=dtype)
+        if mmap_mode is not None:
+            embeddings = np.memmap(
+                self.data_path, dtype=dtype, mode=mmap_mode, shape=(num_rows, dim)
+            )
+        else:
+            embeddings = np.fromfile(self.data_path, dtype=dtype, count=num_rows * dim)
+            embeddings = embeddings.reshape(num_rows, dim)
+        return node_ids, embeddings
@@ -12,3 +12,7 @@ class Scratch:
             saved_info = json.load(open(f"{base_path}/scratch.json", "r"))
             for key, value in saved_info.items():
                 setattr(self, key, value)
+
+    def save(self):
+        info = {k: v for k, v in vars(self).items() if k != "base_path"}
+        json.dump(info, open(f"{self.base_path}/scratch.json", "w"))
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from .embedding_file import EmbeddingFile
+
+
+class SharedEvent:
+    """
+    Payload of an event that the environment broadcasts to several personas.
+    """
+
+    id: int
+    description: str
+    embedding: np.ndarray
+    ref_count: int
+
+    def __init__(self, id: int, description: str) -> None:
+        self.id = id
+        self.description = description
+        self.embedding = None
+        self.ref_count = 0
+
+    def toJSON(self):
+        return {
+            "id": self.id,
+            "description": self.description,
+        }
+
+
+class SharedEventStore:
+    """
+    Broadcast events stored once for all the personas of a run.
+
+    The event nodes of each memory keep their own time and expiration, but
+    reference the shared entry with the same description: its embedding is computed
+    for the first persona that stores the event and reused by the others. The
+    importance is rated by each persona, from its own perspective. Entries are
+    reference counted by the nodes and dropped on save once no memory uses them.
+
+    Saved in base_path: events.json with the payloads and an EmbeddingFile whose
+    rows are keyed by entry id. The embeddings of shared nodes are not repeated in
+    the embedding files of the personas, nodes.json refers to the entry with
+    shared_event_id.
+    """
+
+    def __init__(self, base_path: str) -> None:
+        self.base_path = base_path
+        os.makedirs(base_path, exist_ok=True)
+        self.embedding_file = EmbeddingFile(base_path)
+        self.events_path = f"{base_path}/events.json"
+
+        self._lock = threading.RLock()
+        self._by_description: dict[str, SharedEvent] = dict()
+        self._by_id: dict[int, SharedEvent] = dict()
+        self._next_id = 1
+        self._loaded = False
+
+        self._unsaved_embedding_ids: list[int] = []
+        self._embedding_file_started = False
+
+    def _add(self, entry: SharedEvent):
+        self._by_description[entry.description] = entry
+        self._by_id[entry.id] = entry
+        self._next_id = max(self._next_id, entry.id + 1)
+
+    def _load(self):
+        """
+        Load the entries saved by a previous process, e.g. to resume a run.
+        """
+        self._loaded = True
+        if not os.path.exists(self.events_path):
+            return
+        with open(self.events_path, "r") as f:
+            saved_entries = json.load(f)
+        for saved in saved_entries:
+            if saved["id"] in self._by_id:
+                continue
+            self._add(SharedEvent(saved["id"], saved["description"]))
+        if self.embedding_file.exists():
+            entry_ids, embeddings = self.embedding_file.load()
+            if len(entry_ids) > 0:
+                # never reuse the id of a row still in the file
+                self._next_id = max(self._next_id, int(entry_ids.max()) + 1)
+            for entry_id, embedding in zip(entry_ids.tolist(), embeddings):
+                if entry_id in self._by_id:
+                    self._by_id[entry_id].embedding = embedding
+        # rows of entries dropped since may be in the file, rewrite it on next save
+        self._embedding_file_started = False
+
+    def acquire(self, description: str) -> SharedEvent:
+        with self._lock:
+            entry = self._by_description.get(description)
+            if entry is None:
+                entry = SharedEvent(self._next_id, description)
+                self._add(entry)
+            entry.ref_count += 1
+            return entry
+
+    def acquire_id(self, entry_id: int) -> SharedEvent:
+        with self._lock:
+            if entry_id not in self._by_id and not self._loaded:
+                self._load()
+            entry = self._by_id[entry_id]
+            entry.ref_count += 1
+            return entry
+
+    def release(self, entry: SharedEvent):
+        with self._lock:
+            entry.ref_count -= 1
+
+    def set_embedding(self, entry: SharedEvent, embedding: np.ndarray):
+        with self._lock:
+            if entry.embedding is None:
+                entry.embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+                self._unsaved_embedding_ids.append(entry.id)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def save(self):
+        with self._lock:
+            unused = [e for e in self._by_id.values() if e.ref_count <= 0]
+            for entry in unused:
+                del self._by_id[entry.id]
+                del self._by_description[entry.description]
+            if len(unused) > 0:
+                self._embedding_file_started = False
+
+            with open(self.events_path, "w") as f:
+                json.dump([entry.toJSON() for entry in self._by_id.values()], f)
+
+            if self._embedding_file_started:
+                entries = [
+                    self._by_id[entry_id]
+                    for entry_id in self._unsaved_embedding_ids
+                    if entry_id in self._by_id
+                ]
+            else:
+                entries = [e for e in self._by_id.values() if e.embedding is not None]
+            self._unsaved_embedding_ids = []
+            if len(entries) > 0:
+                self.embedding_file.append(
+                    [entry.id for entry in entries],
+                    np.stack([entry.embedding for entry in entries]),
+                    truncate=not self._embedding_file_started,
+                )
+                self._embedding_file_started = True
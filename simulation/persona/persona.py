@@ -20,7 +20,7 @@ from .cognition import (
     StoreComponent,
 )
 from .embedding_model import EmbeddingModel
-from .memory import AssociativeMemory, Scratch
+from .memory import AssociativeMemory, Scratch, SharedEventStore
 
 
 class PersonaAgent:
@@ -45,16 +45,17 @@ class PersonaAgent:
         plan_cls: type[PlanComponent] = PlanComponent,
         act_cls: type[ActComponent] = ActComponent,
         converse_cls: type[ConverseComponent] = ConverseComponent,
+        shared_events: SharedEventStore = None,
     ) -> None:
         self.cfg = cfg
         self.base_path = base_path
         os.makedirs(base_path, exist_ok=True)
 
-        self.memory = memory_cls(base_path)
+        self.memory = memory_cls(base_path, shared_events=shared_events)
         self.perceive = perceive_cls(model)
         self.retrieve = retrieve_cls(model, self.memory, embedding_model)
         self.store = store_cls(model, self.memory, embedding_model, self.cfg.store)
-        self.reflect = reflect_cls(model)
+        self.reflect = reflect_cls(model, self.cfg.reflect)
         self.plan = plan_cls(model)
         self.act = act_cls(
             model,
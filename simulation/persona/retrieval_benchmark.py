@@ -0,0 +1,374 @@
+"""
+Micro-benchmark of the memory retrieval and save, on synthetic memories of 100 to 100k
+nodes with random embeddings, on CPU and without the embedding model:
+
+    python -m simulation.persona.retrieval_benchmark --output retrieval_baseline.json
+    python -m simulation.persona.retrieval_benchmark --baseline retrieval_baseline.json
+
+The results are written as json and can be compared with those of an earlier run on
+the same machine: a case whose fastest run is more than --max-slowdown times slower
+than in the baseline is a regression, and the exit code is then 1. The fastest run is
+compared rather than the median, as it is the least affected by the other processes.
+
+The nodes are events, thoughts, actions and chats created over the two months before
+the retrieval, with the expiration dates of the simulation (events expire with the
+next month, the others after expiration_delta), so some of them are expired, as in
+the memory of a persona at the expiration horizon.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+
+from .cognition import RetrieveComponent, StoreComponent
+from .embedding_model import EmbeddingCache, EmbeddingModel
+from .memory import AssociativeMemory
+
+DIM = 1024  # mxbai-embed-large-v1
+START_TIME = datetime(2024, 1, 1, 1, 0, 0)
+HISTORY_DAYS = 60
+EXPIRATION_DAYS = 63
+NODE_TYPES = ["event", "thought", "action", "chat"]
+NODE_TYPE_WEIGHTS = [0.4, 0.3, 0.2, 0.1]
+FOCAL_POINTS = ["lake", "harvesting", "restaurant", "income", "fish", "community"]
+NAMES = ["John", "Kate", "Jack", "Emma", "Luke"]
+
+
+class RandomEmbeddingModel(EmbeddingModel):
+    """
+    EmbeddingModel returning a random vector per text, the same for the same text.
+    """
+
+    def __init__(self, dim: int = DIM) -> None:
+        self.dim = dim
+        self.truncate_dim = None
+        self.model_id = f"random-{dim}"
+        # every retrieval encodes its focal points, as on a cache miss
+        self.cache = EmbeddingCache(0)
+        self.cache_path = None
+
+    def _dimension(self) -> int:
+        return self.dim
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        return np.stack(
+            [
+                np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+                .standard_normal(self.dim)
+                .astype(np.float32)
+                for text in texts
+            ]
+        )
+
+
+def _description(rng: np.random.Generator, node_type: str) -> str:
+    name = NAMES[rng.integers(len(NAMES))]
+    amount = int(rng.integers(0, 20))
+    if node_type == "event":
+        return f"{name} caught {amount} tons of fish."
+    if node_type == "thought":
+        return (
+            f"{name} thinks the community should catch at most {amount} tons of fish"
+            " each month, so that the lake stays sustainable."
+        )
+    if node_type == "action":
+        return f"Before everyone fishes, there are {amount * 5} tons of fish in the lake."
+    return f"{name} and the others agreed to a limit of {amount} tons per person."
+
+
+def build_memory(
+    base_path: str,
+    num_nodes: int,
+    dim: int = DIM,
+    seed: int = 0,
+    chunk_size: int = 10000,
+) -> tuple[AssociativeMemory, datetime]:
+    """
+    Returns:
+        tuple[AssociativeMemory, datetime]: The memory, with an embedding and an
+        importance score for every node, and the time of the retrieval.
+    """
+    rng = np.random.default_rng(seed)
+    memory = AssociativeMemory(base_path)
+    current_time = START_TIME + timedelta(days=HISTORY_DAYS)
+    types = rng.choice(NODE_TYPES, size=num_nodes, p=NODE_TYPE_WEIGHTS)
+    offsets = np.sort(rng.uniform(0, HISTORY_DAYS * 24 * 3600, size=num_nodes))
+
+    for start in range(0, num_nodes, chunk_size):
+        end = min(start + chunk_size, num_nodes)
+        embeddings = rng.standard_normal((end - start, dim), dtype=np.float32)
+        for i in range(start, end):
+            node_type = types[i]
+            created = START_TIME + timedelta(seconds=float(offsets[i]))
+            if node_type == "event":
+                expiration = created + timedelta(days=int(rng.integers(30, 61)))
+            else:
+                expiration = created + timedelta(days=EXPIRATION_DAYS)
+            description = _description(rng, node_type)
+            if node_type == "event":
+                node = memory.add_event(
+                    None, None, None, description, created, expiration
+                )
+            elif node_type == "thought":
+                node = memory.add_thought(
+                    None, None, None, description, created, expiration
+                )
+            elif node_type == "action":
+                node = memory.add_action(
+                    None, None, None, description, created, expiration
+                )
+            else:
+                conversation = [(NAMES[j], description) for j in range(3)]
+                node = memory.add_chat(
+                    None, None, None, description, conversation, created, expiration
+                )
+            memory.set_node_importance(node.id, int(rng.integers(1, 11)))
+            if node_type == "thought" and rng.random() < 0.02:
+                node.always_include = True
+            memory.set_node_embedding(node.id, embeddings[i - start])
+    return memory, current_time
+
+
+def measure(fn, setup=None, repeat: int = 5, number: int = 1) -> dict:
+    """
+    Returns:
+        dict: Min and median over repeat runs of the time of one call of fn, each
+        run calling it number times after setup (not timed).
+    """
+    fn()  # warm up, e.g. caches and the retrieval index
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {"min_s": float(np.min(times)), "median_s": float(np.median(times))}
+
+
+def _files_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(path, name))
+        for name in os.listdir(path)
+        if os.path.isfile(os.path.join(path, name))
+    )
+
+
+def run_size(
+    num_nodes: int,
+    focal_point_counts: list[int],
+    top_ks: list[int],
+    repeat: int,
+    dim: int = DIM,
+) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as base_path:
+        start = time.perf_counter()
+        memory, current_time = build_memory(base_path, num_nodes, dim)
+        print(f"{num_nodes} nodes built in {time.perf_counter() - start:.1f}s")
+
+        embedding_model = RandomEmbeddingModel(dim)
+        store = StoreComponent(None, memory, embedding_model, None)
+        retrieve = RetrieveComponent(None, memory, embedding_model)
+        persona = SimpleNamespace(
+            agent_id="persona_0",
+            current_time=current_time,
+            memory=memory,
+            store=store,
+        )
+        store.init_persona_ref(persona)
+        retrieve.init_persona_ref(persona)
+        num_live = len(memory.get_nodes_for_retrieval(current_time))
+
+        def add(name: str, stats: dict, **params):
+            res = {"name": name, "nodes": num_nodes, **params, **stats}
+            results.append(res)
+            print(_format(res))
+
+        def reset_index():
+            memory._retrieval_time = None
+            memory._reindex_expiration()
+
+        add(
+            "get_nodes_for_retrieval",
+            measure(
+                lambda: memory.get_nodes_for_retrieval(current_time), repeat=repeat
+            ),
+            live_nodes=num_live,
+        )
+        add(
+            "get_nodes_for_retrieval_cold",
+            measure(
+                lambda: memory.get_nodes_for_retrieval(current_time),
+                setup=reset_index,
+                repeat=repeat,
+            ),
+            live_nodes=num_live,
+        )
+        for num_focal_points in focal_point_counts:
+            focal_points = FOCAL_POINTS[:num_focal_points]
+            for top_k in top_ks:
+                params = {"focal_points": num_focal_points, "top_k": top_k}
+                add(
+                    "_retrieve_dict",
+                    measure(
+                        lambda: retrieve._retrieve_dict(focal_points, top_k),
+                        repeat=repeat,
+                    ),
+                    **params,
+                )
+                add(
+                    "retrieve",
+                    measure(
+                        lambda: retrieve.retrieve(focal_points, top_k), repeat=repeat
+                    ),
+                    **params,
+                )
+
+        # the first save writes every node and embedding, the next ones only the
+        # new embeddings but all of nodes.json
+        start = time.perf_counter()
+        memory.save()
+        save_time = time.perf_counter() - start
+        add(
+            "save",
+            {"min_s": save_time, "median_s": save_time},
+            bytes=_files_size(base_path),
+        )
+
+        rng = np.random.default_rng(1)
+
+        def add_nodes():
+            for _ in range(10):
+                node = memory.add_thought(
+                    None,
+                    None,
+                    None,
+                    _description(rng, "thought"),
+                    current_time,
+                    current_time + timedelta(days=EXPIRATION_DAYS),
+                )
+                memory.set_node_embedding(
+                    node.id, rng.standard_normal(dim, dtype=np.float32)
+                )
+
+        add(
+            "save_incremental",
+            measure(memory.save, setup=add_nodes, repeat=repeat),
+            new_nodes=10,
+        )
+    return results
+
+
+def _format(res: dict) -> str:
+    params = " ".join(
+        f"{key}={value}"
+        for key, value in res.items()
+        if key not in ("name", "nodes", "min_s", "median_s")
+    )
+    return (
+        f"  {res['name']:<30} {res['nodes']:>7} nodes {res['median_s'] * 1000:10.3f} ms"
+        f" (min {res['min_s'] * 1000:.3f}) {params}"
+    )
+
+
+def _case_key(res: dict) -> tuple:
+    return (
+        res["name"],
+        res["nodes"],
+        res.get("focal_points"),
+        res.get("top_k"),
+    )
+
+
+def compare(results: list[dict], baseline: list[dict], max_slowdown: float) -> int:
+    """
+    Print the ratio of the min time of every case to that of the baseline.
+
+    Returns:
+        int: The number of regressions.
+    """
+    baseline = {_case_key(res): res for res in baseline}
+    num_regressions = 0
+    for res in results:
+        base = baseline.get(_case_key(res))
+        if base is None or base["min_s"] <= 0:
+            continue
+        ratio = res["min_s"] / base["min_s"]
+        flag = ""
+        if ratio > max_slowdown:
+            flag = "REGRESSION"
+            num_regressions += 1
+        elif ratio < 1 / max_slowdown:
+            flag = "faster"
+        print(f"{_format(res)} x{ratio:.2f} {flag}")
+        if "bytes" in res and res["bytes"] != base.get("bytes"):
+            print(f"    size {base.get('bytes')} -> {res['bytes']} bytes")
+    return num_regressions
+
+
+def environment() -> dict:
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000]
+    )
+    parser.add_argument(
+        "--focal-points", type=int, nargs="+", default=[1, 2, 3, 4, 5, 6]
+    )
+    parser.add_argument("--top-k", type=int, nargs="+", default=[5, 10])
+    parser.add_argument("--dim", type=int, default=DIM)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write the results as json")
+    parser.add_argument(
+        "--baseline", default=None, help="results of an earlier run to compare with"
+    )
+    parser.add_argument("--max-slowdown", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = []
+    for num_nodes in args.sizes:
+        results.extend(
+            run_size(num_nodes, args.focal_points, args.top_k, args.repeat, args.dim)
+        )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "environment": environment(),
+                    "dim": args.dim,
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline} ({baseline['environment']['date']})")
+        num_regressions = compare(results, baseline["results"], args.max_slowdown)
+        if num_regressions > 0:
+            print(f"{num_regressions} regressions")
+            sys.exit(1)
@@ -1 +1,2 @@
 from .environment import *
+from .checkpoint import load_checkpoint, read_checkpoint, save_checkpoint
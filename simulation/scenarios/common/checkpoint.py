@@ -0,0 +1,102 @@
+"""
+Checkpoints are taken at round boundaries and stored in
+<experiment_storage>/checkpoint:
+
+- env.pkl: state of the environment (ConcurrentEnv.state_dict)
+- checkpoint.json: round, logger state and, per persona, how many memory nodes
+  existed at the checkpoint. Written last, so it only exists for a complete
+  checkpoint.
+
+The memories themselves are the ones saved in the persona folders; nodes added
+after the checkpoint are dropped on resume.
+"""
+
+import json
+import os
+import pickle
+
+from simulation.persona import PersonaAgent
+from simulation.utils import WandbLogger
+
+from .environment import ConcurrentEnv, HarvestingObs
+
+
+def _checkpoint_dir(experiment_storage: str) -> str:
+    return os.path.join(experiment_storage, "checkpoint")
+
+
+def _dump_atomic(path: str, write, mode="w"):
+    with open(f"{path}.tmp", mode) as f:
+        write(f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_checkpoint(experiment_storage: str) -> dict:
+    path = os.path.join(_checkpoint_dir(experiment_storage), "checkpoint.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(
+    experiment_storage: str,
+    env: ConcurrentEnv,
+    personas: dict[str, PersonaAgent],
+    logger: WandbLogger,
+):
+    path = _checkpoint_dir(experiment_storage)
+    os.makedirs(path, exist_ok=True)
+
+    memory = {}
+    for persona_id, persona in personas.items():
+        persona.store.score_pending()
+        persona.store.embed_pending()
+        persona.memory.save()
+        persona.scratch.save()
+        memory[persona_id] = persona.memory.checkpoint_state()
+
+    _dump_atomic(
+        os.path.join(path, "env.pkl"),
+        lambda f: pickle.dump(env.state_dict(), f),
+        mode="wb",
+    )
+    _dump_atomic(
+        os.path.join(path, "checkpoint.json"),
+        lambda f: json.dump(
+            {
+                "num_round": env.num_round,
+                "logger": logger.state_dict(),
+                "memory": memory,
+            },
+            f,
+        ),
+    )
+
+
+def load_checkpoint(
+    experiment_storage: str,
+    env: ConcurrentEnv,
+    personas: dict[str, PersonaAgent],
+    logger: WandbLogger,
+) -> tuple[str, HarvestingObs]:
+    """
+    Restore env, personas and logger from the last checkpoint.
+
+    The env needs to be reset before, so that all its attributes exist.
+
+    Returns:
+        tuple[str, HarvestingObs]: The agent to play next and its observation.
+    """
+    checkpoint = read_checkpoint(experiment_storage)
+    if checkpoint is None:
+        raise FileNotFoundError(f"No checkpoint found in {experiment_storage}")
+
+    with open(os.path.join(_checkpoint_dir(experiment_storage), "env.pkl"), "rb") as f:
+        env.load_state_dict(pickle.load(f))
+    for persona_id, persona in personas.items():
+        persona.memory.restore(checkpoint["memory"][persona_id])
+    logger.load_state_dict(checkpoint["logger"])
+
+    print(f"Resumed from checkpoint at round {checkpoint['num_round']}")
+    return env.agent_selection, env._observe(env.agent_selection)
@@ -1,3 +1,4 @@
-from .common import HarvestingObs
-from .concurrent_env import ConcurrentEnv
+from .common import AgentValues, HarvestingObs
+from .concurrent_env import ConcurrentEnv, get_max_num_agents
+from .env_log import EnvLog
 from .perturbation_env import PerturbationEnv
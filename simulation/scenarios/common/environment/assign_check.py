@@ -0,0 +1,121 @@
+"""
+Statistical check that the "stochastic_vectorized" resource assignment draws the
+same distribution as "stochastic".
+
+For each case, both strategies are sampled many times and the allocations are
+compared with a chi-square test of homogeneity. Run with:
+
+    python -m simulation.scenarios.common.environment.assign_check
+"""
+
+import argparse
+import sys
+from collections import Counter
+
+import numpy as np
+from omegaconf import OmegaConf
+from scipy.stats import chi2_contingency
+
+from .concurrent_env import ConcurrentEnv
+
+# (wanted per agent, resource in pool)
+CASES = [
+    ([10, 10, 10, 10, 10], 30),
+    ([1, 5, 20, 0, 40], 25),
+    ([3, 3], 4),
+    ([50, 1, 1, 1, 1], 10),
+    ([7, 8, 9, 10, 11, 12, 13, 14, 15, 16], 60),
+    # agents without arrivals at the end
+    ([10, 10, 0], 15),
+    ([0, 0, 5], 3),
+    ([4, 6, 0, 0], 7),
+]
+
+
+def _sample(strategy: str, wanted: list[int], pool: int, num_samples: int, seed: int):
+    env = ConcurrentEnv(OmegaConf.create({"num_agents": len(wanted)}), None, {})
+    agents = env.possible_agents
+    env.agents = agents
+    env.random = np.random.RandomState(seed)
+    assign = {
+        "stochastic": env._assign_stochastic,
+        "stochastic_vectorized": env._assign_stochastic_vectorized,
+    }[strategy]
+
+    samples = []
+    for _ in range(num_samples):
+        env.internal_global_state = {
+            "wanted_resource": np.array(wanted, dtype=np.int64),
+            "resource_in_pool": pool,
+        }
+        res = assign()
+        allocation = tuple(res[a] for a in agents)
+        # invariants that must hold for every draw
+        assert all(0 <= r <= w for r, w in zip(allocation, wanted))
+        assert sum(allocation) == min(pool, sum(wanted))
+        assert env.internal_global_state["resource_in_pool"] == pool - sum(allocation)
+        samples.append(allocation)
+    return Counter(samples)
+
+
+def _marginal(samples: Counter, agent_index: int) -> Counter:
+    res = Counter()
+    for allocation, count in samples.items():
+        res[allocation[agent_index]] += count
+    return res
+
+
+def _homogeneity_p_value(reference: Counter, candidate: Counter) -> float:
+    outcomes = sorted(set(reference) | set(candidate))
+    table = np.array(
+        [[reference[o] for o in outcomes], [candidate[o] for o in outcomes]]
+    )
+    # pool rare outcomes, so that the expected counts are not too small
+    frequent = table.sum(axis=0) >= 10
+    table = np.column_stack(
+        [table[:, frequent], table[:, ~frequent].sum(axis=1, keepdims=True)]
+    )
+    table = table[:, table.sum(axis=0) > 0]
+    if table.shape[1] < 2:
+        return 1.0  # a single possible outcome
+    _, p_value, _, _ = chi2_contingency(table)
+    return p_value
+
+
+def check(num_samples: int = 20000, alpha: float = 1e-3, seed: int = 0) -> bool:
+    """
+    Compare the joint allocation and the allocation of each single agent.
+
+    Returns:
+        bool: Whether no test rejected the equivalence at level alpha.
+    """
+    ok = True
+    for wanted, pool in CASES:
+        reference = _sample("stochastic", wanted, pool, num_samples, seed)
+        candidate = _sample(
+            "stochastic_vectorized", wanted, pool, num_samples, seed + 1
+        )
+
+        p_values = [_homogeneity_p_value(reference, candidate)]
+        for i in range(len(wanted)):
+            p_values.append(
+                _homogeneity_p_value(
+                    _marginal(reference, i), _marginal(candidate, i)
+                )
+            )
+        passed = min(p_values) >= alpha
+        ok = ok and passed
+        print(
+            f"wanted={wanted} pool={pool}: joint p={p_values[0]:.4f}, "
+            f"min marginal p={min(p_values[1:]):.4f} {'ok' if passed else 'FAILED'}"
+        )
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-samples", type=int, default=20000)
+    parser.add_argument("--alpha", type=float, default=1e-3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.exit(0 if check(args.num_samples, args.alpha, args.seed) else 1)
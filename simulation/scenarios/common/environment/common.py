@@ -1,8 +1,40 @@
+from collections.abc import Mapping
 from datetime import datetime
 
+import numpy as np
+
 from simulation.persona.common import ChatObservation, PersonaOberservation
 
 
+class AgentValues(Mapping):
+    """
+    Read-only dict view {agent_id: value} over an array of per-agent values.
+
+    Building it is O(1), so observations do not copy the state of all the agents.
+    """
+
+    def __init__(
+        self, agents: list[str], agent_index: dict[str, int], values: np.ndarray
+    ) -> None:
+        self._agents = agents
+        self._agent_index = agent_index
+        self._values = values
+
+    def __getitem__(self, agent: str) -> int:
+        if agent not in self._agent_index:
+            raise KeyError(agent)
+        return self._values[self._agent_index[agent]].item()
+
+    def __iter__(self):
+        return iter(self._agents)
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
 class HarvestingObs(PersonaOberservation):
     current_resource_num: int
 
@@ -2,7 +2,6 @@ import math
 from datetime import datetime, timedelta
 
 import numpy as np
-import pandas as pd
 from omegaconf import DictConfig, OmegaConf
 from pettingzoo.utils import agent_selector
 
@@ -14,7 +13,8 @@ from simulation.persona.common import (
     PersonaIdentity,
 )
 
-from .common import HarvestingObs
+from .common import AgentValues, HarvestingObs
+from .env_log import EnvLog
 
 
 def get_reflection_day(current_date):
@@ -32,20 +32,41 @@ def get_expiration_next_month(current_date):
     return get_reflection_day(current_date)
 
 
+def get_max_num_agents(cfg: DictConfig) -> int:
+    """
+    Number of agents taking part in a run, including the ones that perturbations
+    add later on.
+    """
+    num_agents = cfg.num_agents
+    for p in cfg.get("perturbations", None) or []:
+        num_agents = max(num_agents, p.perturbation.get("num_agents", 0))
+    return num_agents
+
+
 class ConcurrentEnv:
+    # per-agent numeric state, stored in arrays indexed by agent_name_mapping
+    PER_AGENT_ARRAYS = [
+        "collected_resource",
+        "wanted_resource",
+        "last_collected_resource",
+    ]
+
     def __init__(
         self, cfg: DictConfig, experiment_storage: str, map_id_to_name: dict[str, str]
     ) -> None:
         self.cfg = cfg
         self.experiment_storage = experiment_storage
 
-        self.possible_agents = [f"persona_{i}" for i in range(5)]
+        self.possible_agents = [
+            f"persona_{i}" for i in range(get_max_num_agents(cfg))
+        ]
         self.agent_name_mapping = dict(
             zip(self.possible_agents, list(range(len(self.possible_agents))))
         )
         self.agent_id_to_name = map_id_to_name
 
         self.POOL_LOCATION = "pool"
+        self._no_resource = np.zeros(len(self.possible_agents), dtype=np.int64)
 
     ### Prompt text
 
@@ -70,6 +91,7 @@ class ConcurrentEnv:
                     self.internal_global_state["next_time"][agent]
                 ),
                 always_include=True,
+                broadcast=True,
             )
         ]
         if self.cfg.inject_universalization:
@@ -81,6 +103,7 @@ class ConcurrentEnv:
                         self.internal_global_state["next_time"][agent]
                     ),
                     always_include=True,
+                    broadcast=True,
                 )
             )
         obs = HarvestingObs(
@@ -92,7 +115,7 @@ class ConcurrentEnv:
             context="",
             chat=None,
             current_resource_num=self.internal_global_state["resource_in_pool"],
-            agent_resource_num={agent: 0 for agent in self.agents},
+            agent_resource_num=self._agent_values(self._no_resource),
             before_harvesting_sustainability_threshold=sustainability_threshold,
         )
         return obs
@@ -119,7 +142,7 @@ class ConcurrentEnv:
             context="",
             chat=None,
             current_resource_num=self.internal_global_state["resource_in_pool"],
-            agent_resource_num={agent: 0 for agent in self.agents},
+            agent_resource_num=self._agent_values(self._no_resource),
             before_harvesting_sustainability_threshold=self.internal_global_state[
                 "sustainability_threshold"
             ],
@@ -137,7 +160,9 @@ class ConcurrentEnv:
             context="",
             chat=None,
             current_resource_num=self.internal_global_state["resource_in_pool"],
-            agent_resource_num=self.internal_global_state["last_collected_resource"],
+            agent_resource_num=self._agent_values(
+                self.internal_global_state["last_collected_resource"]
+            ),
             before_harvesting_sustainability_threshold=self.internal_global_state[
                 "sustainability_threshold"
             ],
@@ -154,7 +179,7 @@ class ConcurrentEnv:
             context="",
             chat=None,
             current_resource_num=self.internal_global_state["resource_in_pool"],
-            agent_resource_num={agent: 0 for agent in self.agents},
+            agent_resource_num=self._agent_values(self._no_resource),
             before_harvesting_sustainability_threshold=self.internal_global_state[
                 "sustainability_threshold"
             ],
@@ -178,6 +203,24 @@ class ConcurrentEnv:
             state = self._observe_home(agent)
         return state
 
+    def observe_concurrent_agents(self) -> dict[str, HarvestingObs]:
+        """
+        Observations of the current and all remaining agents of a concurrent phase.
+
+        In the concurrent harvesting phase what an agent does does not change what the
+        following agents observe, so their cognition can run in parallel. The actions
+        still have to be passed to step() one by one, in the order of the returned dict.
+        Returns an empty dict in any other phase.
+        """
+        if (
+            self.phase != self.POOL_LOCATION
+            or self.cfg.harvesting_order != "concurrent"
+        ):
+            return {}
+        agent_order = self._agent_selector.agent_order
+        agents = agent_order[agent_order.index(self.agent_selection) :]
+        return {agent: self._observe(agent) for agent in agents}
+
     def close(self):
         """
         Close should release any graphical displays, subprocesses, network connections
@@ -186,10 +229,20 @@ class ConcurrentEnv:
         """
         pass
 
+    def _agent_values(self, values: np.ndarray) -> AgentValues:
+        return AgentValues(self.agents, self.agent_name_mapping, values)
+
+    def _agents_index(self) -> np.ndarray:
+        return np.array(
+            [self.agent_name_mapping[agent] for agent in self.agents], dtype=np.int64
+        )
+
+    def get_agent_state(self, key: str, agent: str) -> int:
+        return int(self.internal_global_state[key][self.agent_name_mapping[agent]])
+
     def _init_agent(self, agent):
-        self.internal_global_state["collected_resource"][agent] = 0
-        self.internal_global_state["wanted_resource"][agent] = 0
-        self.internal_global_state["last_collected_resource"][agent] = 0
+        for key in self.PER_AGENT_ARRAYS:
+            self.internal_global_state[key][self.agent_name_mapping[agent]] = 0
         self.internal_global_state["next_location"][agent] = self.POOL_LOCATION
         self.internal_global_state["next_time"][agent] = datetime(2024, 1, 1, 1, 0, 0)
 
@@ -202,7 +255,7 @@ class ConcurrentEnv:
         self.agents = self.possible_agents[: self.cfg.num_agents]
 
         self.num_round = 0
-        self.df_acc = []
+        self.env_log = EnvLog(f"{self.experiment_storage}/log_env.jsonl")
 
         # RL specific (for pettingzoo)
         self.rewards = {}
@@ -216,9 +269,10 @@ class ConcurrentEnv:
             "sustainability_threshold": (
                 10
             ),  # each day the fish double and cap at 100, so maximum 50 can be fished
-            "collected_resource": {},
-            "wanted_resource": {},
-            "last_collected_resource": {},
+            **{
+                key: np.zeros(len(self.possible_agents), dtype=np.int64)
+                for key in self.PER_AGENT_ARRAYS
+            },
             "next_location": {},
             "next_time": {},
             "action": {},
@@ -236,39 +290,107 @@ class ConcurrentEnv:
         return self.agent_selection, self._observe(self.agent_selection)
 
     def save_log(self):
-        pd.concat(self.df_acc).to_json(
-            f"{self.experiment_storage}/log_env.json", orient="records"
-        )
+        self.env_log.save_json(f"{self.experiment_storage}/log_env.json")
+
+    # Everything that changes after reset, used for checkpointing
+    STATE_ATTRIBUTES = [
+        "cfg",
+        "random",
+        "agents",
+        "num_round",
+        "env_log",
+        "rewards",
+        "terminations",
+        "internal_global_state",
+        "_agent_selector",
+        "agent_selection",
+        "_phase_selector",
+        "phase",
+    ]
+
+    def state_dict(self) -> dict:
+        state = {k: getattr(self, k) for k in self.STATE_ATTRIBUTES}
+        # random-sequential harvesting order uses the global numpy generator
+        state["np_random_state"] = np.random.get_state()
+        return state
 
-    def _assign_stochastic(self):
-        resource_per_agent = {agent: 0 for agent in self.agents}
+    def load_state_dict(self, state: dict):
+        state = dict(state)
+        np.random.set_state(state.pop("np_random_state"))
+        for k, v in state.items():
+            setattr(self, k, v)
 
-        wanted = self.internal_global_state["wanted_resource"].copy()
+    def _assign_stochastic(self):
+        index = self._agents_index()
+        wanted = self.internal_global_state["wanted_resource"][index].copy()
+        assigned = np.zeros(len(index), dtype=np.int64)
         remaining = self.internal_global_state["resource_in_pool"]
-        while sum(wanted.values()) > 0 and remaining > 0:
-            # filter agents which want more fish
-            agents_to_assign = [agent for agent in self.agents if wanted[agent] > 0]
-            if len(agents_to_assign) == 0:
-                break
+        # agents which want more resource, only recomputed when one is satisfied
+        agents_to_assign = np.flatnonzero(wanted > 0)
+        while len(agents_to_assign) > 0 and remaining > 0:
             # pick random agent
-            agent = self.random.choice(agents_to_assign)
-            wanted[agent] -= 1
-            resource_per_agent[agent] += 1
+            i = self.random.choice(agents_to_assign)
+            wanted[i] -= 1
+            assigned[i] += 1
             remaining -= 1
+            if wanted[i] == 0:
+                agents_to_assign = np.flatnonzero(wanted > 0)
 
         self.internal_global_state["resource_in_pool"] = int(remaining)
 
-        for agent in self.agents:
-            # convert to int
-            resource_per_agent[agent] = int(resource_per_agent[agent])
+        return dict(zip(self.agents, assigned.tolist()))
 
-        return resource_per_agent
+    def _assign_stochastic_vectorized(self):
+        """
+        Same distribution as _assign_stochastic, without the per-unit loop.
+
+        Picking uniformly among the agents that still want resource is the jump
+        chain of independent unit-rate Poisson processes, one per agent, each
+        stopped after its wanted amount. So we draw the arrival times of every
+        agent at once and give one unit per arrival, in time order, until the
+        pool is empty.
+        """
+        wanted = self.internal_global_state["wanted_resource"][self._agents_index()]
+        remaining = int(self.internal_global_state["resource_in_pool"])
+
+        if wanted.sum() <= remaining:
+            assigned = wanted
+        elif remaining <= 0:
+            assigned = np.zeros_like(wanted)
+        else:
+            # no agent can get more than the whole pool
+            num_arrivals = np.minimum(wanted, remaining)
+            owners = np.repeat(np.arange(len(self.agents)), num_arrivals)
+            gaps = self.random.standard_exponential(len(owners))
+            starts = np.cumsum(num_arrivals) - num_arrivals
+            times = np.cumsum(gaps)
+            # arrival times restart from 0 for every agent; agents without
+            # arrivals have no first arrival (their start can be past the end)
+            has_arrivals = num_arrivals > 0
+            times -= np.repeat(
+                (times[starts[has_arrivals]] - gaps[starts[has_arrivals]]),
+                num_arrivals[has_arrivals],
+            )
+            first = np.argpartition(times, remaining - 1)[:remaining]
+            assigned = np.bincount(owners[first], minlength=len(self.agents))
+
+        self.internal_global_state["resource_in_pool"] = int(
+            remaining - assigned.sum()
+        )
+        return dict(zip(self.agents, assigned.tolist()))
 
     def _assign_proportional(self):
         resource_per_agent = {agent: 0 for agent in self.agents}
         was_rounded_down = {agent: False for agent in self.agents}
 
-        wanted = self.internal_global_state["wanted_resource"].copy()
+        wanted = dict(
+            zip(
+                self.agents,
+                self.internal_global_state["wanted_resource"][
+                    self._agents_index()
+                ].tolist(),
+            )
+        )
         remaining = self.internal_global_state["resource_in_pool"]
         while sum(wanted.values()) > 0 and remaining > 0:
             total_wanted = sum(wanted.values())
@@ -330,6 +452,8 @@ class ConcurrentEnv:
     def _assign_resource(self):
         if self.cfg.assign_resource_strategy == "stochastic":
             resource_per_agent = self._assign_stochastic()
+        elif self.cfg.assign_resource_strategy == "stochastic_vectorized":
+            resource_per_agent = self._assign_stochastic_vectorized()
         elif self.cfg.assign_resource_strategy == "proportional":
             resource_per_agent = self._assign_proportional()
         else:
@@ -342,16 +466,20 @@ class ConcurrentEnv:
             action = self.internal_global_state["action"][agent]
             self.log_step_harvest(action, res)
 
+        index = self._agents_index()
+        collected = np.array(
+            [resource_per_agent[agent] for agent in self.agents], dtype=np.int64
+        )
+        self.internal_global_state["collected_resource"][index] += collected
+        self.internal_global_state["last_collected_resource"][index] = collected
         for agent in self.agents:
-            res = resource_per_agent[agent]
-            self.internal_global_state["collected_resource"][agent] += res
-            self.internal_global_state["last_collected_resource"][agent] = res
-
-            self.rewards[agent] += res
+            self.rewards[agent] += resource_per_agent[agent]
 
     def _step_lake_bet(self, action: PersonaActionHarvesting):
         res = action.quantity
-        self.internal_global_state["wanted_resource"][self.agent_selection] = res
+        self.internal_global_state["wanted_resource"][
+            self.agent_name_mapping[self.agent_selection]
+        ] = res
         self.internal_global_state["action"][self.agent_selection] = action
         self.internal_global_state["next_location"][
             self.agent_selection
@@ -417,19 +545,17 @@ class ConcurrentEnv:
             assert action.location == "home"
             self._step_home(action)
             if self._agent_selector.is_last():
-                self.save_log()
+                self.env_log.flush()
                 self.num_round += 1
                 self.phase = self._phase_selector.next()
 
                 # We want to see also the discussion in case no fish remain
-                self.terminations = {
-                    agent: (
-                        self.internal_global_state["resource_in_pool"]
-                        < 5  # less than 5 fish remain, so we collapse
-                        or self.num_round >= self.cfg.max_num_rounds
-                    )
-                    for agent in self.agents
-                }
+                self.terminations = dict.fromkeys(
+                    self.agents,
+                    self.internal_global_state["resource_in_pool"]
+                    < 5  # less than 5 fish remain, so we collapse
+                    or self.num_round >= self.cfg.max_num_rounds,
+                )
 
                 self.internal_global_state["resource_in_pool"] = min(
                     self.cfg.initial_resource_in_pool,
@@ -464,28 +590,27 @@ class ConcurrentEnv:
         resource_collected: int,
     ):
         tmp = {
-            "agent_id": [action.agent_id],
-            "round": [self.num_round],
-            "action": ["harvesting"],
-            "resource_in_pool_before_harvesting": [
-                self.internal_global_state["resource_before_harvesting"]
+            "agent_id": action.agent_id,
+            "round": self.num_round,
+            "action": "harvesting",
+            "resource_in_pool_before_harvesting": self.internal_global_state[
+                "resource_before_harvesting"
             ],
-            "resource_in_pool_after_harvesting": [
-                self.internal_global_state["resource_in_pool"]
+            "resource_in_pool_after_harvesting": self.internal_global_state[
+                "resource_in_pool"
             ],
-            "concurrent_harvesting": [True],
-            "resource_collected": [resource_collected],
-            "wanted_resource": [action.quantity],
-            "html_interactions": [action.html_interactions],
+            "concurrent_harvesting": True,
+            "resource_collected": resource_collected,
+            "wanted_resource": action.quantity,
+            "html_interactions": action.html_interactions,
         }
         if "sustainable_intention" in action.stats:
-            tmp["sustainable_intention"] = [action.stats["sustainable_intention"]]
-        df_log = pd.DataFrame(tmp, index=[len(self.df_acc)])
-        self.df_acc.append(df_log)
+            tmp["sustainable_intention"] = action.stats["sustainable_intention"]
+        self.env_log.append(tmp)
 
     def log_step_conversation(self, chat: PersonaActionChat):
         for i, (p, u) in enumerate(chat.conversation):
-            df_log = pd.DataFrame(
+            self.env_log.append(
                 {
                     "agent_id": p.agent_id,
                     "agent_name": p.name,
@@ -493,33 +618,26 @@ class ConcurrentEnv:
                     "action": "utterance",
                     "resource_limit": chat.conversation_resource_limit,
                     "utterance": u,
-                    "html_interactions": [chat.html_interactions[i]],
-                },
-                index=[len(self.df_acc)],
+                    "html_interactions": chat.html_interactions[i],
+                }
             )
-            self.df_acc.append(df_log)
-        df_log = pd.DataFrame(
+        self.env_log.append(
             {
                 "agent_id": "framework",
                 "agent_name": "framework",
                 "round": self.num_round,
                 "action": "conversation_summary",
                 "resource_limit": chat.conversation_resource_limit,
-                "html_interactions": [chat.html_interactions[-2]],
-            },
-            index=[len(self.df_acc)],
+                "html_interactions": chat.html_interactions[-2],
+            }
         )
-        self.df_acc.append(df_log)
-
-        df_log = pd.DataFrame(
+        self.env_log.append(
             {
                 "agent_id": "framework",
                 "agent_name": "framework",
                 "round": self.num_round,
                 "action": "conversation_resource_limit",
                 "resource_limit": chat.conversation_resource_limit,
-                "html_interactions": [chat.html_interactions[-1]],
-            },
-            index=[len(self.df_acc)],
+                "html_interactions": chat.html_interactions[-1],
+            }
         )
-        self.df_acc.append(df_log)
@@ -0,0 +1,83 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _to_json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, "toJSON"):
+        # e.g. the LazyHtml of html_interactions
+        return value.toJSON()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class EnvLog:
+    """
+    Append-only log of the environment events.
+
+    Each record is written as one line of a JSONL file when it is logged, so the
+    cost of logging does not grow with the length of the run. The log_env.json
+    used by the analysis is produced on demand with save_json.
+
+    The log can be pickled with the env state: on unpickling, records written
+    after the pickle are dropped at the next write.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.num_records = 0
+        self._offset = 0  # bytes of the file holding our records
+        self._file = None
+
+    def _open(self):
+        # the file is only touched at the first write, so that an env that is
+        # reset and then restored from a checkpoint does not truncate the log
+        self._file = open(self.path, "ab")
+        self._file.truncate(self._offset)
+
+    def append(self, record: dict):
+        if self._file is None:
+            self._open()
+        line = json.dumps(record, default=_to_json_value) + "\n"
+        self._file.write(line.encode("utf-8"))
+        self.num_records += 1
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+            self._offset = self._file.tell()
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def records(self) -> list[dict]:
+        self.flush()
+        if self._file is None and not os.path.exists(self.path):
+            return []
+        with open(self.path, "rb") as f:
+            data = f.read(self._offset)
+        return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.records())
+
+    def save_json(self, path: str):
+        self.to_dataframe().to_json(path, orient="records")
+
+    def __getstate__(self):
+        self.flush()
+        return {
+            "path": self.path,
+            "num_records": self.num_records,
+            "_offset": self._offset,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._file = None
@@ -61,6 +61,7 @@ class PerturbationEnv(ConcurrentEnv):
                             expiration=get_expiration_next_month(
                                 self.internal_global_state["next_time"][agent]
                             ),
+                            broadcast=True,
                         )
                     )
 
@@ -73,7 +74,7 @@ class PerturbationEnv(ConcurrentEnv):
                 context="",
                 chat=None,
                 current_resource_num=self.internal_global_state["resource_in_pool"],
-                agent_resource_num={agent: 0 for agent in self.agents},
+                agent_resource_num=self._agent_values(self._no_resource),
                 before_harvesting_sustainability_threshold=self.internal_global_state[
                     "sustainability_threshold"
                 ],
@@ -128,7 +129,7 @@ class PerturbationEnv(ConcurrentEnv):
             assert action.location == "home"
             self._step_home(action)
             if self._agent_selector.is_last():
-                self.save_log()
+                self.env_log.flush()
                 self.num_round += 1
 
                 ## Apply perturbations, now we assume we have only 1
@@ -150,13 +151,11 @@ class PerturbationEnv(ConcurrentEnv):
                 self.phase = self._phase_selector.next()
 
                 # We want to see also the discussion in case no fish remain
-                self.terminations = {
-                    agent: (
-                        self.internal_global_state["resource_in_pool"] < 5
-                        or self.num_round >= self.cfg.max_num_rounds
-                    )
-                    for agent in self.agents
-                }
+                self.terminations = dict.fromkeys(
+                    self.agents,
+                    self.internal_global_state["resource_in_pool"] < 5
+                    or self.num_round >= self.cfg.max_num_rounds,
+                )
 
                 self.internal_global_state["resource_in_pool"] = min(
                     self.cfg.initial_resource_in_pool,
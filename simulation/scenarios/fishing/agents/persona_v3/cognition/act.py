@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from simulation.persona.cognition.act import ActComponent
-from simulation.utils import ModelWandbWrapper
+from simulation.utils import ModelWandbWrapper, profiled
 from pathfinder import assistant, system, user
 
 from .act_prompts import prompt_action_choose_amount_of_fish_to_catch
@@ -20,6 +20,7 @@ class FishingActComponent(ActComponent):
         super().__init__(model)
         self.cfg = cfg
 
+    @profiled
     def choose_how_many_fish_to_chat(
         self,
         retrieved_memories: list[str],
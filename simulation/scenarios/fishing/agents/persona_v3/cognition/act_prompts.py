@@ -54,6 +54,6 @@ def prompt_action_choose_amount_of_fish_to_catch(
         option = int(lm["option"])
         reasoning = lm["reasoning"]
 
-    model.end_chain(identity.name, lm)
+    html_interactions = model.end_chain(identity.name, lm)
 
-    return option, lm.html()
+    return option, html_interactions
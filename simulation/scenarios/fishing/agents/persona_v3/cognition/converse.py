@@ -3,7 +3,7 @@ from datetime import datetime
 from simulation.persona.cognition.converse import ConverseComponent
 from simulation.persona.cognition.retrieve import RetrieveComponent
 from simulation.persona.common import PersonaIdentity
-from simulation.utils import ModelWandbWrapper
+from simulation.utils import ModelWandbWrapper, profiled
 from pathfinder import assistant, system, user
 
 from .converse_prompts import (
@@ -22,6 +22,7 @@ class FishingConverseComponent(ConverseComponent):
     ):
         super().__init__(model, retrieve, cfg)
 
+    @profiled
     def converse_group(
         self,
         target_personas: list[PersonaIdentity],
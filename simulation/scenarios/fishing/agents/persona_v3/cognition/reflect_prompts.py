@@ -1,3 +1,5 @@
+import re
+
 from simulation.persona.common import PersonaIdentity
 from simulation.utils import ModelWandbWrapper
 from pathfinder import assistant, system, user
@@ -63,6 +65,58 @@ def prompt_insight_and_evidence(
     return acc
 
 
+def _parse_numbered_insights(text: str, max_insights: int) -> list[str]:
+    """
+    Split a numbered list "1. insight (because of 1,5,3) 2. insight ..." into the
+    insights, dropping the evidence in parentheses.
+    """
+    acc = []
+    for i in range(max_insights):
+        match = re.search(rf"(?:^|(?<=\s)){i+2}\.", text)
+        item = text if match is None else text[: match.start()]
+        insight = item.split("(")[0].strip()
+        if insight:
+            acc.append(insight)
+        if match is None:
+            break
+        text = text[match.end() :]
+    return acc
+
+
+def prompt_insights_single_pass(
+    model: ModelWandbWrapper, persona: PersonaIdentity, statements: list[str]
+):
+    """
+    Same prompt as prompt_insight_and_evidence, but the whole numbered list is
+    generated in one call and split locally.
+    """
+    if len(statements) == 0:
+        return []
+
+    lm = model.start_chain(
+        persona.name, "cognition_retrieve", "prompt_insights_single_pass"
+    )
+
+    with user():
+        lm += f"{get_sytem_prompt(persona)}\n"
+        lm += f"{numbered_memory_prompt(persona, statements)}\n"
+        lm += (
+            f"What high-level insights can you infere from the above"
+            " statements? (example format: insight (because of 1,5,3)"
+        )
+    with assistant():
+        lm += f"1."
+        lm = model.gen(
+            lm,
+            name="insights",
+            stop_regex=rf"(?:^|\s){len(statements)+1}\.",
+        )
+        acc = _parse_numbered_insights(lm["insights"], len(statements))
+        model.end_chain(persona.name, lm)
+
+    return acc
+
+
 def prompt_planning_thought_on_conversation(
     model: ModelWandbWrapper,
     persona: PersonaIdentity,
@@ -158,8 +212,8 @@ def prompt_find_harvesting_limit_from_conversation(
 
         if resource_limit_agreed:
             res = int(lm["num_resource"])
-            model.end_chain("framework", lm)
-            return res, lm.html()
+            html_interactions = model.end_chain("framework", lm)
+            return res, html_interactions
         else:
-            model.end_chain("framework", lm)
-            return None, lm.html()
+            html_interactions = model.end_chain("framework", lm)
+            return None, html_interactions
@@ -117,13 +117,36 @@ def get_sytem_prompt(persona):
     else:
         raise ValueError(f"Unknown SYS_VERSION: {SYS_VERSION}")
 
+# names of the personas when the identity does not list the ones of the run
+DEFAULT_PERSONA_NAMES = ["John", "Kate", "Jack", "Emma", "Luke"]
 
-def get_sytem_prompt_v1(persona):
-    persona_names = ["John", "Kate", "Jack", "Emma", "Luke"]
+NUMBER_WORDS = (
+    "zero one two three four five six seven eight nine ten eleven twelve thirteen"
+    " fourteen fifteen sixteen seventeen eighteen nineteen twenty"
+).split()
+
+
+def number_to_words(n: int) -> str:
+    if n < len(NUMBER_WORDS):
+        return NUMBER_WORDS[n]
+    return str(n)
+
+
+def get_persona_names(persona) -> list[str]:
+    return list(persona.community or DEFAULT_PERSONA_NAMES)
+
+
+def get_other_persona_names(persona) -> list[str]:
+    persona_names = get_persona_names(persona)
     persona_names.remove(persona.name)
+    return persona_names
+
+
+def get_sytem_prompt_v1(persona):
+    persona_names = get_other_persona_names(persona)
     list_string_persona_name = ", ".join(persona_names)
     text = (
-        f"You are {persona.name}, a fisherman, and you fish each month in a lake along with four other fishermen ({list_string_persona_name})."
+        f"You are {persona.name}, a fisherman, and you fish each month in a lake along with {number_to_words(len(persona_names))} other fishermen ({list_string_persona_name})."
         " The lake has a population capacity of 100 tons of fish."
         " Each month, each fisherman decides how many fish to take out of the lake between 0 and 100 tons."
         " At the end of the month, the remaining fish reproduce and double up to the population capacity."
@@ -142,11 +165,10 @@ def get_sytem_prompt_v1(persona):
 
 
 def get_sytem_prompt_v3(persona):
-    persona_names = ["John", "Kate", "Jack", "Emma", "Luke"]
-    persona_names.remove(persona.name)
+    persona_names = get_other_persona_names(persona)
     list_string_persona_name = ", ".join(persona_names)
     text = (
-        f"You are {persona.name}, a fisherman, and you fish every month in a lake along with four other fishermen ({list_string_persona_name})."
+        f"You are {persona.name}, a fisherman, and you fish every month in a lake along with {number_to_words(len(persona_names))} other fishermen ({list_string_persona_name})."
         " The lake has a carrying capacity of 100 tons of fish."
         " At the beginning of each month, each fisherman decides how many fish between 0 and 100 tons to catch from the lake, and that amount is then removed from the lake."
         " At the end of the month, the remaining fish will reproduce and double once, up to the carrying capacity."
@@ -154,7 +176,7 @@ def get_sytem_prompt_v3(persona):
         " Each fisherman's goal is to optimize his income in the long run over many months."
         " At the end of each month, the number of fish caught by each fisherman will be revealed, and the fishermen will have the opportunity to communicate with each other."
         " They can use this as an opportunity to negotiate and persuade others to influence their behavior in the next month."
-        " For example, if there are 90 tons of fish at the beginning of the month and the five fishermen catch a total of 30 fish,"
+        f" For example, if there are 90 tons of fish at the beginning of the month and the {number_to_words(len(get_persona_names(persona)))} fishermen catch a total of 30 fish,"
         " there will be 60 tons of fish left at the end of the month before reproduction, and 100 tons after reproduction."
     )
 
@@ -165,17 +187,16 @@ def get_sytem_prompt_v3(persona):
 
 
 def get_sytem_prompt_v3_nocom(persona):
-    persona_names = ["John", "Kate", "Jack", "Emma", "Luke"]
-    persona_names.remove(persona.name)
+    persona_names = get_other_persona_names(persona)
     list_string_persona_name = ", ".join(persona_names)
     text = (
-        f"You are {persona.name}, a fisherman, and you fish every month in a lake along with four other fishermen ({list_string_persona_name})."
+        f"You are {persona.name}, a fisherman, and you fish every month in a lake along with {number_to_words(len(persona_names))} other fishermen ({list_string_persona_name})."
         " The lake has a carrying capacity of 100 tons of fish."
         " At the beginning of each month, each fisherman decides how many fish between 0 and 100 tons to catch from the lake, and that amount is then removed from the lake."
         " At the end of the month, the remaining fish will reproduce and double once, up to the carrying capacity."
         " For every ton of fish caught, a fisherman earns one thousand dollars."
         " Each fisherman's goal is to optimize his income in the long run over many months."
-        " For example, if there are 90 tons of fish at the beginning of the month and the five fishermen catch a total of 30 fish,"
+        f" For example, if there are 90 tons of fish at the beginning of the month and the {number_to_words(len(get_persona_names(persona)))} fishermen catch a total of 30 fish,"
         " there will be 60 tons of fish left at the end of the month before reproduction, and 100 tons after reproduction."
     )
 
@@ -19,7 +19,7 @@ from simulation.persona.common import (
     PersonaIdentity,
 )
 from simulation.persona.embedding_model import EmbeddingModel
-from simulation.persona.memory import AssociativeMemory, Scratch
+from simulation.persona.memory import AssociativeMemory, Scratch, SharedEventStore
 from simulation.scenarios.common.environment import HarvestingObs
 from simulation.utils import ModelWandbWrapper
 
@@ -53,6 +53,7 @@ class FishingPersona(PersonaAgent):
         plan_cls: type[FishingPlanComponent] = FishingPlanComponent,
         act_cls: type[FishingActComponent] = FishingActComponent,
         converse_cls: type[FishingConverseComponent] = FishingConverseComponent,
+        shared_events: SharedEventStore = None,
     ) -> None:
         super().__init__(
             cfg,
@@ -67,6 +68,7 @@ class FishingPersona(PersonaAgent):
             plan_cls,
             act_cls,
             converse_cls,
+            shared_events,
         )
 
     def loop(self, obs: HarvestingObs) -> PersonaAction:
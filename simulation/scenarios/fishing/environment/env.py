@@ -36,8 +36,8 @@ class FishingConcurrentEnv(ConcurrentEnv):
         return tons_in_lake(num)
 
     def _prompt_pool_amount_of_resource_after_harvesting(self, agent):
-        wanted = self.internal_global_state["wanted_resource"][agent]
-        caught = self.internal_global_state["last_collected_resource"][agent]
+        wanted = self.get_agent_state("wanted_resource", agent)
+        caught = self.get_agent_state("last_collected_resource", agent)
         agent_name = self.agent_id_to_name[agent]
         return tons_caught(agent_name, wanted, caught)
 
@@ -60,8 +60,8 @@ class FishingPerturbationEnv(PerturbationEnv):
         return tons_in_lake(num)
 
     def _prompt_pool_amount_of_resource_after_harvesting(self, agent):
-        wanted = self.internal_global_state["wanted_resource"][agent]
-        caught = self.internal_global_state["last_collected_resource"][agent]
+        wanted = self.get_agent_state("wanted_resource", agent)
+        caught = self.get_agent_state("last_collected_resource", agent)
         agent_name = self.agent_id_to_name[agent]
         return tons_caught(agent_name, wanted, caught)
 
@@ -69,6 +69,6 @@ class FishingPerturbationEnv(PerturbationEnv):
         return univ(sustainability_threshold)
 
     def _prompt_home_observe_agent_resource(self, agent):
-        caught = self.internal_global_state["last_collected_resource"][agent]
+        caught = self.get_agent_state("last_collected_resource", agent)
         agent_name = self.agent_id_to_name[agent]
         return tons_caught_home(agent_name, caught)
@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from simulation.persona.cognition.act import ActComponent
-from simulation.utils import ModelWandbWrapper
+from simulation.utils import ModelWandbWrapper, profiled
 from pathfinder import assistant, system, user
 
 from .act_prompts import prompt_action_choose_amount_of_pollution
@@ -12,6 +12,7 @@ class PollutionActComponent(ActComponent):
         super().__init__(model)
         self.cfg = cfg
 
+    @profiled
     def choose_how_many_widgets(
         self,
         retrieved_memories: list[str],
@@ -6,6 +6,7 @@ from simulation.utils import ModelWandbWrapper
 
 from .store_prompts import (
     prompt_importance_action,
+    prompt_importance_batch,
     prompt_importance_chat,
     prompt_importance_event,
     prompt_importance_thought,
@@ -27,3 +28,4 @@ class PollutionStoreComponent(StoreComponent):
         self.prompt_importance_chat = prompt_importance_chat
         self.prompt_importance_event = prompt_importance_event
         self.prompt_importance_action = prompt_importance_action
+        self.prompt_importance_batch = prompt_importance_batch
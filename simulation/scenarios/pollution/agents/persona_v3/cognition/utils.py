@@ -107,18 +107,36 @@ def get_sytem_prompt(persona):
         raise ValueError(f"Unknown SYS_VERSION: {SYS_VERSION}")
 
 
-# All females
-OTHER_PERSONAS = ["John", "Kate", "Jack", "Emma", "Luke"]
+# names of the personas when the identity does not list the ones of the run
+DEFAULT_PERSONA_NAMES = ["John", "Kate", "Jack", "Emma", "Luke"]
 
-import copy
+NUMBER_WORDS = (
+    "zero one two three four five six seven eight nine ten eleven twelve thirteen"
+    " fourteen fifteen sixteen seventeen eighteen nineteen twenty"
+).split()
 
 
-def get_sytem_prompt_v3(persona):
-    persona_names = copy.deepcopy(OTHER_PERSONAS)
+def number_to_words(n: int) -> str:
+    if n < len(NUMBER_WORDS):
+        return NUMBER_WORDS[n]
+    return str(n)
+
+
+def get_persona_names(persona) -> list[str]:
+    return list(persona.community or DEFAULT_PERSONA_NAMES)
+
+
+def get_other_persona_names(persona) -> list[str]:
+    persona_names = get_persona_names(persona)
     persona_names.remove(persona.name)
+    return persona_names
+
+
+def get_sytem_prompt_v3(persona):
+    persona_names = get_other_persona_names(persona)
     list_string_persona_name = ", ".join(persona_names)
     text = (
-        f"You are {persona.name}, a factory owner. Every month, you decide how many widgets to make with four other factory owners ({list_string_persona_name}) that are situated on the banks of a river."
+        f"You are {persona.name}, a factory owner. Every month, you decide how many widgets to make with {number_to_words(len(persona_names))} other factory owners ({list_string_persona_name}) that are situated on the banks of a river."
         f" For every 1 pallet of widgets manufactured, unpolluted water decreased by 1% of the total river volume."
         f" At the beginning of each month, each factory owner chooses to manufacture between 0 and 100 pallets of widgets, and corresponding pollution is generated."
         f" At the end of the month, the river recovers, and the percentage of unpolluted water doubles."
@@ -126,7 +144,7 @@ def get_sytem_prompt_v3(persona):
         f" Each factory owner's goal is to optimize his income over the long run."
         f" At the end of each month, the number of widgets produced by each owner will be revealed, and the owners will have the opportunity to communicate with each other."
         f" They can use this period of communication as an opportunity to negotiate with or persuade others to produce less pollution in the next month."
-        f" For example, if the river is 90% unpolluted at the beginning of the month and the five factory owners create a total of 30 pallets of widgets,"
+        f" For example, if the river is 90% unpolluted at the beginning of the month and the {number_to_words(len(get_persona_names(persona)))} factory owners create a total of 30 pallets of widgets,"
         f" the river will be 60% unpolluted before recovery and 100% unpolluted after recovery."
     )
 
@@ -137,17 +155,16 @@ def get_sytem_prompt_v3(persona):
 
 
 def get_sytem_prompt_v3_nocom(persona):
-    persona_names = copy.deepcopy(OTHER_PERSONAS)
-    persona_names.remove(persona.name)
+    persona_names = get_other_persona_names(persona)
     list_string_persona_name = ", ".join(persona_names)
     text = (
-        f"You are {persona.name}, a factory owner. Every month, you decide how many widgets to make with four other factory owners ({list_string_persona_name}) that are situated on the banks of a river."
+        f"You are {persona.name}, a factory owner. Every month, you decide how many widgets to make with {number_to_words(len(persona_names))} other factory owners ({list_string_persona_name}) that are situated on the banks of a river."
         f" For every 1 pallet of widgets manufactured, unpolluted water decreased by 1% of the total river volume."
         f" At the beginning of each month, each factory owner chooses to manufacture between 0 and 100 pallets of widgets, and corresponding pollution is generated."
         f" At the end of the month, the river recovers, and the percentage of unpolluted water doubles."
         f" For every pallet of widgets, the factory owner earns one thousand dollars."
         f" Each factory owner's goal is to optimize his income over the long run."
-        f" For example, if the river is 90% unpolluted at the beginning of the month and the five factory owners create a total of 30 pallets of widgets,"
+        f" For example, if the river is 90% unpolluted at the beginning of the month and the {number_to_words(len(get_persona_names(persona)))} factory owners create a total of 30 pallets of widgets,"
         f" the river will be 60% unpolluted before recovery and 100% unpolluted after recovery."
     )
 
@@ -19,7 +19,7 @@ from simulation.persona.common import (
     PersonaIdentity,
 )
 from simulation.persona.embedding_model import EmbeddingModel
-from simulation.persona.memory import AssociativeMemory, Scratch
+from simulation.persona.memory import AssociativeMemory, Scratch, SharedEventStore
 from simulation.scenarios.common.environment import HarvestingObs
 from simulation.utils import ModelWandbWrapper
 
@@ -53,6 +53,7 @@ class PollutionPersona(PersonaAgent):
         plan_cls: type[PollutionPlanComponent] = PollutionPlanComponent,
         act_cls: type[PollutionActComponent] = PollutionActComponent,
         converse_cls: type[PollutionConverseComponent] = PollutionConverseComponent,
+        shared_events: SharedEventStore = None,
     ) -> None:
         super().__init__(
             cfg,
@@ -67,6 +68,7 @@ class PollutionPersona(PersonaAgent):
             plan_cls,
             act_cls,
             converse_cls,
+            shared_events,
         )
 
     def loop(self, obs: HarvestingObs) -> PersonaAction:
@@ -98,8 +98,8 @@ def prompt_converse_utterance_in_group(
             assert lm["next_speaker"] in options
             next_speaker = lm["next_speaker"]
 
-    model.end_chain(init_persona.name, lm)
-    return utterance, utterance_ended, next_speaker, lm.html()
+    html_interactions = model.end_chain(init_persona.name, lm)
+    return utterance, utterance_ended, next_speaker, html_interactions
 
 
 def prompt_summarize_conversation_in_one_sentence(
@@ -120,5 +120,5 @@ def prompt_summarize_conversation_in_one_sentence(
         lm = model.gen(lm, name="summary", default_value="", stop_regex=r"\.")
         summary = lm["summary"] + "."
 
-    model.end_chain("framework", lm)
-    return summary, lm.html()
+    html_interactions = model.end_chain("framework", lm)
+    return summary, html_interactions
@@ -4,6 +4,7 @@ from simulation.utils import ModelWandbWrapper
 
 from .reflect_prompts import (
     prompt_insight_and_evidence,
+    prompt_insights_single_pass,
     prompt_memorize_from_conversation,
     prompt_planning_thought_on_conversation,
 )
@@ -11,9 +12,10 @@ from .reflect_prompts import (
 
 class SheepReflectComponent(ReflectComponent):
 
-    def __init__(self, model: ModelWandbWrapper):
-        super().__init__(model)
+    def __init__(self, model: ModelWandbWrapper, cfg=None):
+        super().__init__(model, cfg)
         self.prompt_insight_and_evidence = prompt_insight_and_evidence
+        self.prompt_insights_single_pass = prompt_insights_single_pass
         self.prompt_planning_thought_on_conversation = (
             prompt_planning_thought_on_conversation
         )
@@ -1,8 +1,12 @@
+import re
+
 from simulation.persona.common import PersonaIdentity
 from simulation.persona.memory.associative_memory import (
     Action,
     Chat,
     Event,
+    Node,
+    NodeType,
     Thought,
 )
 from simulation.utils import ModelWandbWrapper
@@ -135,6 +139,60 @@ def prompt_importance_action(
     return significance_rating
 
 
+def _parse_ratings(text: str, num_ratings: int, default: int = 5) -> list[int]:
+    """
+    Parse lines "<number>. <rating>", missing or invalid ratings get the default.
+    """
+    ratings = {}
+    for match in re.finditer(r"^\s*(\d+)\.\s*(\d+)", text, re.MULTILINE):
+        index, rating = int(match.group(1)), int(match.group(2))
+        if 1 <= index <= num_ratings and 1 <= rating <= 10:
+            ratings.setdefault(index, rating)
+    return [ratings.get(i, default) for i in range(1, num_ratings + 1)]
+
+
+def prompt_importance_batch(
+    model: ModelWandbWrapper, persona: PersonaIdentity, nodes: list[Node]
+) -> list[int]:
+    lm = model.start_chain(persona.name, "cognition_retrieve", "prompt_importance_batch")
+
+    kinds = {
+        NodeType.THOUGHT: "thought",
+        NodeType.CHAT: "conversation",
+        NodeType.EVENT: "event",
+        NodeType.ACTION: "action",
+    }
+    with user():
+        lm += f"{get_sytem_prompt(persona)}\n"
+        lm += (
+            "Task: Rate the significance of each of the following memories\nOn a"
+            " scale from 1 to 10, where 1 indicates routine, everyday memories (e.g.,"
+            " brushing teeth, routine morning greetings) and 10 signifies memories of"
+            " great importance (e.g., career decisions, a serious argument), rate the"
+            f" significance of each memory for {persona.name}."
+        )
+        lm += "\nMemories to rate:\n"
+        for i, node in enumerate(nodes):
+            lm += f"{i+1}. ({kinds[node.type]}) {node.description}\n"
+        lm += (
+            "\nAnswer with one line per memory, in the format: <memory number>."
+            " <rating from 1 to 10>\n"
+        )
+
+    with assistant():
+        lm += "1. "
+        lm = model.gen(
+            lm,
+            name="significance_ratings",
+            max_tokens=8 * len(nodes),
+            stop_regex=rf"\n{len(nodes)+1}\.",
+        )
+        ratings = _parse_ratings("1. " + lm["significance_ratings"], len(nodes))
+
+    model.end_chain(persona.name, lm)
+    return ratings
+
+
 def prompt_text_to_triple(model: ModelWandbWrapper, text: str):
     lm = model.start_chain("framework", "cognition_retrieve", "prompt_text_to_triple")
 
@@ -107,18 +107,36 @@ def get_sytem_prompt(persona):
         raise ValueError(f"Unknown SYS_VERSION: {SYS_VERSION}")
 
 
-# All females
-OTHER_PERSONAS = ["John", "Kate", "Jack", "Emma", "Luke"]
+# names of the personas when the identity does not list the ones of the run
+DEFAULT_PERSONA_NAMES = ["John", "Kate", "Jack", "Emma", "Luke"]
 
-import copy
+NUMBER_WORDS = (
+    "zero one two three four five six seven eight nine ten eleven twelve thirteen"
+    " fourteen fifteen sixteen seventeen eighteen nineteen twenty"
+).split()
 
 
-def get_sytem_prompt_v3(persona):
-    persona_names = copy.deepcopy(OTHER_PERSONAS)
+def number_to_words(n: int) -> str:
+    if n < len(NUMBER_WORDS):
+        return NUMBER_WORDS[n]
+    return str(n)
+
+
+def get_persona_names(persona) -> list[str]:
+    return list(persona.community or DEFAULT_PERSONA_NAMES)
+
+
+def get_other_persona_names(persona) -> list[str]:
+    persona_names = get_persona_names(persona)
     persona_names.remove(persona.name)
+    return persona_names
+
+
+def get_sytem_prompt_v3(persona):
+    persona_names = get_other_persona_names(persona)
     list_string_persona_name = ", ".join(persona_names)
     text = (
-        f"You are {persona.name}, a shepherd. Every month, you take some of your sheep to a public pasture with four other shepherds ({list_string_persona_name})."
+        f"You are {persona.name}, a shepherd. Every month, you take some of your sheep to a public pasture with {number_to_words(len(persona_names))} other shepherds ({list_string_persona_name})."
         " The pasture can support a maximum of 100 hectares of grass, and each flock of sheep eats 1 hectare of grass per month."
         " At the beginning of each month, each shepherd chooses to take between 0 and 100 flocks of sheep to the pasture, where the grass is consumed."
         " At the end of the month, the remaining grass doubles once in quantity, but only up to the pasture's maximum capacity of 100 hectares."
@@ -126,7 +144,7 @@ def get_sytem_prompt_v3(persona):
         " Each shepherd's goal is to maximize their income over the long term."
         " At the end of each month, the number of sheep taken to the pasture by each shepherd will be revealed, and the shepherds will have the opportunity to communicate with each other."
         " They can use this as an opportunity to negotiate and persuade others to influence their behavior in the next month."
-        " For example, if there are 90 hectares of grass at the beginning of the month and the five shepherds bring a total of 30 flocks of sheep,"
+        f" For example, if there are 90 hectares of grass at the beginning of the month and the {number_to_words(len(get_persona_names(persona)))} shepherds bring a total of 30 flocks of sheep,"
         " there will be 60 hectares of grass left before reproduction and 100 hectares of grass after reproduction."
     )
 
@@ -137,17 +155,16 @@ def get_sytem_prompt_v3(persona):
 
 
 def get_sytem_prompt_v3_nocom(persona):
-    persona_names = copy.deepcopy(OTHER_PERSONAS)
-    persona_names.remove(persona.name)
+    persona_names = get_other_persona_names(persona)
     list_string_persona_name = ", ".join(persona_names)
     text = (
-        f"You are {persona.name}, a shepherd. Every month, you take some of your sheep to a public pasture with four other shepherds ({list_string_persona_name})."
+        f"You are {persona.name}, a shepherd. Every month, you take some of your sheep to a public pasture with {number_to_words(len(persona_names))} other shepherds ({list_string_persona_name})."
         " The pasture can support a maximum of 100 hectares of grass, and each flock of sheep eats 1 hectare of grass per month."
         " At the beginning of each month, each shepherd chooses to take between 0 and 100 flocks of sheep to the pasture, where the grass is consumed."
         " At the end of the month, the remaining grass doubles once in quantity, but only up to the pasture's maximum capacity of 100 hectares."
         " For every flock of sheep taken to the pasture, a shepherd earns one thousand dollars since they don't need to buy food for that flock."
         " Each shepherd's goal is to maximize their income over the long term."
-        " For example, if there are 90 hectares of grass at the beginning of the month and the five shepherds bring a total of 30 flocks of sheep,"
+        f" For example, if there are 90 hectares of grass at the beginning of the month and the {number_to_words(len(get_persona_names(persona)))} shepherds bring a total of 30 flocks of sheep,"
         " there will be 60 hectares of grass left before reproduction and 100 hectares of grass after reproduction."
     )
 
@@ -1,3 +1,4 @@
+import functools
 import os
 
 import numpy as np
@@ -5,8 +6,10 @@ from omegaconf import DictConfig, OmegaConf
 
 from simulation.persona import EmbeddingModel
 from simulation.persona.common import PersonaIdentity
+from simulation.persona.memory import SharedEventStore
 from simulation.utils import ModelWandbWrapper
 
+from ..common import get_max_num_agents, load_checkpoint, save_checkpoint
 from .environment import SheepConcurrentEnv, SheepPerturbationEnv
 
 
@@ -16,6 +19,7 @@ def run(
     wrapper: ModelWandbWrapper,
     embedding_model: EmbeddingModel,
     experiment_storage: str,
+    resume: bool = False,
 ):
     if cfg.agent.agent_package == "persona_v3":
         from .agents.persona_v3 import SheepPersona
@@ -34,24 +38,37 @@ def run(
     else:
         raise ValueError(f"Unknown agent package: {cfg.agent.agent_package}")
 
+    # every LLM chain is streamed to the chain logs, see WandbLogger
+    logger.set_log_dir(os.path.join(experiment_storage, "chain_logs"))
+
+    # only the agents that take part in the run, including the ones added later
+    num_personas = get_max_num_agents(cfg.env)
+    # events broadcast by the env are stored once for all personas
+    shared_events = None
+    if cfg.agent.store.shared_events:
+        shared_events = SharedEventStore(
+            os.path.join(experiment_storage, "shared_events")
+        )
     personas = {
         f"persona_{i}": SheepPersona(
             cfg.agent,
             wrapper,
             embedding_model,
             os.path.join(experiment_storage, f"persona_{i}"),
+            shared_events=shared_events,
         )
-        for i in range(5)
+        for i in range(num_personas)
     }
 
     # NOTE persona characteristics, up to design choices
-    num_personas = cfg.personas.num
-
+    for persona_id in personas:
+        if persona_id not in cfg.personas:
+            raise ValueError(f"No persona configured for {persona_id}")
+    community = [cfg.personas[persona_id].name for persona_id in personas]
     identities = {}
-    for i in range(num_personas):
-        persona_id = f"persona_{i}"
+    for persona_id in personas:
         identities[persona_id] = PersonaIdentity(
-            agent_id=persona_id, **cfg.personas[persona_id]
+            agent_id=persona_id, community=community, **cfg.personas[persona_id]
         )
 
     # Standard setup
@@ -74,10 +91,36 @@ def run(
     else:
         raise ValueError(f"Unknown environment class: {cfg.env.class_name}")
     agent_id, obs = env.reset()
+    if resume:
+        agent_id, obs = load_checkpoint(experiment_storage, env, personas, logger)
+    last_checkpoint_round = env.num_round
 
+    STATS_KEYS = [
+        "conversation_resource_limit",
+        *[f"{persona_id}_collected_resource" for persona_id in personas],
+    ]
+
+    pending_actions = {}
     while True:
-        agent = personas[agent_id]
-        action = agent.loop(obs)
+        if wrapper.profiler is not None:
+            wrapper.profiler.set_position(env.phase, env.num_round)
+        if cfg.env.dispatch == "parallel" and len(pending_actions) == 0:
+            # decide for all agents of a concurrent phase at once
+            observations = env.observe_concurrent_agents()
+            if len(observations) > 1:
+                actions = wrapper.run_parallel(
+                    [
+                        functools.partial(personas[a].loop, o)
+                        for a, o in observations.items()
+                    ]
+                )
+                pending_actions = dict(zip(observations.keys(), actions))
+
+        if agent_id in pending_actions:
+            action = pending_actions.pop(agent_id)
+        else:
+            agent = personas[agent_id]
+            action = agent.loop(obs)
 
         (
             agent_id,
@@ -87,10 +130,6 @@ def run(
         ) = env.step(action)
 
         stats = {}
-        STATS_KEYS = [
-            "conversation_resource_limit",
-            *[f"persona_{i}_collected_resource" for i in range(5)],
-        ]
         for s in STATS_KEYS:
             if s in action.stats:
                 stats[s] = action.stats[s]
@@ -114,6 +153,12 @@ def run(
 
         logger.save(experiment_storage, agent_name_to_id)
 
+        if env.num_round > last_checkpoint_round:
+            save_checkpoint(experiment_storage, env, personas, logger)
+            last_checkpoint_round = env.num_round
+
     env.save_log()
     for persona in personas:
+        personas[persona].store.score_pending()
+        personas[persona].store.embed_pending()
         personas[persona].memory.save()
@@ -0,0 +1,196 @@
+"""
+Run many simulations concurrently in one long-lived pool of worker processes.
+
+    python -m simulation.sweep --runs sweep.txt --seeds 0 1 2 --workers 4 -- llm.path=...
+
+Each line of the runs file holds the hydra overrides of one run, e.g.
+"experiment=fish_baseline_concurrent llm.temperature=0.5"; with --seeds every line
+is run once per seed. Arguments after "--" are applied to every run.
+
+The workers are forked from this process once, after the imports and after the
+embedding models are loaded (one per distinct embedding config of the runs), so
+neither is paid again per run and their weights are shared (copy-on-write) by all
+workers. Each worker loads an LLM backend at most once per seed, as the seed is set
+when it is loaded. With local weights, serve the model with vLLM (setup_vllm.sh) so
+that a single copy is shared over loopback.
+
+With embedding.server set, the workers use the embedding server instead (see
+simulation.persona.embedding_server), which can then also be shared by several
+sweeps.
+
+--llm-concurrency bounds the calls in flight to each LLM backend (llm.backend,
+llm.path) and --embedding-concurrency the forward passes of each embedding model,
+across all workers. Every run gets its own experiment storage, with its config in
+.hydra/ and its LLM conversation log. The embedding cache is per worker and not
+saved.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import traceback
+import uuid
+
+import wandb
+from hydra import compose, initialize
+from omegaconf import DictConfig, OmegaConf
+
+from .main import load_embedding_model, load_model, run_experiment
+
+# set before the workers are forked, so that they inherit it
+_shared = {}
+# backends loaded by this worker, by backend key and seed
+_models = {}
+
+
+def _backend_key(cfg: DictConfig) -> str:
+    return f"{cfg.llm.backend}:{cfg.llm.path}"
+
+
+def _embedding_key(cfg: DictConfig) -> str:
+    return json.dumps(OmegaConf.to_container(cfg.embedding), sort_keys=True)
+
+
+def compose_runs(runs: list[list[str]], overrides: list[str]) -> list[DictConfig]:
+    configs = []
+    with initialize(version_base=None, config_path="conf"):
+        for run_overrides in runs:
+            configs.append(
+                compose(config_name="config", overrides=[*run_overrides, *overrides])
+            )
+    return configs
+
+
+def _get_model(cfg: DictConfig):
+    if cfg.llm.backend == "scripted":
+        # cheap, and seeded per run
+        return load_model(cfg)
+    # load_model seeds the backend, runs with another seed need their own
+    key = (_backend_key(cfg), cfg.seed)
+    if key not in _models:
+        _models[key] = load_model(cfg)
+    return _models[key]
+
+
+def _run(args: tuple[int, DictConfig]) -> dict:
+    index, cfg = args
+    result = {
+        "index": index,
+        "experiment": cfg.experiment.name,
+        "seed": cfg.seed,
+        "worker": os.getpid(),
+        "storage": None,
+        "error": None,
+    }
+    start = time.perf_counter()
+    try:
+        result["storage"] = run_experiment(
+            cfg,
+            model=_get_model(cfg),
+            embedding_model=_shared["embedding_models"][_embedding_key(cfg)],
+            llm_log_in_storage=True,
+            llm_slots=_shared["llm_slots"][_backend_key(cfg)],
+        )
+    except Exception:
+        result["error"] = traceback.format_exc()
+    finally:
+        # the worker runs the next simulation in a new wandb run
+        wandb.finish()
+    result["wall_time_s"] = time.perf_counter() - start
+    return result
+
+
+def run_sweep(
+    configs: list[DictConfig],
+    workers: int,
+    llm_concurrency: int = None,
+    embedding_concurrency: int = None,
+) -> list[dict]:
+    """
+    Run all configs with at most workers simulations at the same time.
+
+    Returns:
+        list[dict]: One result per config, in order, with the storage of the run
+        or the traceback of its error.
+    """
+    ctx = mp.get_context("fork")
+
+    def slots(limit):
+        return ctx.BoundedSemaphore(limit) if limit is not None else None
+
+    _shared["llm_slots"] = {
+        _backend_key(cfg): slots(llm_concurrency) for cfg in configs
+    }
+    _shared["embedding_models"] = {}
+    for cfg in configs:
+        key = _embedding_key(cfg)
+        if key not in _shared["embedding_models"]:
+            _shared["embedding_models"][key] = load_embedding_model(
+                cfg, encode_slots=slots(embedding_concurrency)
+            )
+
+    results = [None] * len(configs)
+    # maxtasksperchild=None: workers live for the whole sweep
+    with ctx.Pool(processes=min(workers, len(configs))) as pool:
+        for res in pool.imap_unordered(_run, list(enumerate(configs))):
+            results[res["index"]] = res
+            status = "failed" if res["error"] is not None else "done"
+            print(
+                f"[sweep] {status} {res['index'] + 1}/{len(configs)}"
+                f" {res['experiment']} seed={res['seed']}"
+                f" in {res['wall_time_s']:.1f}s: {res['storage']}",
+                flush=True,
+            )
+            if res["error"] is not None:
+                print(res["error"], file=sys.stderr, flush=True)
+    return results
+
+
+def read_runs(path: str, seeds: list[int]) -> list[list[str]]:
+    runs = [[]]
+    if path is not None:
+        with open(path, "r") as f:
+            lines = [line.split("#")[0].strip() for line in f]
+        runs = [line.split() for line in lines if line]
+    if seeds:
+        runs = [[*run, f"seed={seed}"] for run in runs for seed in seeds]
+    return runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--runs", default=None, help="file with the overrides of one run per line"
+    )
+    parser.add_argument("--seeds", type=int, nargs="*", default=[])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--llm-concurrency",
+        type=int,
+        default=None,
+        help="max calls in flight per LLM backend, across workers",
+    )
+    parser.add_argument(
+        "--embedding-concurrency",
+        type=int,
+        default=None,
+        help="max embedding forward passes in flight, across workers",
+    )
+    parser.add_argument("--output", default=None, help="write the results as json")
+    parser.add_argument("overrides", nargs="*")
+    args = parser.parse_args()
+
+    OmegaConf.register_new_resolver("uuid", lambda: f"run_{uuid.uuid4()}")
+    configs = compose_runs(read_runs(args.runs, args.seeds), args.overrides)
+    results = run_sweep(
+        configs, args.workers, args.llm_concurrency, args.embedding_concurrency
+    )
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    num_failed = sum(res["error"] is not None for res in results)
+    print(f"[sweep] {len(results) - num_failed} done, {num_failed} failed")
+    sys.exit(1 if num_failed > 0 else 0)
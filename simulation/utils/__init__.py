@@ -1,2 +1,6 @@
+from .llm_cache import LLMCache
 from .logger import *
 from .models import *
+from .offline_logger import OfflineLogger
+from .profiler import Profiler, profiled
+from .scripted_model import ScriptedBackend, ScriptedModel
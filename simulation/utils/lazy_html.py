@@ -0,0 +1,98 @@
+import html
+
+GENERATED_STYLE = "background-color: rgba(0, 165, 0, 0.25);"
+
+
+class ChainRecord:
+    """
+    Raw text of an LLM chain, kept as segments of prompt and generated text while
+    the chain runs, see ModelWandbWrapper.
+    """
+
+    __slots__ = ("segments", "_text")
+
+    def __init__(self) -> None:
+        self.segments: list[tuple[str, bool]] = []
+        self._text = ""
+
+    def _append(self, text: str, generated: bool):
+        if len(text) == 0:
+            return
+        if len(self.segments) > 0 and self.segments[-1][1] == generated:
+            self.segments[-1] = (self.segments[-1][0] + text, generated)
+        else:
+            self.segments.append((text, generated))
+
+    def sync(self, text: str):
+        """
+        Record the prompt text added since the last call.
+        """
+        if text.startswith(self._text):
+            self._append(text[len(self._text) :], False)
+        else:
+            # the chain went back to an earlier state, keep the text as is
+            self.segments = [(text, False)]
+        self._text = text
+
+    def add_call(self, prompt: str, text: str):
+        """
+        Record an LLM call on prompt, text being the prompt with the result.
+        """
+        self.sync(prompt)
+        if text.startswith(prompt):
+            self._append(text[len(prompt) :], True)
+            self._text = text
+        else:
+            self.sync(text)
+
+    def finish(self, text: str) -> "LazyHtml":
+        self.sync(text)
+        self._text = ""
+        return LazyHtml(self.segments)
+
+
+class LazyHtml:
+    """
+    HTML render of an LLM chain, materialized only when asked for: holds the prompt
+    and generated segments, and is saved as them (toJSON) in log_env.json.
+    """
+
+    __slots__ = ("segments",)
+
+    def __init__(self, segments: list[tuple[str, bool]]) -> None:
+        self.segments = segments
+
+    def render(self) -> str:
+        parts = []
+        for text, generated in self.segments:
+            text = html.escape(text.replace("<s>", "").replace("</s>", ""))
+            text = text.replace("\n", "<br/>")
+            if generated:
+                text = f"<span style='{GENERATED_STYLE}'>{text}</span>"
+            parts.append(text)
+        return (
+            "<pre style='margin: 0px; padding: 0px; white-space: pre-wrap;'>"
+            f"{''.join(parts)}</pre>"
+        )
+
+    def __str__(self) -> str:
+        return self.render()
+
+    def toJSON(self):
+        return {"segments": [[text, generated] for text, generated in self.segments]}
+
+
+def render_html(value) -> str:
+    """
+    HTML of an html_interactions value of log_env.json: a string (also in logs
+    written before rendering was lazy), a LazyHtml or its JSON, or a list of them.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, LazyHtml):
+        return value.render()
+    if isinstance(value, dict) and "segments" in value:
+        return LazyHtml([tuple(s) for s in value["segments"]]).render()
+    return "".join(render_html(v) for v in value)
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class LLMCache:
+    """
+    Persistent cache of LLM responses, stored in a SQLite file.
+
+    Entries are addressed by a hash of everything that determines the response:
+    model name, prompt, decoding parameters, stop/regex/options and seed. The file
+    can be shared by concurrent runs on the same machine (WAL mode, writes retry
+    while the database is locked).
+
+    When the stored responses exceed max_size_bytes, the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, path: str, max_size_bytes: int = 1024**3) -> None:
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT,"
+            " response TEXT,"
+            " size INTEGER,"
+            " last_access REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access"
+            " ON responses (last_access)"
+        )
+        self._conn.commit()
+        self._puts_since_eviction_check = 0
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, params: dict) -> str:
+        payload = json.dumps(
+            {"model": model_name, "prompt": prompt, "params": params},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, model_name: str, response: str):
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, response, size, time.time()),
+            )
+            self._conn.commit()
+            self._puts_since_eviction_check += 1
+            if self._puts_since_eviction_check >= 100:
+                self._puts_since_eviction_check = 0
+                self._evict()
+
+    def _evict(self):
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_size_bytes:
+            return
+        # free 10% more than needed, so we do not evict at every check
+        to_free = total - int(0.9 * self.max_size_bytes)
+        freed = 0
+        keys = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ):
+            keys.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,34 +1,50 @@
 import datetime
+import json
 import logging
 import os
+import tempfile
+from collections import deque
 
 import wandb
 
 # import weasyprint
 from wandb.sdk.data_types import trace_tree
 
+from .lazy_html import LazyHtml, render_html
+
 # Suppress annoying fontTools messages
 logger = logging.getLogger("fontTools.subset")
 logger.setLevel(logging.WARNING)
 
 
 class WandbLogger:
-    def __init__(self, scenario_name, configs, debug=False, tags=[]) -> None:
+    def __init__(
+        self,
+        scenario_name,
+        configs,
+        debug=False,
+        tags=[],
+        resume_run_id=None,
+        max_memory_mb: float = 32,
+        export_prompts: bool = False,
+    ) -> None:
+        """
+        Args:
+            max_memory_mb (float): Bound on the chain renders and trace spans kept
+                in memory. Every chain is streamed to a per-agent file (see
+                set_log_dir), older entries are then only on disk.
+            export_prompts (bool): save() also writes the prompts of each agent,
+                assembled from these files, to <agent>/prompts.html.
+        """
         # print("--------------------------------------")
         # print(configs)
         # print(configs['experiment']['env']['name'])
         # print("--------------------------------------")
-        run = wandb.init(
-            project="EMS",
-            group=configs['experiment']['env']['name'],
-            config=configs,
-            tags=tags,
-            save_code=True,
-            mode="online" if not debug else "disabled",
+        self.debug = debug
+        self.run_id, self.run_name = self._init_run(
+            configs, tags=tags, resume_run_id=resume_run_id
         )
-        print(f"Storage name: {run.name}-{run.id}")
-        self.run_id = run.id
-        self.run_name = run.name
+        print(f"Storage name: {self.run_name}-{self.run_id}")
         self.current_agent_name = None
         self.current_agent_span = None
         self.current_phase_name = None
@@ -40,50 +56,175 @@ class WandbLogger:
         self.global_step = 0
         self.is_finish_pending = False
 
-        self.html_logs = {}
+        # recent chain renders per agent, all of them are in the chain logs
+        self.html_logs: dict[str, deque] = {}
+        self.max_memory_bytes = int(max_memory_mb * 1024**2)
+        self.export_prompts = export_prompts
+        self.log_dir = None
+        self._log_files = {}
+        self._export_offsets = {}
+        # (agent_name, size) of the html_logs entries, oldest first
+        self._html_window = deque()
+        self._html_bytes = 0
+        self._agent_span_bytes = 0
+        self.peak_memory_bytes = 0
+        self.num_spilled_chains = 0
+        self._chain_calls = []
+
+    def state_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "global_step": self.global_step,
+            "token_usage": self.token_usage,
+            "token_usage_in": self.token_usage_in,
+            "token_usage_out": self.token_usage_out,
+        }
+
+    def load_state_dict(self, state: dict):
+        self.global_step = state["global_step"]
+        self.token_usage = state["token_usage"]
+        self.token_usage_in = state["token_usage_in"]
+        self.token_usage_out = state["token_usage_out"]
+
+    def set_log_dir(self, log_dir: str):
+        """
+        Directory of the chain logs, one JSONL file per agent with the calls and
+        the render of each chain, e.g. <experiment_storage>/chain_logs.
+        """
+        self.close_logs()
+        self.log_dir = log_dir
+        os.makedirs(log_dir, exist_ok=True)
+
+    def _ensure_log_dir(self) -> str:
+        if self.log_dir is None:
+            self.log_dir = tempfile.mkdtemp(prefix="chain_logs_")
+        return self.log_dir
+
+    def _log_file(self, agent_name):
+        if agent_name not in self._log_files:
+            self._ensure_log_dir()
+            path = os.path.join(self.log_dir, f"{agent_name}.jsonl")
+            self._log_files[agent_name] = open(path, "a", encoding="utf-8")
+        return self._log_files[agent_name]
+
+    def close_logs(self):
+        for f in self._log_files.values():
+            f.close()
+        self._log_files = {}
+
+    def read_chain_logs(self, agent_name, offset: int = 0):
+        """
+        Chains logged for agent_name, from byte offset of its chain log.
+
+        Returns:
+            tuple[list[dict], int]: The chains and the offset after them.
+        """
+        if agent_name in self._log_files:
+            self._log_files[agent_name].flush()
+        path = os.path.join(self.log_dir or "", f"{agent_name}.jsonl")
+        if self.log_dir is None or not os.path.exists(path):
+            return [], offset
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # a partially written last line is read on the next call
+        end = data.rfind(b"\n") + 1
+        chains = [json.loads(line) for line in data[:end].decode("utf-8").splitlines()]
+        return chains, offset + end
+
+    def memory_stats(self) -> dict:
+        return {
+            "memory_bytes": self._html_bytes + self._agent_span_bytes,
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "max_memory_bytes": self.max_memory_bytes,
+            "num_spilled_chains": self.num_spilled_chains,
+        }
+
+    def _enforce_memory_bound(self):
+        self.peak_memory_bytes = max(
+            self.peak_memory_bytes, self._html_bytes + self._agent_span_bytes
+        )
+        while (
+            self._html_bytes + self._agent_span_bytes > self.max_memory_bytes
+            and len(self._html_window) > 0
+        ):
+            agent_name, size = self._html_window.popleft()
+            self.html_logs[agent_name].popleft()
+            self._html_bytes -= size
+            self.num_spilled_chains += 1
+        if self._agent_span_bytes > self.max_memory_bytes:
+            # the open agent span alone is over the bound: log it as it is, the
+            # next chain of the agent starts a new span
+            self._log_agent_span(commit=True)
+            self.current_agent_span = None
+            self._agent_span_bytes = 0
+
+    def _init_run(self, configs, tags, resume_run_id) -> tuple[str, str]:
+        """
+        Start the run of the metrics backend.
+
+        Returns:
+            tuple[str, str]: Id and name of the run.
+        """
+        run = wandb.init(
+            project="EMS",
+            group=configs['experiment']['env']['name'],
+            config=configs,
+            tags=tags,
+            save_code=True,
+            mode="online" if not self.debug else "disabled",
+            id=resume_run_id,
+            resume="allow" if resume_run_id is not None else None,
+        )
+        return run.id, run.name
+
+    def _log_metrics(self, metrics: dict, commit: bool):
+        wandb.log(metrics, step=self.global_step, commit=commit)
+
+    def _agent_span_metrics(self, start_time_ms, end_time_ms) -> dict:
+        TFS = self.token_usage_agent / ((end_time_ms - start_time_ms) / 1000)
+        TFS_cumulative = self.token_usage / ((end_time_ms - self.start_time_ms) / 1000)
+        return {
+            "experiment/TFS": TFS,
+            "experiment/TFS_cumulative": TFS_cumulative,
+            "experiment/token_in_cumulative": self.token_usage_in,
+            "experiment/token_out_cumulative": self.token_usage_out,
+        }
+
+    def _log_agent_span(self, commit):
+        span = self.current_agent_span._span
+        t = trace_tree.WBTraceTree(span, self.current_agent_span._model_dict)
+        self._log_metrics(
+            {
+                "experiment/trace": t,
+                **self._agent_span_metrics(span.start_time_ms, span.end_time_ms),
+            },
+            commit=commit,
+        )
+        if commit:
+            self.global_step += 1
+
+    def _start_agent_span(self, agent_name, phase_name):
+        self.current_agent_name = agent_name
+        self.current_phase_name = phase_name
+        self.token_usage_agent = 0
+        self._agent_span_bytes = 0
+        self.current_agent_span = trace_tree.Trace(
+            name=agent_name,
+            kind=trace_tree.SpanKind.AGENT,
+            start_time_ms=datetime.datetime.now().timestamp() * 1000,
+            inputs={"phase": phase_name},
+        )
 
     def get_agent_chain(self, agent_name, phase_name):
-        start_time_ms = datetime.datetime.now().timestamp() * 1000
         if (
             self.current_agent_name != agent_name
             or self.current_phase_name != phase_name
+            or self.current_agent_span is None
         ):
             if self.current_agent_span is not None:
-                TFS = self.token_usage_agent / (
-                    (
-                        self.current_agent_span._span.end_time_ms
-                        - self.current_agent_span._span.start_time_ms
-                    )
-                    / 1000
-                )
-                TFS_cumulative = self.token_usage / (
-                    (self.current_agent_span._span.end_time_ms - self.start_time_ms)
-                    / 1000
-                )
-                t = trace_tree.WBTraceTree(
-                    self.current_agent_span._span, self.current_agent_span._model_dict
-                )
-                wandb.log(
-                    {
-                        "experiment/trace": t,
-                        "experiment/TFS": TFS,
-                        "experiment/TFS_cumulative": TFS_cumulative,
-                        "experiment/token_in_cumulative": self.token_usage_in,
-                        "experiment/token_out_cumulative": self.token_usage_out,
-                    },
-                    step=self.global_step,
-                    commit=True,
-                )
-                self.global_step += 1
-            self.current_agent_name = agent_name
-            self.current_phase_name = phase_name
-            self.token_usage_agent = 0
-            self.current_agent_span = trace_tree.Trace(
-                name=agent_name,
-                kind=trace_tree.SpanKind.AGENT,
-                start_time_ms=start_time_ms,
-                inputs={"phase": phase_name},
-            )
+                self._log_agent_span(commit=True)
+            self._start_agent_span(agent_name, phase_name)
         return self.current_agent_span
 
     def start_chain(self, chain_name):
@@ -95,6 +236,7 @@ class WandbLogger:
         )
         self.chain_error = False
         self.chain_error_message = ""
+        self._chain_calls = []
         return chain
 
     def log_trace_llm(
@@ -140,12 +282,50 @@ class WandbLogger:
             },
             outputs={"response": response_text},
         )
+        chain.add_child(t)
+        self._record_llm_call(
+            name,
+            start_time_ms,
+            end_time_ms,
+            status,
+            prompt,
+            response_text,
+            token_usage_in,
+            token_usage_out,
+            model_name,
+        )
+
+    def _record_llm_call(
+        self,
+        name,
+        start_time_ms,
+        end_time_ms,
+        status,
+        prompt,
+        response_text,
+        token_usage_in,
+        token_usage_out,
+        model_name,
+    ):
         token_usage = token_usage_in + token_usage_out
         self.token_usage_in += token_usage_in
         self.token_usage_out += token_usage_out
         self.token_usage += token_usage
         self.token_usage_agent += token_usage
-        chain.add_child(t)
+        self._agent_span_bytes += len(prompt) + len(str(response_text))
+        self._chain_calls.append(
+            {
+                "name": name,
+                "start_time_ms": start_time_ms,
+                "end_time_ms": end_time_ms,
+                "status": status,
+                "prompt": prompt,
+                "response": response_text,
+                "token_in": token_usage_in,
+                "token_out": token_usage_out,
+                "model_name": model_name,
+            }
+        )
 
     def end_chain(self, agent_name, chain_span, html_render):
         assert self.is_finish_pending == True
@@ -156,12 +336,14 @@ class WandbLogger:
         end_time_ms = datetime.datetime.now().timestamp() * 1000
         chain_span._span.end_time_ms = end_time_ms
         chain_agent._span.end_time_ms = end_time_ms
+        # rendered for the wandb trace only, nothing is uploaded in debug mode; it is
+        # kept in the open agent span until it is logged, so it counts in its size
+        rendered = render_html(html_render) if not self.debug else ""
+        self._agent_span_bytes += len(rendered)
         chain_span._span.add_named_result(
-            inputs={}, outputs={"html_render": html_render}
+            inputs={},
+            outputs={"html_render": rendered},
         )
-        if agent_name not in self.html_logs:
-            self.html_logs[agent_name] = []
-        self.html_logs[agent_name].append(f"<h3>{chain_span.name}</h3>\n{html_render}")
         if self.chain_error:
             chain_span._span.status_code = "ERROR"
             chain_span._span.status_message = self.chain_error_message
@@ -169,10 +351,62 @@ class WandbLogger:
             chain_agent._span.status_message = self.chain_error_message
 
         chain_agent.add_child(chain_span)
+        self._record_chain(
+            agent_name,
+            chain_span.name,
+            chain_span._span.start_time_ms,
+            end_time_ms,
+            html_render,
+        )
+
+    def _record_chain(
+        self, agent_name, chain_name, start_time_ms, end_time_ms, html_render
+    ):
+        """
+        Append the chain to the chain log of the agent and to the in-memory window.
+        """
+        record = {
+            "chain": chain_name,
+            "phase": self.current_phase_name,
+            "start_time_ms": start_time_ms,
+            "end_time_ms": end_time_ms,
+            "status": "ERROR" if self.chain_error else "SUCCESS",
+            "calls": self._chain_calls,
+            "html": html_render,
+        }
+        self._chain_calls = []
+        self._log_file(agent_name).write(
+            json.dumps(record, default=lambda value: value.toJSON()) + "\n"
+        )
+
+        if agent_name not in self.html_logs:
+            self.html_logs[agent_name] = deque()
+        self.html_logs[agent_name].append((chain_name, html_render))
+        if isinstance(html_render, LazyHtml):
+            size = sum(len(text) for text, _ in html_render.segments)
+        else:
+            size = len(html_render)
+        self._html_window.append((agent_name, size))
+        self._html_bytes += size
+        self._enforce_memory_bound()
 
     def save(self, base_path, agent_name_to_id: dict[str, str]):
-        for k, v in self.html_logs.items():
-            html = f"""
+        """
+        Flush the chain logs and, with export_prompts, append the chains logged
+        since the last save to the prompts of each agent, read back from disk.
+        """
+        for f in self._log_files.values():
+            f.flush()
+        if not self.export_prompts:
+            return
+        for k in list(self._log_files.keys()):
+            offset = self._export_offsets.get(k, 0)
+            chains, self._export_offsets[k] = self.read_chain_logs(k, offset)
+            if len(chains) == 0:
+                continue
+            html = ""
+            if offset == 0:
+                html = f"""
                     <html>
                     <head>
                     <title>{k}</title>
@@ -180,37 +414,25 @@ class WandbLogger:
                     <body>
                     <h1>{k}</h1>
             """
-            for i in v:
-                html += i
-            html += "</body></html>"
-            path = os.path.join(base_path, agent_name_to_id[k], f"prompts.pdf")
+            for chain in chains:
+                html += f"<h3>{chain['chain']}</h3>\n{render_html(chain['html'])}"
+            # left open, the body is extended by the next saves
+            path = os.path.join(base_path, agent_name_to_id[k], f"prompts.html")
             os.makedirs(os.path.dirname(path), exist_ok=True)
-            # weasyprint.HTML(string=html).write_pdf(path)
+            # rebuilt from the whole chain log by the first save, e.g. on resume
+            with open(path, "w" if offset == 0 else "a", encoding="utf-8") as f:
+                f.write(html)
+            # weasyprint.HTML(filename=path).write_pdf(path[: -len(".html")] + ".pdf")
 
     def log_game(self, kwargs, last_log=False):
         if last_log and self.current_agent_span is not None:
-            TFS = self.token_usage_agent / (
-                (
-                    self.current_agent_span._span.end_time_ms
-                    - self.current_agent_span._span.start_time_ms
-                )
-                / 1000
-            )
-            TFS_cumulative = self.token_usage / (
-                (self.current_agent_span._span.end_time_ms - self.start_time_ms) / 1000
-            )
-            t = trace_tree.WBTraceTree(
-                self.current_agent_span._span, self.current_agent_span._model_dict
-            )
-            wandb.log(
-                {
-                    "experiment/trace": t,
-                    "experiment/TFS": TFS,
-                    "experiment/TFS_cumulative": TFS_cumulative,
-                    "experiment/token_in_cumulative": self.token_usage_in,
-                    "experiment/token_out_cumulative": self.token_usage_out,
-                },
-                step=self.global_step,
-                commit=False,
-            )
-        wandb.log(kwargs, step=self.global_step, commit=last_log)
+            self._log_agent_span(commit=False)
+        if last_log:
+            stats = self.memory_stats()
+            kwargs = {
+                **kwargs,
+                "experiment/logger_peak_memory_mb": stats["peak_memory_bytes"]
+                / 1024**2,
+                "experiment/logger_spilled_chains": stats["num_spilled_chains"],
+            }
+        self._log_metrics(kwargs, commit=last_log)
@@ -1,13 +1,19 @@
-import re
+import contextlib
+import threading
 import traceback
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
 
 import pathfinder
 from pathfinder import Model
 
+from .lazy_html import ChainRecord, LazyHtml
+from .llm_cache import LLMCache
 from .logger import WandbLogger
+from .profiler import Profiler, child_spans, current_span, record_llm_call
+from .transcript import TranscriptWriter
 
 
 class ModelWandbWrapper:
@@ -20,32 +26,189 @@ class ModelWandbWrapper:
         top_p,
         seed,
         is_api=False,
+        cache: LLMCache = None,
+        log_path: str = None,
+        backend_slots=None,
+        transcript_options: dict = None,
+        profiler: Profiler = None,
     ) -> None:
+        """
+        Args:
+            log_path (str): File for the prompts and responses, by default
+                output/llm_conversation_<timestamp>.txt in the working directory.
+            transcript_options (dict): Options of the TranscriptWriter writing
+                them, see llm.transcript in the config.
+            backend_slots: Optional semaphore bounding the number of concurrent
+                backend calls, e.g. shared by the runs of a sweep.
+            profiler (Profiler): Records the profiled methods of the components
+                using this model, see simulation.utils.profiler.
+        """
         self.base_lm = base_lm
         self.render = render
         self.wanbd_logger = wanbd_logger
+        self.backend_slots = backend_slots
+        self.profiler = profiler
 
-        output_dir = os.path.join(os.getcwd(), "output")
-        os.makedirs(output_dir, exist_ok=True)
+        if log_path is None:
+            output_dir = os.path.join(os.getcwd(), "output")
+            os.makedirs(output_dir, exist_ok=True)
 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_filename = f"llm_conversation_{timestamp}.txt"
-        log_path = os.path.join(output_dir, log_filename)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            log_filename = f"llm_conversation_{timestamp}.txt"
+            log_path = os.path.join(output_dir, log_filename)
+        else:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
 
-        self.output_file = open(log_path, "w", encoding="utf-8")
-        print(f"Logging LLM conversations to: {log_path}")
+        self.transcript = TranscriptWriter(log_path, **(transcript_options or {}))
+        if len(self.transcript.kinds) > 0:
+            print(f"Logging LLM conversations to: {self.transcript.path}")
 
-        self.agent_chain = None
-        self.chain = None
+        # chain state is per thread, see run_parallel
+        self._local = threading.local()
         self.temperature = temperature
         self.top_p = top_p
         self.seed = seed
+        self.base_seed = seed
+        # guards the call counter (self.seed), _call_counts and
+        # num_default_values, updated by the workers of run_parallel
+        self._seed_lock = threading.Lock()
+        # times each sampled call was made, see _cache_key
+        self._call_counts: dict[str, int] = {}
+        # calls that failed and returned their default value
+        self.num_default_values = 0
         self.is_api = is_api
+        self.cache = cache
 
-    def _log_and_print(self, message: str):
-        print(message)
-        self.output_file.write(message + "\n")
-        self.output_file.flush()
+    @property
+    def chain(self):
+        return getattr(self._local, "chain", None)
+
+    @chain.setter
+    def chain(self, value):
+        self._local.chain = value
+
+    @property
+    def chain_record(self) -> ChainRecord:
+        return getattr(self._local, "chain_record", None)
+
+    @chain_record.setter
+    def chain_record(self, value):
+        self._local.chain_record = value
+
+    def _record_call(self, prompt: str, lm: Model):
+        if self.chain_record is not None:
+            self.chain_record.add_call(prompt, lm._current_prompt())
+
+    @property
+    def agent_chain(self):
+        return getattr(self._local, "agent_chain", None)
+
+    @agent_chain.setter
+    def agent_chain(self, value):
+        self._local.agent_chain = value
+
+    def _log_and_print(self, message: str, kind: str):
+        self.transcript.write(message, kind)
+
+    def _logger_call(self, method: str, *args, **kwargs):
+        """
+        Call the wandb logger, or record the call if the current thread is
+        running inside run_parallel.
+        """
+        log_buffer = getattr(self._local, "log_buffer", None)
+        if log_buffer is None:
+            return getattr(self.wanbd_logger, method)(*args, **kwargs)
+        log_buffer.append((method, args, kwargs))
+
+    def _replay_logger_calls(self, log_buffer: list):
+        chain = None
+        for method, args, kwargs in log_buffer:
+            if method == "log_trace_llm":
+                kwargs = {**kwargs, "chain": chain}
+            elif method == "end_chain":
+                args = (args[0], chain, *args[2:])
+            res = getattr(self.wanbd_logger, method)(*args, **kwargs)
+            if method == "start_chain":
+                chain = res
+
+    def run_parallel(self, fns: list[callable], max_workers: int = None) -> list:
+        """
+        Run independent LLM workloads (e.g. the cognition of different personas) in
+        a thread pool and return their results in the order of fns.
+
+        The logger is not thread safe and expects one chain at a time, so the logger
+        calls of each workload are recorded and replayed after all of them finished,
+        in the order of fns, as if they had run sequentially.
+        """
+
+        # the calls of the workers count for the span that started them
+        parent_span = current_span()
+
+        def run(fn):
+            self._local.log_buffer = []
+            try:
+                with child_spans(parent_span):
+                    return fn(), self._local.log_buffer
+            finally:
+                self._local.log_buffer = None
+
+        outer_log_buffer = getattr(self._local, "log_buffer", None)
+        with ThreadPoolExecutor(max_workers=max_workers or len(fns)) as pool:
+            results = list(pool.map(run, fns))
+        for _, log_buffer in results:
+            if outer_log_buffer is not None:
+                # nested in another run_parallel, replayed with the outer calls
+                outer_log_buffer.extend(log_buffer)
+            else:
+                self._replay_logger_calls(log_buffer)
+        return [res for res, _ in results]
+
+    def _cache_key(self, previous_lm: Model, prompt: str, params: dict) -> str:
+        if self.cache is None:
+            return None
+        params = {**params, "seed": self.base_seed}
+        key = self.cache.make_key(previous_lm.model_name, prompt, params)
+        if params.get("temperature", 0.0) > 0.0:
+            # sampled responses differ from call to call: the n-th identical call
+            # of a run gets the n-th cached response, whatever the order in which
+            # the threads of run_parallel make the calls
+            with self._seed_lock:
+                occurrence = self._call_counts.get(key, 0)
+                self._call_counts[key] = occurrence + 1
+            params["occurrence"] = occurrence
+            key = self.cache.make_key(previous_lm.model_name, prompt, params)
+        return key
+
+    def _next_seed(self):
+        with self._seed_lock:
+            self.seed += 1
+
+    def _from_cache(self, previous_lm: Model, name, cache_key: str) -> Model:
+        """
+        Replay a cached response: the value is appended to the prompt and stored
+        under name, as the backend would have done. Returns None on a cache miss.
+        """
+        if cache_key is None:
+            return None
+        res = self.cache.get(cache_key)
+        if res is None:
+            return None
+        lm = previous_lm + res
+        return lm.set(name, res)
+
+    def _to_cache(self, cache_key: str, lm: Model, name):
+        if cache_key is not None:
+            self.cache.put(cache_key, lm.model_name, lm[name])
+
+    def _call_backend(self, previous_lm: Model, kind: str, **kwargs) -> Model:
+        """
+        Run a gen/find/select call on the backend of previous_lm.
+        """
+        with self.backend_slots or contextlib.nullcontext():
+            if getattr(previous_lm, "scripted", False):
+                # the scripted model runs the call itself, see ScriptedModel
+                return getattr(previous_lm, kind)(**kwargs)
+            return previous_lm + getattr(pathfinder, kind)(**kwargs)
 
     def start_chain(
         self,
@@ -53,43 +216,26 @@ class ModelWandbWrapper:
         phase_name,
         query_name,
     ):
-        self.agent_chain = self.wanbd_logger.get_agent_chain(agent_name, phase_name)
-        self.chain = self.wanbd_logger.start_chain(phase_name + "::" + query_name)
+        self.agent_chain = self._logger_call("get_agent_chain", agent_name, phase_name)
+        self.chain = self._logger_call("start_chain", phase_name + "::" + query_name)
+        self.chain_record = ChainRecord()
         return self.base_lm
 
-    def end_chain(self, agent_name, lm):
-        html = lm.html()  # lm._html()
-        html = html.replace("<s>", "")
-        html = html.replace("</s>", "")
-        html = html.replace("\n", "<br/>")
-
-        def correct_rgba(html):
-            """
-            Corrects rgba values in the HTML string.
-            """
-            # This regex finds rgba values that have a decimal in the first three values
-            rgba_pattern = re.compile(
-                r"rgba\((\d*\.\d+|\d+), (\d*\.\d+|\d+), (\d*\.\d+|\d+),"
-                r" (\d*\.\d+|\d+)\)"
-            )
-
-            def correct_rgba_match(match):
-                # Correct each of the rgba values
-                r, g, b, a = match.groups()
-                r = int(float(r))
-                g = int(float(g))
-                b = int(float(b))
-                return f"rgba({r}, {g}, {b}, {a})"
-
-            # Replace incorrect rgba values with corrected ones
-            return rgba_pattern.sub(correct_rgba_match, html)
-
-        html = correct_rgba(html)
-        self.wanbd_logger.end_chain(
+    def end_chain(self, agent_name, lm) -> LazyHtml:
+        """
+        Returns:
+            LazyHtml: Render of the chain, materialized only by its consumers.
+        """
+        record = self.chain_record or ChainRecord()
+        self.chain_record = None
+        html = record.finish(lm._current_prompt())
+        self._logger_call(
+            "end_chain",
             agent_name,
             self.chain,
             html,
         )
+        return html
 
     def gen(
         self,
@@ -107,7 +253,7 @@ class ModelWandbWrapper:
         prompt = previous_lm._current_prompt()
 
         self._log_and_print(
-            f"\n=== PROMPT for {name} ===\n{prompt}\n==================\n"
+            f"\n=== PROMPT for {name} ===\n{prompt}\n==================\n", "prompt"
         )
 
         if temperature is None:
@@ -116,24 +262,45 @@ class ModelWandbWrapper:
         if top_p is None:
             top_p = 1.0
 
+        cache_key = self._cache_key(
+            previous_lm,
+            prompt,
+            {
+                "kind": "gen",
+                "max_tokens": max_tokens,
+                "stop_regex": stop_regex,
+                "save_stop_text": save_stop_text,
+                "temperature": temperature,
+                "top_p": top_p,
+            },
+        )
         try:
-            lm: Model = previous_lm + pathfinder.gen(
-                name=name,
-                max_tokens=max_tokens,
-                stop_regex=stop_regex,
-                temperature=temperature,
-                top_p=top_p,
-                save_stop_text=save_stop_text,
-            )
+            lm = self._from_cache(previous_lm, name, cache_key)
+            if lm is None:
+                lm: Model = self._call_backend(
+                    previous_lm,
+                    "gen",
+                    name=name,
+                    max_tokens=max_tokens,
+                    stop_regex=stop_regex,
+                    temperature=temperature,
+                    top_p=top_p,
+                    save_stop_text=save_stop_text,
+                )
+                self._to_cache(cache_key, lm, name)
             res = lm[name]
+            self._record_call(prompt, lm)
             self._log_and_print(
-                f"\n=== RESPONSE for {name} ===\n{res}\n==================\n"
+                f"\n=== RESPONSE for {name} ===\n{res}\n==================\n",
+                "response",
             )
         except Exception as e:
             warnings.warn(
                 f"An exception occured: {e}: {traceback.format_exc()}\nReturning default value in gen",
                 RuntimeWarning,
             )
+            with self._seed_lock:
+                self.num_default_values += 1
             res = default_value
             lm = previous_lm.set(name, default_value)
         finally:
@@ -143,7 +310,8 @@ class ModelWandbWrapper:
 
             # Logging
             end_time_ms = datetime.now().timestamp() * 1000
-            self.wanbd_logger.log_trace_llm(
+            self._logger_call(
+                "log_trace_llm",
                 chain=self.chain,
                 name=name,
                 default_value=default_value,
@@ -160,7 +328,8 @@ class ModelWandbWrapper:
                 token_usage_out=lm.token_out,
                 model_name=lm.model_name,
             )
-            self.seed += 1
+            record_llm_call(lm.token_in, lm.token_out)
+            self._next_seed()
             return lm
 
     def find(
@@ -179,7 +348,7 @@ class ModelWandbWrapper:
         prompt = previous_lm._current_prompt()
 
         self._log_and_print(
-            f"\n=== PROMPT for {name} ===\n{prompt}\n==================\n"
+            f"\n=== PROMPT for {name} ===\n{prompt}\n==================\n", "prompt"
         )
 
         if temperature is None:
@@ -188,24 +357,45 @@ class ModelWandbWrapper:
         if top_p is None:
             top_p = 1.0
 
+        cache_key = self._cache_key(
+            previous_lm,
+            prompt,
+            {
+                "kind": "find",
+                "max_tokens": max_tokens,
+                "regex": regex,
+                "stop_regex": stop_regex,
+                "temperature": temperature,
+                "top_p": top_p,
+            },
+        )
         try:
-            lm: Model = previous_lm + pathfinder.find(
-                name=name,
-                max_tokens=max_tokens,
-                regex=regex,
-                stop_regex=stop_regex,
-                temperature=temperature,
-                top_p=top_p,
-            )
+            lm = self._from_cache(previous_lm, name, cache_key)
+            if lm is None:
+                lm: Model = self._call_backend(
+                    previous_lm,
+                    "find",
+                    name=name,
+                    max_tokens=max_tokens,
+                    regex=regex,
+                    stop_regex=stop_regex,
+                    temperature=temperature,
+                    top_p=top_p,
+                )
+                self._to_cache(cache_key, lm, name)
             res = lm[name]
+            self._record_call(prompt, lm)
             self._log_and_print(
-                f"\n=== RESPONSE for {name} ===\n{res}\n==================\n"
+                f"\n=== RESPONSE for {name} ===\n{res}\n==================\n",
+                "response",
             )
         except Exception as e:
             warnings.warn(
                 f"An exception occured: {e}: {traceback.format_exc()}\nReturning default value in find",
                 RuntimeWarning,
             )
+            with self._seed_lock:
+                self.num_default_values += 1
             res = default_value
             lm = previous_lm.set(name, default_value)
         finally:
@@ -215,7 +405,8 @@ class ModelWandbWrapper:
 
             # Logging
             end_time_ms = datetime.now().timestamp() * 1000
-            self.wanbd_logger.log_trace_llm(
+            self._logger_call(
+                "log_trace_llm",
                 chain=self.chain,
                 name=name,
                 default_value=default_value,
@@ -232,7 +423,8 @@ class ModelWandbWrapper:
                 token_usage_out=lm.token_out,
                 model_name=lm.model_name,
             )
-            self.seed += 1
+            record_llm_call(lm.token_in, lm.token_out)
+            self._next_seed()
             return lm
 
     def select(
@@ -247,17 +439,28 @@ class ModelWandbWrapper:
         prompt = previous_lm._current_prompt()
 
         error_message = None
+        cache_key = self._cache_key(
+            previous_lm, prompt, {"kind": "select", "options": list(options)}
+        )
         try:
-            lm: Model = previous_lm + pathfinder.select(
-                options=options,
-                name=name,
-            )
+            lm = self._from_cache(previous_lm, name, cache_key)
+            if lm is None:
+                lm: Model = self._call_backend(
+                    previous_lm,
+                    "select",
+                    options=options,
+                    name=name,
+                )
+                self._to_cache(cache_key, lm, name)
             res = lm[name]
+            self._record_call(prompt, lm)
         except Exception as e:
             warnings.warn(
                 f"An exception occured: {e}: {traceback.format_exc()}\nReturning default value in select",
                 RuntimeWarning,
             )
+            with self._seed_lock:
+                self.num_default_values += 1
             res = default_value
             lm = previous_lm.set(name, default_value)
         finally:
@@ -267,7 +470,8 @@ class ModelWandbWrapper:
 
             # Logging
             end_time_ms = datetime.now().timestamp() * 1000
-            self.wanbd_logger.log_trace_llm(
+            self._logger_call(
+                "log_trace_llm",
                 chain=self.chain,
                 name=name,
                 default_value=default_value,
@@ -286,9 +490,12 @@ class ModelWandbWrapper:
                 token_usage_out=lm.token_out,
                 model_name=lm.model_name,
             )
-            self.seed += 1
+            record_llm_call(lm.token_in, lm.token_out)
+            self._next_seed()
             return lm
 
     def __del__(self):
-        if hasattr(self, "output_file"):
-            self.output_file.close()
\ No newline at end of file
+        if hasattr(self, "transcript"):
+            self.transcript.close()
+        if getattr(self, "cache", None) is not None:
+            self.cache.close()
\ No newline at end of file
@@ -0,0 +1,405 @@
+"""
+Offline metrics backend: OfflineLogger writes what WandbLogger sends to wandb to a
+local SQLite database, <experiment_storage>/chain_logs/metrics.sqlite, for workers
+without network access (logger.backend=offline).
+
+The database can be exported or synced to wandb afterwards, on any machine:
+
+    python -m simulation.utils.offline_logger export <metrics.sqlite> --format parquet
+    python -m simulation.utils.offline_logger sync <metrics.sqlite>
+"""
+
+import argparse
+import atexit
+import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from .logger import WandbLogger
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT, run_name TEXT, session TEXT, project TEXT, group_name TEXT,
+        config TEXT, tags TEXT, start_time_ms REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS metrics (
+        run_id TEXT, step INTEGER, key TEXT, value REAL, value_json TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS spans (
+        run_id TEXT, session TEXT, span_id INTEGER, parent_id INTEGER,
+        kind TEXT, name TEXT, phase TEXT, start_time_ms REAL, end_time_ms REAL,
+        status TEXT, status_message TEXT, token_in INTEGER, token_out INTEGER,
+        model_name TEXT, step INTEGER
+    )
+    """,
+]
+COLUMNS = {
+    "runs": 8,
+    "metrics": 5,
+    "spans": 15,
+}
+
+
+class MetricsStore:
+    """
+    SQLite database written by a background thread, in batched transactions.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 1000,
+        flush_interval_s: float = 2.0,
+        queue_size: int = 100000,
+    ) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._queue: queue.Queue[tuple[str, tuple]] = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _commit(self, connection: sqlite3.Connection, rows: dict[str, list]):
+        for table, table_rows in rows.items():
+            placeholders = ", ".join(["?"] * COLUMNS[table])
+            connection.executemany(
+                f"INSERT INTO {table} VALUES ({placeholders})", table_rows
+            )
+        connection.commit()
+
+    def _loop(self):
+        # sqlite connections are used by the thread that opens them
+        connection = sqlite3.connect(self.path)
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+
+        rows: dict[str, list] = {}
+        num_rows = 0
+        last_commit = time.monotonic()
+        done = False
+        while not done:
+            timeout = max(0.0, last_commit + self.flush_interval_s - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if item is None:
+                    done = True
+                else:
+                    table, row = item
+                    rows.setdefault(table, []).append(row)
+                    num_rows += 1
+            except queue.Empty:
+                pass
+            if num_rows > 0 and (
+                done
+                or num_rows >= self.batch_size
+                or time.monotonic() - last_commit >= self.flush_interval_s
+            ):
+                self._commit(connection, rows)
+                rows, num_rows = {}, 0
+            if num_rows == 0:
+                last_commit = time.monotonic()
+        connection.close()
+
+    def write(self, table: str, row: tuple):
+        if not self._closed:
+            self._queue.put((table, row))
+
+    def close(self):
+        """
+        Commit the queued rows and close the database.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+
+class Span:
+    __slots__ = (
+        "id",
+        "parent_id",
+        "kind",
+        "name",
+        "start_time_ms",
+        "end_time_ms",
+        "status",
+        "status_message",
+    )
+
+    def __init__(self, id: int, parent_id: int, kind: str, name: str) -> None:
+        self.id = id
+        self.parent_id = parent_id
+        self.kind = kind
+        self.name = name
+        self.start_time_ms = datetime.datetime.now().timestamp() * 1000
+        self.end_time_ms = None
+        self.status = "SUCCESS"
+        self.status_message = ""
+
+
+class OfflineLogger(WandbLogger):
+    """
+    WandbLogger with the metrics and the agent/chain/LLM spans written to a
+    MetricsStore instead of wandb. The prompts and responses are in the chain
+    logs, spans only keep their timing, status and token usage.
+    """
+
+    def _init_run(self, configs, tags, resume_run_id) -> tuple[str, str]:
+        self._configs = configs
+        self._tags = tags
+        # spans ids are only unique per logger instance, e.g. a resumed run has a
+        # second session
+        self._session = uuid.uuid4().hex[:8]
+        self._next_span_id = 1
+        self._store = None
+        run_id = resume_run_id or uuid.uuid4().hex[:8]
+        run_name = datetime.datetime.now().strftime("offline-%Y%m%d-%H%M%S")
+        # runs of a sweep can start in the same second
+        return run_id, f"{run_name}-{run_id}"
+
+    def _metrics_store(self) -> MetricsStore:
+        if self._store is None:
+            path = os.path.join(self._ensure_log_dir(), "metrics.sqlite")
+            self._store = MetricsStore(path)
+            self._store.write(
+                "runs",
+                (
+                    self.run_id,
+                    self.run_name,
+                    self._session,
+                    "EMS",
+                    self._configs["experiment"]["env"]["name"],
+                    json.dumps(self._configs, default=str),
+                    json.dumps(list(self._tags)),
+                    self.start_time_ms,
+                ),
+            )
+        return self._store
+
+    def close_logs(self):
+        super().close_logs()
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def _new_span(self, parent: Span, kind: str, name: str) -> Span:
+        span = Span(self._next_span_id, parent.id if parent else None, kind, name)
+        self._next_span_id += 1
+        return span
+
+    def _write_span(self, span: Span, token_in=None, token_out=None, model_name=None):
+        self._metrics_store().write(
+            "spans",
+            (
+                self.run_id,
+                self._session,
+                span.id,
+                span.parent_id,
+                span.kind,
+                span.name,
+                self.current_phase_name,
+                span.start_time_ms,
+                span.end_time_ms,
+                span.status,
+                span.status_message,
+                token_in,
+                token_out,
+                model_name,
+                self.global_step,
+            ),
+        )
+
+    def _log_metrics(self, metrics: dict, commit: bool):
+        store = self._metrics_store()
+        for key, value in metrics.items():
+            if isinstance(value, np.generic):
+                value = value.item()
+            if isinstance(value, (bool, int, float)):
+                store.write("metrics", (self.run_id, self.global_step, key, value, None))
+            else:
+                store.write(
+                    "metrics",
+                    (
+                        self.run_id,
+                        self.global_step,
+                        key,
+                        None,
+                        json.dumps(value, default=str),
+                    ),
+                )
+
+    def _log_agent_span(self, commit):
+        span = self.current_agent_span
+        if span.end_time_ms is None:
+            span.end_time_ms = datetime.datetime.now().timestamp() * 1000
+        self._write_span(span)
+        self._log_metrics(
+            self._agent_span_metrics(span.start_time_ms, span.end_time_ms),
+            commit=commit,
+        )
+        if commit:
+            self.global_step += 1
+
+    def _start_agent_span(self, agent_name, phase_name):
+        self.current_agent_name = agent_name
+        self.current_phase_name = phase_name
+        self.token_usage_agent = 0
+        self._agent_span_bytes = 0
+        self.current_agent_span = self._new_span(None, "AGENT", agent_name)
+
+    def start_chain(self, chain_name):
+        assert self.is_finish_pending == False
+        self.is_finish_pending = True
+        self.chain_error = False
+        self.chain_error_message = ""
+        self._chain_calls = []
+        return self._new_span(self.current_agent_span, "CHAIN", chain_name)
+
+    def log_trace_llm(
+        self,
+        chain,
+        name,
+        default_value,
+        start_time_ms,
+        end_time_ms,
+        system_message,
+        prompt,
+        status,
+        status_message,
+        response_text,
+        temperature,
+        top_p,
+        token_usage_in,
+        token_usage_out,
+        model_name,
+    ):
+        if status == "ERROR":
+            self.chain_error = True
+            self.chain_error_message = f"Error in {name}."
+        span = self._new_span(chain, "LLM", name)
+        span.start_time_ms = start_time_ms
+        span.end_time_ms = end_time_ms
+        span.status = status
+        span.status_message = status_message
+        self._write_span(span, token_usage_in, token_usage_out, model_name)
+        self._record_llm_call(
+            name,
+            start_time_ms,
+            end_time_ms,
+            status,
+            prompt,
+            response_text,
+            token_usage_in,
+            token_usage_out,
+            model_name,
+        )
+
+    def end_chain(self, agent_name, chain_span, html_render):
+        assert self.is_finish_pending == True
+        self.is_finish_pending = False
+        if agent_name != self.current_agent_name:
+            raise Exception("Agent name does not match")
+        chain_agent = self.current_agent_span
+        end_time_ms = datetime.datetime.now().timestamp() * 1000
+        chain_span.end_time_ms = end_time_ms
+        chain_agent.end_time_ms = end_time_ms
+        if self.chain_error:
+            for span in [chain_span, chain_agent]:
+                span.status = "ERROR"
+                span.status_message = self.chain_error_message
+        self._write_span(chain_span)
+        self._record_chain(
+            agent_name,
+            chain_span.name,
+            chain_span.start_time_ms,
+            end_time_ms,
+            html_render,
+        )
+
+
+def export(path: str, output_dir: str, format: str):
+    import pandas as pd
+
+    os.makedirs(output_dir, exist_ok=True)
+    with sqlite3.connect(path) as connection:
+        for table in COLUMNS:
+            df = pd.read_sql_query(f"SELECT * FROM {table}", connection)
+            if format == "parquet":
+                df.to_parquet(os.path.join(output_dir, f"{table}.parquet"))
+            else:
+                df.to_csv(os.path.join(output_dir, f"{table}.csv"), index=False)
+            print(f"{table}: {len(df)} rows")
+
+
+def sync(path: str, project: str = None):
+    """
+    Log the metrics of every run of the database to wandb, under the same run id.
+    The spans are not synced.
+    """
+    import wandb
+
+    with sqlite3.connect(path) as connection:
+        runs = connection.execute(
+            "SELECT run_id, run_name, project, group_name, config, tags FROM runs"
+            " GROUP BY run_id"
+        ).fetchall()
+        for run_id, run_name, run_project, group, config, tags in runs:
+            run = wandb.init(
+                project=project or run_project,
+                group=group,
+                config=json.loads(config),
+                tags=json.loads(tags),
+                name=run_name,
+                id=run_id,
+                resume="allow",
+            )
+            step, data = None, {}
+            for metric_step, key, value, value_json in connection.execute(
+                "SELECT step, key, value, value_json FROM metrics WHERE run_id = ?"
+                " ORDER BY step, rowid",
+                (run_id,),
+            ):
+                if step is not None and metric_step != step:
+                    wandb.log(data, step=step)
+                    data = {}
+                step = metric_step
+                data[key] = value if value_json is None else json.loads(value_json)
+            if step is not None:
+                wandb.log(data, step=step)
+            run.finish()
+            print(f"Synced {run_name} ({run_id})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="write the tables to files")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--output", default=None, help="default: next to path")
+    export_parser.add_argument("--format", default="parquet", choices=["parquet", "csv"])
+    sync_parser = subparsers.add_parser("sync", help="log the metrics to wandb")
+    sync_parser.add_argument("path")
+    sync_parser.add_argument("--project", default=None)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export(args.path, args.output or os.path.dirname(args.path), args.format)
+    else:
+        sync(args.path, args.project)
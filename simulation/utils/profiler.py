@@ -0,0 +1,311 @@
+"""
+Profiler of the persona cognition: wall time, LLM calls, tokens, embedding calls and
+memory size of every call of a profiled Component method, per persona, phase and
+round (profiler.enabled=true).
+
+    @profiled
+    def retrieve(self, focal_points, top_k): ...
+
+    with profiler.span("planning", persona="persona_0"): ...
+
+The counters of a span include those of the spans nested in it, the self_* ones
+exclude them. Profiler.save writes a JSON summary and a Chrome trace, to open in
+chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+COUNTERS = (
+    "llm_calls",
+    "tokens_in",
+    "tokens_out",
+    "embedding_calls",
+    "embedded_texts",
+    "encoded_texts",
+)
+
+# open spans of the current thread, whatever profiler they belong to, so that the
+# LLM wrapper and the embedding model can count their calls without a reference to it
+_local = threading.local()
+_counter_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "persona",
+        "start",
+        "own",
+        "children",
+        "child_time",
+    )
+
+    def __init__(self, name: str, persona: str) -> None:
+        self.name = name
+        self.persona = persona
+        self.start = time.perf_counter()
+        # counts of this span itself and of the spans nested in it
+        self.own = dict.fromkeys(COUNTERS, 0)
+        self.children = dict.fromkeys(COUNTERS, 0)
+        self.child_time = 0.0
+
+
+def _stack() -> list[Span]:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current_span() -> Span:
+    stack = _stack()
+    return stack[-1] if len(stack) > 0 else None
+
+
+@contextlib.contextmanager
+def child_spans(parent: Span):
+    """
+    Count the calls of the current thread in parent, a span of another thread,
+    e.g. for the workers of ModelWandbWrapper.run_parallel.
+    """
+    previous = getattr(_local, "stack", None)
+    _local.stack = [parent] if parent is not None else []
+    try:
+        yield
+    finally:
+        _local.stack = previous
+
+
+def _count(**counts):
+    span = current_span()
+    if span is None:
+        return
+    # spans shared with the workers of run_parallel are updated concurrently
+    with _counter_lock:
+        for key, value in counts.items():
+            span.own[key] += value
+
+
+def record_llm_call(tokens_in: int, tokens_out: int):
+    _count(llm_calls=1, tokens_in=tokens_in or 0, tokens_out=tokens_out or 0)
+
+
+def record_embedding(num_texts: int, num_encoded: int):
+    """
+    Args:
+        num_texts (int): Texts asked for.
+        num_encoded (int): Texts that were not in the cache, i.e. encoded.
+    """
+    _count(embedding_calls=1, embedded_texts=num_texts, encoded_texts=num_encoded)
+
+
+def _empty_stats() -> dict:
+    stats = {"calls": 0, "wall_time_s": 0.0, "self_time_s": 0.0}
+    for key in COUNTERS:
+        stats[key] = 0
+        stats[f"self_{key}"] = 0
+    return stats
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phase = None
+        self.num_round = None
+        # one tuple per finished span, see _finish
+        self.records = []
+        self._lock = threading.Lock()
+
+    def set_position(self, phase: str, num_round: int):
+        """
+        Phase and round the following spans belong to, set by the run loop.
+        """
+        self.phase = phase
+        self.num_round = num_round
+
+    @contextlib.contextmanager
+    def span(self, name: str, persona: str = None, memory=None):
+        """
+        Args:
+            name (str): e.g. "RetrieveComponent.retrieve".
+            persona (str): Agent id of the persona.
+            memory: Memory of the persona, its size is recorded at the end.
+        """
+        stack = _stack()
+        span = Span(name, persona)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            self._finish(span, stack[-1] if len(stack) > 0 else None, memory)
+
+    def _finish(self, span: Span, parent: Span, memory):
+        end = time.perf_counter()
+        duration = end - span.start
+        with _counter_lock:
+            total = {key: span.own[key] + span.children[key] for key in COUNTERS}
+            if parent is not None:
+                parent.child_time += duration
+                for key in COUNTERS:
+                    parent.children[key] += total[key]
+        record = (
+            span.name,
+            span.persona,
+            self.phase,
+            self.num_round,
+            span.start - self.start,
+            duration,
+            duration - span.child_time,
+            total,
+            dict(span.own),
+            len(memory) if memory is not None else None,
+        )
+        with self._lock:
+            self.records.append(record)
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: The stats of every span name, overall and per persona, phase and
+            round, and the memory size of every persona at the end of each round.
+        """
+        groups = {
+            "components": defaultdict(_empty_stats),
+            "personas": defaultdict(lambda: defaultdict(_empty_stats)),
+            "phases": defaultdict(lambda: defaultdict(_empty_stats)),
+            "rounds": defaultdict(lambda: defaultdict(_empty_stats)),
+        }
+        memory_size = defaultdict(dict)
+        with self._lock:
+            records = list(self.records)
+        for (
+            name,
+            persona,
+            phase,
+            num_round,
+            _,
+            duration,
+            self_time,
+            total,
+            own,
+            size,
+        ) in records:
+            for stats in [
+                groups["components"][name],
+                groups["personas"][str(persona)][name],
+                groups["phases"][str(phase)][name],
+                groups["rounds"][str(num_round)][name],
+            ]:
+                stats["calls"] += 1
+                stats["wall_time_s"] += duration
+                stats["self_time_s"] += self_time
+                for key in COUNTERS:
+                    stats[key] += total[key]
+                    stats[f"self_{key}"] += own[key]
+            if size is not None and persona is not None:
+                memory_size[persona][str(num_round)] = size
+
+        def to_dict(value):
+            if isinstance(value, defaultdict):
+                return {key: to_dict(v) for key, v in value.items()}
+            return value
+
+        return {
+            "wall_time_s": time.perf_counter() - self.start,
+            **{key: to_dict(value) for key, value in groups.items()},
+            "memory_size": dict(memory_size),
+        }
+
+    def chrome_trace(self) -> dict:
+        """
+        Returns:
+            dict: The spans in the Chrome trace event format, one track per persona.
+        """
+        with self._lock:
+            records = list(self.records)
+        tids = {}
+        events = []
+        for (
+            name,
+            persona,
+            phase,
+            num_round,
+            start,
+            duration,
+            _,
+            total,
+            _,
+            size,
+        ) in records:
+            if persona not in tids:
+                tids[persona] = len(tids) + 1
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": 1,
+                        "tid": tids[persona],
+                        "args": {"name": str(persona)},
+                    }
+                )
+            events.append(
+                {
+                    "name": name,
+                    "cat": str(phase),
+                    "ph": "X",
+                    "ts": start * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": 1,
+                    "tid": tids[persona],
+                    "args": {"phase": phase, "round": num_round, **total},
+                }
+            )
+            if size is not None:
+                events.append(
+                    {
+                        "name": f"memory_size {persona}",
+                        "ph": "C",
+                        "ts": (start + duration) * 1e6,
+                        "pid": 1,
+                        "args": {"nodes": size},
+                    }
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path: str):
+        """
+        Write profile.json and profile_trace.json to the folder path.
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "profile.json"), "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        with open(os.path.join(path, "profile_trace.json"), "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def profiled(method):
+    """
+    Record the calls of a Component method in the profiler of its model, if any.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        profiler = getattr(self.model, "profiler", None)
+        if profiler is None:
+            return method(self, *args, **kwargs)
+        persona = getattr(self, "persona", None)
+        with profiler.span(
+            f"{type(self).__name__}.{method.__name__}",
+            persona=getattr(persona, "agent_id", None),
+            memory=getattr(persona, "memory", None),
+        ):
+            return method(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,261 @@
+import hashlib
+import html
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+VOCABULARY = (
+    "we should catch fewer fish this month so that the lake can recover and every"
+    " fisherman keeps earning in the long run I agree with the plan to share the"
+    " resource fairly among us and to respect the limit we discussed together"
+).split()
+
+
+def _literal_for_regex(regex: str) -> str:
+    """
+    A string matching the first alternative of a regex made of literals, e.g.
+    "Answer:" for r"Answer:|So, the answer is:". Empty if there is none.
+    """
+    first = regex.split("|")[0]
+    literal = re.sub(r"\\(.)", r"\1", first)
+    if re.fullmatch(regex, literal):
+        return literal
+    return ""
+
+
+class ScriptedBackend:
+    """
+    Deterministic local stand-in for an LLM, used to benchmark the framework
+    without a GPU or an API.
+
+    Responses depend only on the seed and on the prompt, so a run is reproducible
+    also when calls happen in parallel. They honour the constraints of the call:
+    - gen: random words, cut before the first match of stop_regex
+    - find: a value that fully matches regex (numbers are drawn in number_range)
+    - select: one of the options
+    Fixed responses can be scripted per variable name with responses.
+
+    Each call sleeps latency_ms (+ up to latency_jitter_ms) plus ms_per_token for
+    each generated token. Token counts are word counts.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        latency_ms: float = 0.0,
+        latency_jitter_ms: float = 0.0,
+        ms_per_token: float = 0.0,
+        gen_tokens: tuple[int, int] = (20, 80),
+        number_range: tuple[int, int] = (0, 20),
+        responses: dict[str, list[str]] = None,
+        model_name: str = "scripted",
+    ) -> None:
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.ms_per_token = ms_per_token
+        self.gen_tokens = tuple(gen_tokens)
+        self.number_range = tuple(number_range)
+        self.responses = dict(responses or {})
+        self.model_name = model_name
+
+        self._lock = threading.Lock()
+        self.num_calls = Counter()
+        self.token_usage_in = 0
+        self.token_usage_out = 0
+
+    def _rng(self, kind: str, name: str, prompt: str) -> np.random.RandomState:
+        digest = hashlib.sha256(
+            f"{self.seed}\0{kind}\0{name}\0{prompt}".encode("utf-8")
+        ).digest()
+        return np.random.RandomState(int.from_bytes(digest[:4], "little"))
+
+    def _scripted(self, rng: np.random.RandomState, name: str) -> str:
+        options = self.responses.get(name)
+        if not options:
+            return None
+        return str(options[rng.randint(len(options))])
+
+    def _wait(self, rng: np.random.RandomState, num_tokens: int):
+        delay_ms = (
+            self.latency_ms
+            + self.latency_jitter_ms * rng.uniform()
+            + self.ms_per_token * num_tokens
+        )
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def _record(self, kind: str, prompt: str, text: str) -> tuple[int, int]:
+        token_in = len(prompt.split())
+        token_out = len(text.split())
+        with self._lock:
+            self.num_calls[kind] += 1
+            self.token_usage_in += token_in
+            self.token_usage_out += token_out
+        return token_in, token_out
+
+    def gen(
+        self,
+        prompt: str,
+        name: str,
+        max_tokens: int = 1000,
+        stop_regex: str = None,
+        save_stop_text=False,
+    ) -> tuple[str, str]:
+        """
+        Returns:
+            tuple[str, str]: The value of the variable and the text appended to the
+            prompt.
+        """
+        rng = self._rng("gen", name, prompt)
+        value = self._scripted(rng, name)
+        if value is None:
+            num_words = rng.randint(self.gen_tokens[0], self.gen_tokens[1] + 1)
+            num_words = min(num_words, max_tokens)
+            value = " ".join(rng.choice(VOCABULARY, num_words))
+        text = value
+        if stop_regex is not None:
+            match = re.search(stop_regex, value)
+            if match is not None:
+                value = value[: match.start()]
+            text = value
+            if save_stop_text:
+                text += _literal_for_regex(stop_regex)
+        self._wait(rng, len(text.split()))
+        return value, text
+
+    def find(self, prompt: str, name: str, regex: str) -> str:
+        rng = self._rng("find", name, prompt)
+        value = self._scripted(rng, name)
+        if value is None:
+            candidates = [
+                str(rng.randint(self.number_range[0], self.number_range[1] + 1)),
+                "yes",
+                "no",
+                str(rng.choice(VOCABULARY)),
+            ]
+            value = next(
+                (c for c in candidates if regex is None or re.fullmatch(regex, c)),
+                None,
+            )
+        if value is None:
+            raise ValueError(f"Scripted model cannot produce a match for {regex}")
+        self._wait(rng, 1)
+        return value
+
+    def select(self, prompt: str, name: str, options: list[str]) -> str:
+        rng = self._rng("select", name, prompt)
+        value = self._scripted(rng, name)
+        if value not in options:
+            value = options[rng.randint(len(options))]
+        self._wait(rng, 1)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": dict(self.num_calls),
+                "token_usage_in": self.token_usage_in,
+                "token_usage_out": self.token_usage_out,
+            }
+
+
+class ScriptedModel:
+    """
+    Prompt state on top of a ScriptedBackend, with the parts of the pathfinder
+    Model interface used by ModelWandbWrapper: adding text, named variables,
+    html(), token counts of the last call. ModelWandbWrapper runs the calls with
+    its gen/find/select methods instead of adding pathfinder calls, see scripted.
+    """
+
+    scripted = True
+
+    def __init__(
+        self,
+        backend: ScriptedBackend,
+        text: str = "",
+        variables: dict = None,
+        token_in: int = 0,
+        token_out: int = 0,
+    ) -> None:
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.text = text
+        self.variables = dict(variables or {})
+        self.token_in = token_in
+        self.token_out = token_out
+
+    @classmethod
+    def from_config(cls, seed: int, cfg) -> "ScriptedModel":
+        return cls(ScriptedBackend(seed=seed, **cfg))
+
+    def _copy(self, text=None, variables=None, token_in=0, token_out=0):
+        return ScriptedModel(
+            self.backend,
+            self.text if text is None else text,
+            self.variables if variables is None else variables,
+            token_in,
+            token_out,
+        )
+
+    def __add__(self, other: str) -> "ScriptedModel":
+        if not isinstance(other, str):
+            raise TypeError(
+                f"ScriptedModel only adds text, got {type(other).__name__}"
+            )
+        return self._copy(text=self.text + other)
+
+    def __getitem__(self, name: str):
+        return self.variables[name]
+
+    def set(self, name: str, value) -> "ScriptedModel":
+        return self._copy(variables={**self.variables, name: value})
+
+    def _current_prompt(self) -> str:
+        return self.text
+
+    def html(self) -> str:
+        return f"<pre style='margin: 0px; padding: 0px;'>{html.escape(self.text)}</pre>"
+
+    def _with_result(self, kind: str, name: str, value: str, text: str):
+        prompt = self.text
+        token_in, token_out = self.backend._record(kind, prompt, text)
+        return self._copy(
+            text=prompt + text,
+            variables={**self.variables, name: value},
+            token_in=token_in,
+            token_out=token_out,
+        )
+
+    def gen(
+        self,
+        name=None,
+        max_tokens=1000,
+        stop_regex=None,
+        save_stop_text=False,
+        temperature=None,
+        top_p=None,
+    ) -> "ScriptedModel":
+        value, text = self.backend.gen(
+            self.text, name, max_tokens, stop_regex, save_stop_text
+        )
+        return self._with_result("gen", name, value, text)
+
+    def find(
+        self,
+        name=None,
+        max_tokens=100,
+        regex=None,
+        stop_regex=None,
+        temperature=None,
+        top_p=None,
+    ) -> "ScriptedModel":
+        value = self.backend.find(self.text, name, regex)
+        return self._with_result("find", name, value, value)
+
+    def select(self, options, name=None) -> "ScriptedModel":
+        value = self.backend.select(self.text, name, list(options))
+        return self._with_result("select", name, value, value)
@@ -0,0 +1,143 @@
+import atexit
+import gzip
+import os
+import queue
+import threading
+
+VERBOSITY = {
+    "full": {"prompt", "response"},
+    "responses": {"response"},
+    "none": set(),
+}
+COMPRESSION_SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class TranscriptWriter:
+    """
+    Writes the prompts and responses of the LLM calls to a text file from a
+    background thread, so that a call only pays for queueing its messages.
+
+    The queue is bounded: when the disk cannot keep up, the calls wait instead of
+    the memory growing. The file is flushed whenever the queue is empty and closed
+    at exit, also after an uncaught exception.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        verbosity: str = "full",
+        echo: bool = False,
+        compression: str = None,
+        max_size_mb: float = None,
+        queue_size: int = 1024,
+        resume: bool = False,
+    ) -> None:
+        """
+        Args:
+            path (str): File of the transcript, the compression suffix is added.
+            verbosity (str): "full" for prompts and responses, "responses" for the
+                responses only, "none" to write nothing.
+            echo (bool): Also print the messages to the console.
+            compression (str): None, "gzip" or "zstd" (needs zstandard).
+            max_size_mb (float): Continue in a new file, <name>.1.txt and so on,
+                once this many uncompressed MB have been written to the current one.
+            queue_size (int): Messages waiting to be written.
+            resume (bool): Keep the files already written, e.g. by the run being
+                resumed, and continue in the first part that does not exist yet.
+        """
+        if verbosity not in VERBOSITY:
+            raise ValueError(f"Unknown transcript verbosity {verbosity}")
+        if compression not in COMPRESSION_SUFFIX:
+            raise ValueError(f"Unknown transcript compression {compression}")
+        if compression == "zstd":
+            import zstandard  # fail now rather than in the writer thread
+
+        self.root, self.ext = os.path.splitext(path)
+        self.path = path + COMPRESSION_SUFFIX[compression]
+        self.kinds = VERBOSITY[verbosity]
+        self.echo = echo
+        self.compression = compression
+        self.max_bytes = max_size_mb * 1024**2 if max_size_mb is not None else None
+
+        self._queue: queue.Queue[str] = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._part = 0
+        if resume:
+            while os.path.exists(self._part_path(self._part)):
+                self._part += 1
+        self._part_bytes = 0
+        self._closed = False
+        self._thread = None
+        if len(self.kinds) > 0:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _part_path(self, part: int) -> str:
+        if part == 0:
+            return self.path
+        return f"{self.root}.{part}{self.ext}{COMPRESSION_SUFFIX[self.compression]}"
+
+    def _open(self, path: str):
+        if self.compression == "gzip":
+            return gzip.open(path, "wb")
+        elif self.compression == "zstd":
+            import zstandard
+
+            return zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+        return open(path, "wb")
+
+    def _write(self, message: str):
+        if self.echo:
+            print(message)
+        data = (message + "\n").encode("utf-8")
+        if (
+            self._file is not None
+            and self.max_bytes is not None
+            and self._part_bytes > 0
+            and self._part_bytes + len(data) > self.max_bytes
+        ):
+            self._file.close()
+            self._file = None
+            self._part += 1
+        if self._file is None:
+            self._file = self._open(self._part_path(self._part))
+            self._part_bytes = 0
+        self._file.write(data)
+        self._part_bytes += len(data)
+
+    def _loop(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            try:
+                self._write(message)
+                if self._queue.empty() and self._file is not None:
+                    self._file.flush()
+            except Exception as e:
+                # losing the transcript must not stop the simulation
+                print(f"Failed to write the LLM transcript {self.path}: {e}")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write(self, message: str, kind: str = "response"):
+        """
+        Args:
+            kind (str): "prompt" or "response", filtered by the verbosity.
+        """
+        if kind in self.kinds and not self._closed:
+            self._queue.put(message)
+
+    def close(self):
+        """
+        Write the queued messages and close the file.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            atexit.unregister(self.close)
@@ -14,7 +14,12 @@ from transformers import set_seed
 
 import wandb
 from simulation.persona.common import PersonaIdentity
-from simulation.utils import ModelWandbWrapper, WandbLogger
+from simulation.utils import (
+    LLMCache,
+    ModelWandbWrapper,
+    ScriptedModel,
+    WandbLogger,
+)
 from pathfinder import get_model
 
 
@@ -23,7 +28,12 @@ def main(cfg: DictConfig):
     print(OmegaConf.to_yaml(cfg))
     set_seed(cfg.seed)
 
-    model = get_model(cfg.llm.path, cfg.llm.is_api, cfg.seed, cfg.llm.backend)
+    if cfg.llm.backend == "scripted":
+        model = ScriptedModel.from_config(
+            cfg.seed, OmegaConf.to_container(cfg.llm.scripted)
+        )
+    else:
+        model = get_model(cfg.llm.path, cfg.llm.is_api, cfg.seed, cfg.llm.backend)
     logger = WandbLogger(
         f"subskills_check/pollution/{cfg.code_version}",
         OmegaConf.to_object(cfg),
@@ -35,6 +45,7 @@ def main(cfg: DictConfig):
         f"./results/subskills_check_{cfg.code_version}/{logger.run_name}",
     )
     os.makedirs(experiment_storage, exist_ok=True)
+    logger.set_log_dir(os.path.join(experiment_storage, "chain_logs"))
 
     wrapper = ModelWandbWrapper(
         model,
@@ -44,6 +55,12 @@ def main(cfg: DictConfig):
         top_p=cfg.llm.top_p,
         seed=cfg.seed,
         is_api=cfg.llm.is_api,
+        cache=(
+            LLMCache(cfg.llm.cache, max_size_bytes=cfg.llm.cache_max_size_mb * 1024**2)
+            if cfg.llm.cache is not None
+            else None
+        ),
+        transcript_options=OmegaConf.to_container(cfg.llm.transcript),
     )
 
     if cfg.llm.out_format == "freeform":
@@ -513,6 +530,9 @@ def main(cfg: DictConfig):
     for test_case in tqdm.tqdm(test_cases):
         test_case.run()
 
+    if wrapper.cache is not None:
+        print(f"LLM cache: {wrapper.cache.stats()}")
+
 
 if __name__ == "__main__":
     OmegaConf.register_resolver("uuid", lambda: f"run_{uuid.uuid4()}")